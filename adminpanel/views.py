@@ -9,6 +9,7 @@ from django.db.models import Q,Avg,Count,Sum,Min,Max,F
 from django.utils.crypto import get_random_string
 from django.views.decorators.http import require_http_methods
 from products.models import Product, ProductVariant, ProductImage, SubCategory, Offer
+from products.search import search_products
 from products.forms import ProductForm, ProductVarientForm
 from shop.models import  Order, ReturnRequest, OrderItem
 from .decorator import admin_required
@@ -28,6 +29,7 @@ from wallet.utils import credit_wallet
 from django.db.models import IntegerField
 from django.db.models.functions import Cast
 from django.http import JsonResponse
+from payments.gateway import get_gateway
 import json
 from support.models import SupportTicket, SupportMessage
 from support.views import get_ticket_safe
@@ -356,11 +358,7 @@ def product_list_view(request):
 
 
     if query:
-        products = products.filter(
-            Q(name__icontains=query) |
-            Q(color__icontains=query) |
-            Q(category__icontains=query)
-        )
+        products = search_products(products, query)
 
 
     sort_by = request.GET.get("sort","")
@@ -381,6 +379,8 @@ def product_list_view(request):
         products = products.order_by("-created_at")
     elif sort_by == "oldest":
         products = products.order_by("created_at")
+    elif query:
+        products = products.order_by("-search_rank", "-id")
     else:
         products = products.order_by("-id")
 
@@ -1055,6 +1055,7 @@ def admin_offer_add(request):
                 discount_percent = discount,
                 start_date = start_date,
                 end_date = end_date,
+                is_flash_sale = "is_flash_sale" in request.POST,
             )
 
             offer.products.set(product_ids)
@@ -1078,6 +1079,7 @@ def admin_offer_add(request):
                     discount_percent = discount,
                     start_date = start_date,
                     end_date = end_date,
+                    is_flash_sale = "is_flash_sale" in request.POST,
                 )
 
                 
@@ -1099,6 +1101,7 @@ def admin_offer_edit(request, offer_id):
     if request.method == "POST":
         offer.title = request.POST.get("title")
         offer.discount_percent = request.POST.get("discount")
+        offer.is_flash_sale = "is_flash_sale" in request.POST
         
 
         start = request.POST.get("start_date")
@@ -1663,3 +1666,7 @@ def admin_banner_manager(request):
     return render(request, 'adminpanel/banner_manager.html', context)
 
 
+@admin_required
+def admin_gateway_stats(request):
+    """Payment gateway latency histograms and circuit state, as seen by the process serving this request."""
+    return JsonResponse(get_gateway().stats())
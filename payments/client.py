@@ -0,0 +1,219 @@
+import logging
+import random
+import threading
+import time
+import razorpay
+import requests
+from requests.adapters import HTTPAdapter
+
+
+logger = logging.getLogger(__name__)
+
+# latency histogram bucket upper bounds, in milliseconds
+LATENCY_BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+# seconds to open a connection, the read timeout comes from settings.PAYMENT_GATEWAY_TIMEOUT
+CONNECT_TIMEOUT = 3.05
+
+# idempotent calls are tried this many times in all, waiting a random part of an exponential backoff in between
+MAX_ATTEMPTS = 3
+RETRY_BASE_DELAY = 0.2
+RETRY_MAX_DELAY = 2
+
+# consecutive failures that open the circuit, and seconds until a trial call is let through
+BREAKER_THRESHOLD = 5
+BREAKER_RESET_AFTER = 30
+
+# failures that say nothing about the request itself, worth a retry and counted against the gateway
+TRANSIENT_ERRORS = (
+    requests.ConnectionError,
+    requests.Timeout,
+    razorpay.errors.ServerError,
+    razorpay.errors.GatewayError,
+)
+
+
+class GatewayError(Exception):
+    """The gateway could not be reached or refused the call."""
+
+
+class GatewayUnavailable(GatewayError):
+    """The circuit is open, the call was not attempted."""
+
+
+class SignatureError(GatewayError):
+    """A payment's signature does not match its order, the payment must not be trusted."""
+
+
+class OrderNotPaid(GatewayError):
+    """The gateway holds no captured payment for the order, whatever the browser sent."""
+
+
+class LatencyHistogram:
+    """Call latencies counted in fixed buckets, cheap enough to record every call."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.calls = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def observe(self, seconds, ok=True):
+        ms = seconds * 1000
+        bucket = next((i for i, bound in enumerate(LATENCY_BUCKETS) if ms <= bound), len(LATENCY_BUCKETS))
+        with self.lock:
+            self.counts[bucket] += 1
+            self.calls += 1
+            self.errors += not ok
+            self.total_ms += ms
+            self.max_ms = max(self.max_ms, ms)
+
+    def percentile(self, fraction):
+        """Upper bound of the bucket holding this fraction of calls, in milliseconds, at most the slowest call."""
+        if not self.calls:
+            return None
+        rank = fraction * self.calls
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and i < len(LATENCY_BUCKETS):
+                return min(LATENCY_BUCKETS[i], round(self.max_ms, 1))
+        return round(self.max_ms, 1)
+
+    def snapshot(self):
+        with self.lock:
+            labels = [f"<={bound}ms" for bound in LATENCY_BUCKETS] + [f">{LATENCY_BUCKETS[-1]}ms"]
+            return {
+                "calls": self.calls,
+                "errors": self.errors,
+                "mean_ms": round(self.total_ms / self.calls, 1) if self.calls else None,
+                "p50_ms": self.percentile(0.5),
+                "p95_ms": self.percentile(0.95),
+                "p99_ms": self.percentile(0.99),
+                "max_ms": round(self.max_ms, 1),
+                "buckets": dict(zip(labels, self.counts)),
+            }
+
+
+class CircuitBreaker:
+    """
+    Opens after BREAKER_THRESHOLD consecutive failures, so calls fail at once
+    instead of tying up web workers on a degraded gateway. After BREAKER_RESET_AFTER
+    seconds a single trial call is let through, its outcome closes or reopens it.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, threshold=BREAKER_THRESHOLD, reset_after=BREAKER_RESET_AFTER):
+        self.threshold = threshold
+        self.reset_after = reset_after
+        self.lock = threading.Lock()
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+
+    def allow(self):
+        with self.lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_after:
+                self.state = self.HALF_OPEN
+                return True
+            # open, or half open with the trial call still in flight
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.threshold:
+                if self.state != self.OPEN:
+                    logger.warning("Payment gateway circuit opened after %s failures", self.failures)
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+    def snapshot(self):
+        with self.lock:
+            return {"state": self.state, "failures": self.failures}
+
+
+def pooled_session(pool_size):
+    """A requests session keeping up to pool_size connections alive, retries are left to GatewayClient."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def backoff(attempt):
+    # full jitter, concurrent retries spread out instead of hitting the gateway together
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+
+
+class GatewayClient:
+    """
+    Every call this process makes to one payment gateway goes through call(),
+    which applies the timeout, retries idempotent calls, trips the circuit
+    breaker and records a latency histogram per operation.
+    """
+
+    def __init__(self, name, read_timeout):
+        self.name = name
+        self.timeout = (CONNECT_TIMEOUT, read_timeout)
+        self.breaker = CircuitBreaker()
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    def histogram(self, operation):
+        with self.lock:
+            return self.histograms.setdefault(operation, LatencyHistogram())
+
+    def call(self, operation, request, idempotent=False, timeout=None):
+        """
+        Runs request(timeout) and returns its result. Raises GatewayUnavailable
+        while the circuit is open, GatewayError when the call fails.
+        """
+        timeout = timeout or self.timeout
+        histogram = self.histogram(operation)
+        attempts = MAX_ATTEMPTS if idempotent else 1
+
+        for attempt in range(attempts):
+            if not self.breaker.allow():
+                raise GatewayUnavailable(f"{self.name} is degraded, {operation} not attempted")
+
+            started = time.monotonic()
+            try:
+                result = request(timeout)
+            except TRANSIENT_ERRORS as e:
+                histogram.observe(time.monotonic() - started, ok=False)
+                self.breaker.record_failure()
+                if attempt + 1 == attempts:
+                    raise GatewayError(f"{self.name} {operation} failed: {e}") from e
+                time.sleep(backoff(attempt))
+            except Exception as e:
+                # the gateway answered and refused, it is up
+                histogram.observe(time.monotonic() - started, ok=False)
+                self.breaker.record_success()
+                raise GatewayError(f"{self.name} {operation} refused: {e}") from e
+            else:
+                histogram.observe(time.monotonic() - started)
+                self.breaker.record_success()
+                return result
+
+    def stats(self):
+        with self.lock:
+            histograms = dict(self.histograms)
+        return {
+            "gateway": self.name,
+            "circuit": self.breaker.snapshot(),
+            "operations": {operation: histogram.snapshot() for operation, histogram in histograms.items()},
+        }
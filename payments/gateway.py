@@ -0,0 +1,146 @@
+import hashlib
+import hmac
+import itertools
+import threading
+import time
+import razorpay
+import requests
+from django.conf import settings
+from django.utils.module_loading import import_string
+from .client import GatewayClient, GatewayError, OrderNotPaid, SignatureError, pooled_session
+
+
+class RazorpayGateway:
+    """
+    The live gateway. Amounts are in paise, orders are the dicts Razorpay returns.
+    One SDK client per process over a pool of kept-alive connections.
+    """
+
+    def __init__(self):
+        self.key_id = settings.RAZORPAY_KEY_ID
+        self.client = GatewayClient("razorpay", settings.PAYMENT_GATEWAY_TIMEOUT)
+        self.razorpay = razorpay.Client(
+            session=pooled_session(settings.PAYMENT_GATEWAY_POOL_SIZE),
+            auth=(settings.RAZORPAY_KEY_ID, settings.RAZORPAY_KEY_SECRET),
+        )
+
+    def create_order(self, amount, currency="INR", receipt=None):
+        data = {"amount": amount, "currency": currency, "payment_capture": 1}
+        if receipt:
+            data["receipt"] = receipt
+        # not retried, a create that timed out may still have made the order
+        return self.client.call("create_order", lambda timeout: self.razorpay.order.create(data, timeout=timeout))
+
+    def fetch_order(self, order_id):
+        return self.client.call(
+            "fetch_order", lambda timeout: self.razorpay.order.fetch(order_id, timeout=timeout), idempotent=True,
+        )
+
+    def verify_payment_signature(self, order_id, payment_id, signature):
+        # a local HMAC check, no request is made
+        try:
+            self.razorpay.utility.verify_payment_signature({
+                "razorpay_order_id": order_id,
+                "razorpay_payment_id": payment_id,
+                "razorpay_signature": signature,
+            })
+        except razorpay.errors.SignatureVerificationError as e:
+            raise SignatureError(str(e)) from e
+
+    def stats(self):
+        return self.client.stats()
+
+
+class FakeGateway:
+    """
+    Answers like Razorpay without leaving the process, for tests and benchmarks,
+    through the same GatewayClient as the live gateway. Signatures are Razorpay's
+    HMAC of "order_id|payment_id", sign() makes valid ones and pay() also marks
+    the order paid, as a completed checkout does.
+    """
+
+    key_id = "rzp_test_fake"
+
+    def __init__(self, secret="fake-secret", latency=0, down=False):
+        self.secret = secret
+        # seconds each call sleeps, to stand in for a network round trip
+        self.latency = latency
+        # set to make every call fail as if the gateway could not be reached
+        self.down = down
+        self.client = GatewayClient("fake", settings.PAYMENT_GATEWAY_TIMEOUT)
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.orders = {}
+
+    def _respond(self, timeout):
+        if self.latency:
+            time.sleep(min(self.latency, timeout[1]))
+            if self.latency > timeout[1]:
+                raise requests.Timeout(f"Fake gateway did not answer within {timeout[1]}s")
+        if self.down:
+            raise requests.ConnectionError("Fake gateway is down")
+
+    def create_order(self, amount, currency="INR", receipt=None):
+        def create(timeout):
+            self._respond(timeout)
+            with self.lock:
+                order_id = f"order_fake{next(self.ids):010d}"
+                order = {
+                    "id": order_id, "entity": "order", "amount": amount,
+                    "currency": currency, "receipt": receipt, "status": "created",
+                }
+                self.orders[order_id] = order
+            return order
+
+        return self.client.call("create_order", create)
+
+    def fetch_order(self, order_id):
+        def fetch(timeout):
+            self._respond(timeout)
+            return self.orders[order_id]
+
+        return self.client.call("fetch_order", fetch, idempotent=True)
+
+    def sign(self, order_id, payment_id):
+        return hmac.new(self.secret.encode(), f"{order_id}|{payment_id}".encode(), hashlib.sha256).hexdigest()
+
+    def pay(self, order_id, payment_id):
+        """Captures the order's amount and returns the signature checkout hands the browser."""
+        with self.lock:
+            order = self.orders[order_id]
+            order.update(status="paid", amount_paid=order["amount"])
+        return self.sign(order_id, payment_id)
+
+    def verify_payment_signature(self, order_id, payment_id, signature):
+        if not hmac.compare_digest(self.sign(order_id, payment_id), signature or ""):
+            raise SignatureError("Razorpay Signature Verification Failed")
+
+    def stats(self):
+        return self.client.stats()
+
+
+_gateway = None
+_gateway_lock = threading.Lock()
+
+
+def confirm_payment(order_id, payment_id, signature):
+    """
+    Checks the payment the browser reports: its signature, then that the gateway
+    captured the order, since a signature alone only shows checkout was completed.
+    Raises SignatureError or OrderNotPaid when it must not be trusted, GatewayError
+    when the gateway could not be asked.
+    """
+    gateway = get_gateway()
+    gateway.verify_payment_signature(order_id, payment_id, signature)
+    order = gateway.fetch_order(order_id)
+    if order["status"] != "paid":
+        raise OrderNotPaid(f"Order {order_id} is {order['status']}")
+
+
+def get_gateway():
+    """The gateway named by settings.PAYMENT_GATEWAY, one instance per process."""
+    global _gateway
+    with _gateway_lock:
+        if _gateway is None:
+            _gateway = import_string(settings.PAYMENT_GATEWAY)()
+        return _gateway
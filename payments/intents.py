@@ -0,0 +1,143 @@
+import hashlib
+import json
+import math
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+from .gateway import get_gateway
+from .models import Payment
+
+
+# A payment intent is the gateway order for one exact thing to pay for: the same
+# user, purpose, lines, coupon and amount get the same intent key, so reloading a
+# payment page or submitting it twice reuses the order instead of creating another.
+
+CURRENCY = "INR"
+
+# how long a request waits for another one creating the same intent
+INTENT_LOCK_TTL = 10
+INTENT_LOCK_WAIT = 2
+
+
+class PaymentIntent:
+    __slots__ = ("payment_id", "order_id", "amount", "currency", "expires_at")
+
+    def __init__(self, payment_id, order_id, amount, currency, expires_at):
+        self.payment_id = payment_id
+        self.order_id = order_id
+        # paise
+        self.amount = amount
+        self.currency = currency
+        self.expires_at = expires_at
+
+    def __getstate__(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+
+    @classmethod
+    def for_payment(cls, payment):
+        return cls(payment.id, payment.razorpay_order_id, to_paise(payment.amount), CURRENCY, payment.intent_expires_at)
+
+    @property
+    def order(self):
+        """The gateway order as the checkout templates read it."""
+        return {"id": self.order_id, "amount": self.amount, "currency": self.currency}
+
+
+def to_paise(amount):
+    return int(amount * 100)
+
+
+def intent_key(user_id, purpose, amount, lines=(), coupon_code=None):
+    """sha256 over everything that decides what the customer is paying for."""
+    payload = json.dumps(
+        [user_id, purpose, str(amount), sorted(lines), coupon_code or ""],
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _cache_key(key):
+    return f"payment:intent:{key}"
+
+
+def _remember(key, intent):
+    ttl = math.floor((intent.expires_at - timezone.now()).total_seconds())
+    if ttl > 0:
+        cache.set(_cache_key(key), intent, ttl)
+
+
+def _reusable(user, key):
+    now = timezone.now()
+    intent = cache.get(_cache_key(key))
+    if intent is not None and intent.expires_at > now:
+        return intent
+
+    payment = (
+        Payment.objects.filter(user=user, intent_key=key, status="PENDING", intent_expires_at__gt=now)
+        .exclude(razorpay_order_id=None)
+        .order_by("-id")
+        .first()
+    )
+    if payment is None:
+        return None
+    intent = PaymentIntent.for_payment(payment)
+    _remember(key, intent)
+    return intent
+
+
+def get_payment_intent(user, amount, purpose, lines=(), coupon_code=None):
+    """
+    The pending Payment and gateway order for paying `amount`, reused while it has
+    not expired, been paid or failed. `lines` are hashable tuples describing what is
+    bought. Raises GatewayError when a new order is needed and the gateway fails.
+    """
+    key = intent_key(user.pk, purpose, amount, lines, coupon_code)
+    intent = _reusable(user, key)
+    if intent is not None:
+        return intent
+
+    # a second tab or a double submit waits for the first to create the order
+    lock = f"payment:intent:lock:{key}"
+    deadline = time.monotonic() + INTENT_LOCK_WAIT
+    while not (locked := cache.add(lock, 1, INTENT_LOCK_TTL)):
+        time.sleep(0.1)
+        intent = cache.get(_cache_key(key))
+        if intent is not None:
+            return intent
+        if time.monotonic() > deadline:
+            break
+
+    try:
+        if locked and (intent := _reusable(user, key)) is not None:
+            return intent
+
+        order = get_gateway().create_order(to_paise(amount), CURRENCY, receipt=key[:40])
+        payment = Payment.objects.create(
+            user=user,
+            amount=amount,
+            purpose=purpose,
+            razorpay_order_id=order["id"],
+            intent_key=key,
+            intent_expires_at=timezone.now() + timedelta(seconds=settings.PAYMENT_INTENT_TTL),
+        )
+        intent = PaymentIntent.for_payment(payment)
+        _remember(key, intent)
+        return intent
+    finally:
+        if locked:
+            cache.delete(lock)
+
+
+def forget_payment_intent(payment):
+    """Call once the payment succeeded or failed, its order must not be offered again."""
+    if not payment.intent_key:
+        return
+    Payment.objects.filter(id=payment.id).update(intent_expires_at=timezone.now())
+    transaction.on_commit(lambda: cache.delete(_cache_key(payment.intent_key)))
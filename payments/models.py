@@ -18,6 +18,9 @@ class Payment(models.Model):
     razorpay_signature = models.CharField(max_length=255, blank=True, null=True)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default="PENDING")
     purpose = models.CharField(max_length=50, default="wallet_topup")  # or 'order_payment'
+    # what is being paid for, hashed, and until when its gateway order is reused (payments.intents)
+    intent_key = models.CharField(max_length=64, blank=True, null=True, db_index=True)
+    intent_expires_at = models.DateTimeField(blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
@@ -1,3 +1,242 @@
-from django.test import TestCase
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from .client import MAX_ATTEMPTS, CircuitBreaker, GatewayError, GatewayUnavailable, LatencyHistogram
+from .gateway import FakeGateway
+from .intents import _cache_key, forget_payment_intent, get_payment_intent, intent_key
+from .models import Payment
 
-# Create your tests here.
+
+class PaymentIntentTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create(email="buyer@example.com", fullName="Buyer", referralCode="BUYER")
+        self.gateway = FakeGateway()
+        patcher = mock.patch("payments.intents.get_gateway", return_value=self.gateway)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.lines = [(1, 2), (7, 1)]
+
+    def intent(self, amount="2499.00", lines=None, coupon_code=None):
+        return get_payment_intent(
+            self.user, Decimal(amount), "order_payment", self.lines if lines is None else lines, coupon_code,
+        )
+
+    def test_the_same_checkout_reuses_its_order(self):
+        first = self.intent()
+        # the cached intent, then the pending payment once the cache lost it
+        second = self.intent()
+        cache.clear()
+        third = self.intent()
+
+        self.assertEqual({first.order_id, second.order_id, third.order_id}, {first.order_id})
+        self.assertEqual(first.order, {"id": first.order_id, "amount": 249900, "currency": "INR"})
+        self.assertEqual(len(self.gateway.orders), 1)
+        self.assertEqual(Payment.objects.count(), 1)
+
+    def test_lines_are_compared_in_any_order(self):
+        self.assertEqual(self.intent().order_id, self.intent(lines=list(reversed(self.lines))).order_id)
+
+    def test_a_changed_checkout_gets_a_new_order(self):
+        first = self.intent()
+        changed = [
+            self.intent(lines=[(1, 3), (7, 1)]),
+            self.intent(coupon_code="WELCOME10"),
+            self.intent(amount="2249.00"),
+        ]
+
+        order_ids = {first.order_id} | {intent.order_id for intent in changed}
+        self.assertEqual(len(order_ids), 4)
+        self.assertEqual(len(self.gateway.orders), 4)
+
+    def test_an_expired_intent_is_not_reused(self):
+        first = self.intent()
+        later = timezone.now() + timedelta(seconds=settings.PAYMENT_INTENT_TTL + 1)
+
+        with mock.patch("payments.intents.timezone.now", return_value=later):
+            second = self.intent()
+
+        self.assertNotEqual(second.order_id, first.order_id)
+        self.assertGreater(second.expires_at, later)
+
+    def test_a_finished_payment_is_not_offered_again(self):
+        first = self.intent()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            forget_payment_intent(Payment.objects.get(id=first.payment_id))
+
+        self.assertIsNone(cache.get(_cache_key(Payment.objects.get(id=first.payment_id).intent_key)))
+        self.assertNotEqual(self.intent().order_id, first.order_id)
+
+    def test_a_concurrent_request_waits_for_the_order_being_created(self):
+        key = intent_key(self.user.pk, "order_payment", Decimal("2499.00"), self.lines, None)
+        other = self.intent()
+        # as if another request still held the lock and had not cached its order yet
+        Payment.objects.all().delete()
+        cache.delete(_cache_key(key))
+        cache.add(f"payment:intent:lock:{key}", 1)
+        waited = []
+
+        def other_request_finishes(seconds):
+            waited.append(seconds)
+            cache.set(_cache_key(key), other)
+
+        with mock.patch("payments.intents.time.sleep", side_effect=other_request_finishes):
+            intent = self.intent()
+
+        self.assertEqual(waited, [0.1])
+        self.assertEqual(intent.order_id, other.order_id)
+        self.assertEqual(len(self.gateway.orders), 1)
+
+    def test_a_stuck_lock_is_waited_out(self):
+        key = intent_key(self.user.pk, "order_payment", Decimal("2499.00"), self.lines, None)
+        lock = f"payment:intent:lock:{key}"
+        cache.add(lock, 1)
+
+        with mock.patch("payments.intents.INTENT_LOCK_WAIT", 0), mock.patch("payments.intents.time.sleep"):
+            intent = self.intent()
+
+        self.assertEqual(list(self.gateway.orders), [intent.order_id])
+        # still held by the request that took it
+        self.assertEqual(cache.get(lock), 1)
+
+
+class CircuitBreakerTests(SimpleTestCase):
+
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch("payments.client.time.monotonic", side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.breaker = CircuitBreaker(threshold=2, reset_after=30)
+
+    def test_consecutive_failures_open_it(self):
+        self.breaker.record_failure()
+        self.breaker.record_success()
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+        self.breaker.record_failure()
+
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(self.breaker.allow())
+
+    def test_one_trial_call_is_let_through_after_reset_after(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.now += 29
+        self.assertFalse(self.breaker.allow())
+
+        self.now += 1
+        self.assertTrue(self.breaker.allow())
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+        # the trial call is still in flight
+        self.assertFalse(self.breaker.allow())
+
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.snapshot(), {"state": CircuitBreaker.CLOSED, "failures": 0})
+        self.assertTrue(self.breaker.allow())
+
+    def test_a_failed_trial_call_reopens_it(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.now += 30
+        self.assertTrue(self.breaker.allow())
+
+        self.breaker.record_failure()
+
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(self.breaker.allow())
+        self.now += 30
+        self.assertTrue(self.breaker.allow())
+
+
+@mock.patch("payments.client.time.sleep")
+class GatewayClientTests(SimpleTestCase):
+
+    def test_only_idempotent_calls_are_retried(self, sleep):
+        gateway = FakeGateway(down=True)
+
+        with self.assertRaises(GatewayError):
+            gateway.create_order(1000)
+        with self.assertRaises(GatewayError):
+            gateway.fetch_order("order_fake0000000001")
+
+        self.assertEqual(gateway.client.histogram("create_order").calls, 1)
+        self.assertEqual(gateway.client.histogram("fetch_order").calls, MAX_ATTEMPTS)
+        self.assertEqual(sleep.call_count, MAX_ATTEMPTS - 1)
+
+    def test_a_retry_that_succeeds_returns_its_result(self, sleep):
+        gateway = FakeGateway()
+        order = gateway.create_order(1000)
+        gateway.down = True
+        sleep.side_effect = lambda seconds: setattr(gateway, "down", False)
+
+        self.assertEqual(gateway.fetch_order(order["id"]), order)
+        self.assertEqual(gateway.client.histogram("fetch_order").snapshot()["errors"], 1)
+        self.assertEqual(gateway.client.breaker.failures, 0)
+
+    def test_a_refusal_is_not_retried_or_held_against_the_gateway(self, sleep):
+        gateway = FakeGateway()
+
+        with self.assertRaisesMessage(GatewayError, "refused"):
+            gateway.fetch_order("order_missing")
+
+        sleep.assert_not_called()
+        self.assertEqual(gateway.client.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_an_open_circuit_fails_without_calling_the_gateway(self, sleep):
+        gateway = FakeGateway(down=True)
+        gateway.client.breaker = CircuitBreaker(threshold=1)
+
+        with self.assertRaises(GatewayError):
+            gateway.create_order(1000)
+        gateway.down = False
+        with self.assertRaises(GatewayUnavailable):
+            gateway.create_order(1000)
+
+        self.assertEqual(gateway.orders, {})
+        self.assertEqual(gateway.client.histogram("create_order").calls, 1)
+
+    def test_the_read_timeout_reaches_the_request(self, sleep):
+        with override_settings(PAYMENT_GATEWAY_TIMEOUT=0.01):
+            gateway = FakeGateway(latency=0.05)
+        request = mock.Mock(return_value="ok")
+
+        with self.assertRaisesMessage(GatewayError, "did not answer within 0.01s"):
+            gateway.create_order(1000)
+        self.assertEqual(gateway.client.call("stats", request), "ok")
+        gateway.client.call("stats", request, timeout=(1, 5))
+
+        self.assertEqual([call.args for call in request.call_args_list], [(gateway.client.timeout,), ((1, 5),)])
+        self.assertEqual(gateway.client.timeout[1], 0.01)
+        self.assertEqual(gateway.orders, {})
+
+
+class LatencyHistogramTests(SimpleTestCase):
+
+    def test_percentile_is_the_upper_bound_of_its_bucket(self):
+        histogram = LatencyHistogram()
+        self.assertIsNone(histogram.percentile(0.5))
+
+        for ms in [3] * 50 + [40] * 45 + [700] * 4 + [20000]:
+            histogram.observe(ms / 1000)
+
+        self.assertEqual(histogram.percentile(0.5), 5)
+        self.assertEqual(histogram.percentile(0.95), 50)
+        self.assertEqual(histogram.percentile(0.99), 1000)
+        # past the last bucket, the slowest call
+        self.assertEqual(histogram.percentile(1), 20000)
+
+    def test_percentile_is_at_most_the_slowest_call(self):
+        histogram = LatencyHistogram()
+        histogram.observe(0.0012)
+
+        self.assertEqual(histogram.percentile(0.5), 1.2)
+        self.assertEqual(histogram.snapshot()["buckets"]["<=5ms"], 1)
@@ -0,0 +1,283 @@
+import threading
+import time
+import uuid
+from array import array
+from bisect import bisect_left, insort
+from django.core.cache import cache
+from .models import Product, ProductVariant
+
+
+BITMAP_VERSION_KEY = "catalog:bitmaps:version"
+
+# how often a process checks whether another process changed the catalog
+BITMAP_SYNC_INTERVAL = 30
+
+# sorts the index can order by itself, everything else goes to the database
+BITMAP_SORTS = {"", "new", "nameAsc", "nameDesc"}
+
+# (version, index, checked_at) for this process
+_local_index = (None, None, 0)
+
+
+def _bit(product_id):
+    return 1 << product_id
+
+
+class CatalogBitmaps:
+    """
+    One Python int per filter value, bit n set when active product n matches.
+    Any filter combination is a handful of AND/OR operations over the same
+    number of machine words, however many filters are applied.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.active = 0
+        self.in_stock = 0
+        self.categories = {}
+        self.subcategories = {}
+        self.colors = {}
+        self.sizes = {}
+
+        self.products = {}      # id -> (category, subcategory id, color, sizes, name, created_at)
+        self.by_name = []       # sorted (casefolded name, id)
+        self.by_created = []    # sorted (created_at, id)
+        self.orderings = {}     # sort -> (id list, position by id), rebuilt after changes
+
+    def _set(self, bitmaps, key, product_id):
+        bitmaps[key] = bitmaps.get(key, 0) | _bit(product_id)
+
+    def _clear(self, bitmaps, key, product_id):
+        bitmap = bitmaps.get(key, 0) & ~_bit(product_id)
+        if bitmap:
+            bitmaps[key] = bitmap
+        else:
+            bitmaps.pop(key, None)
+
+    def _remove(self, product_id):
+        old = self.products.pop(product_id, None)
+        if old is None:
+            return
+
+        category, subcategory_id, color, sizes, name, created_at = old
+        self.active &= ~_bit(product_id)
+        self.in_stock &= ~_bit(product_id)
+        self._clear(self.categories, category, product_id)
+        self._clear(self.subcategories, subcategory_id, product_id)
+        self._clear(self.colors, color, product_id)
+        for size in sizes:
+            self._clear(self.sizes, size, product_id)
+
+        for ordering, key in ((self.by_name, (name, product_id)), (self.by_created, (created_at, product_id))):
+            i = bisect_left(ordering, key)
+            if i < len(ordering) and ordering[i] == key:
+                del ordering[i]
+
+    def _add(self, product_id, category, subcategory_id, color, sizes, name, created_at, sort=True):
+        color = (color or "").strip().lower()
+        name = name.casefold()
+        sizes = tuple(sorted(sizes))
+        self.products[product_id] = (category, subcategory_id, color, sizes, name, created_at)
+
+        self.active |= _bit(product_id)
+        if sizes:
+            self.in_stock |= _bit(product_id)
+        self._set(self.categories, category, product_id)
+        self._set(self.subcategories, subcategory_id, product_id)
+        self._set(self.colors, color, product_id)
+        for size in sizes:
+            self._set(self.sizes, size, product_id)
+
+        if sort:
+            insort(self.by_name, (name, product_id))
+            insort(self.by_created, (created_at, product_id))
+        else:
+            self.by_name.append((name, product_id))
+            self.by_created.append((created_at, product_id))
+
+    def load(self, product_ids=None):
+        """(Re)loads the given products from the database, every product when None."""
+        products = Product.objects.filter(is_active=True)
+        variants = ProductVariant.objects.filter(is_active=True, stock__gt=0, product__is_active=True)
+        if product_ids is not None:
+            product_ids = set(product_ids)
+            products = products.filter(id__in=product_ids)
+            variants = variants.filter(product_id__in=product_ids)
+
+        sizes = {}
+        for product_id, size in variants.values_list("product_id", "size").iterator():
+            sizes.setdefault(product_id, set()).add(size)
+
+        rows = products.values_list("id", "category", "subcategory_id", "color", "name", "created_at")
+
+        with self.lock:
+            self.orderings = {}
+            for product_id in product_ids or ():
+                self._remove(product_id)
+
+            for product_id, category, subcategory_id, color, name, created_at in rows.iterator():
+                self._add(
+                    product_id, category, subcategory_id, color, sizes.get(product_id, ()),
+                    name, created_at, sort=product_ids is not None,
+                )
+
+            if product_ids is None:
+                self.by_name.sort()
+                self.by_created.sort()
+
+    def match(self, filters, sort=""):
+        """Active products passing the normalized filters (see shop.facets), in `sort` order."""
+        with self.lock:
+            mask = self.active
+            if filters["category"]:
+                mask &= self.categories.get(filters["category"].upper(), 0)
+            if filters["subcategory"]:
+                mask &= self.subcategories.get(filters["subcategory"], 0)
+            if filters["in_stock"]:
+                mask &= self.in_stock
+            if filters["sizes"]:
+                any_size = 0
+                for size in filters["sizes"]:
+                    any_size |= self.sizes.get(size, 0)
+                mask &= any_size
+            if filters["color"]:
+                # same as color__iexact
+                mask &= self.colors.get(filters["color"], 0)
+
+            return BitmapResult(mask, self._ordering(sort))
+
+    def _ordering(self, sort):
+        if sort not in self.orderings:
+            if sort == "nameAsc":
+                ids = [product_id for _, product_id in self.by_name]
+            elif sort == "nameDesc":
+                ids = [product_id for _, product_id in reversed(self.by_name)]
+            elif sort == "new":
+                ids = [product_id for _, product_id in reversed(self.by_created)]
+            else:
+                self.orderings[sort] = None
+                return None
+
+            positions = array("l", [0]) * (max(ids, default=0) + 1)
+            for position, product_id in enumerate(ids):
+                positions[product_id] = position
+            self.orderings[sort] = (ids, positions)
+        return self.orderings[sort]
+
+
+class BitmapResult:
+    """Ordered product ids behind a bitmap, sliceable like a queryset so Paginator can use it."""
+
+    # below this share of the catalog, sorting the matches beats walking the whole ordering
+    SORT_MATCHES_BELOW = 1 / 16
+
+    def __init__(self, mask, ordering=None):
+        self.mask = mask
+        self.ordering = ordering
+        self._bits = None
+        self._sorted = None
+
+    def count(self):
+        return self.mask.bit_count()
+
+    def __len__(self):
+        return self.count()
+
+    def _bits_string(self):
+        # bin() keeps the scans in C: bit n is at bits[len(bits) - 1 - n]
+        if self._bits is None:
+            self._bits = bin(self.mask)[2:] if self.mask else ""
+        return self._bits
+
+    def _descending_ids(self):
+        bits = self._bits_string()
+        top = len(bits) - 1
+        i = bits.find("1")
+        while i != -1:
+            yield top - i
+            i = bits.find("1", i + 1)
+
+    def _ids(self):
+        if self.ordering is None:
+            # default listing order, highest id first
+            yield from self._descending_ids()
+            return
+
+        ids, positions = self.ordering
+        if self.count() < len(ids) * self.SORT_MATCHES_BELOW:
+            if self._sorted is None:
+                self._sorted = sorted(self._descending_ids(), key=positions.__getitem__)
+            yield from self._sorted
+            return
+
+        bits = self._bits_string()
+        top = len(bits) - 1
+        for product_id in ids:
+            if product_id <= top and bits[top - product_id] == "1":
+                yield product_id
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            ids = []
+            start, stop = index.start or 0, index.stop
+            for i, product_id in enumerate(self._ids()):
+                if stop is not None and i >= stop:
+                    break
+                if i >= start:
+                    ids.append(product_id)
+            return ids[::index.step] if index.step else ids
+        return self[index:index + 1][0]
+
+
+def build_catalog_bitmaps():
+    index = CatalogBitmaps()
+    index.load()
+    return index
+
+
+def _shared_version():
+    version = cache.get(BITMAP_VERSION_KEY)
+    if version is None:
+        cache.add(BITMAP_VERSION_KEY, uuid.uuid4().hex, None)
+        version = cache.get(BITMAP_VERSION_KEY)
+    return version
+
+
+def get_catalog_bitmaps():
+    """
+    This process's index. Changes saved in this process are applied in place;
+    changes from other processes trigger a rebuild within BITMAP_SYNC_INTERVAL.
+    """
+    global _local_index
+    now = time.monotonic()
+
+    version, index, checked_at = _local_index
+    if index is not None and now - checked_at < BITMAP_SYNC_INTERVAL:
+        return index
+
+    shared_version = _shared_version()
+    if index is None or shared_version != version:
+        index = build_catalog_bitmaps()
+
+    _local_index = (shared_version, index, now)
+    return index
+
+
+def bitmaps_products_changed(product_ids):
+    """Call after product or variant changes, including bulk stock updates that skip save()."""
+    global _local_index
+    product_ids = set(product_ids)
+    if not product_ids:
+        return
+
+    version, index, checked_at = _local_index
+    shared_version = cache.get(BITMAP_VERSION_KEY)
+    new_version = uuid.uuid4().hex
+    cache.set(BITMAP_VERSION_KEY, new_version, None)
+
+    if index is not None and version == shared_version:
+        index.load(product_ids)
+        _local_index = (new_version, index, checked_at)
+    else:
+        # behind another process's changes, stamping it would hide them, rebuild on the next read
+        _local_index = (None, None, 0)
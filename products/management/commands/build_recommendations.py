@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from products.recommendations import rebuild_recommendations, update_recommendations
+
+
+class Command(BaseCommand):
+    help = (
+        "Add orders placed since the last run to the \"customers also bought\" recommendations, "
+        "or recount every order when the last full recount is a day old. Run it every few minutes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--full", action="store_true", help="Recount every order from scratch.")
+
+    def handle(self, *args, **options):
+        build = rebuild_recommendations() if options["full"] else update_recommendations()
+        self.stdout.write(self.style.SUCCESS(
+            f"Counted {build.orders} orders, recommendations are current up to order {build.last_order_id}"
+        ))
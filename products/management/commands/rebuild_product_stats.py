@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from products.stats import rebuild_product_stats
+
+
+class Command(BaseCommand):
+    help = "Recompute review and stock aggregates for every product from scratch."
+
+    def handle(self, *args, **options):
+        count = rebuild_product_stats()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt stats for {count} products"))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+from products.search import get_search_backend, refresh_search_index
+
+
+class Command(BaseCommand):
+    help = "Re-index every product for storefront and admin search."
+
+    def handle(self, *args, **options):
+        refresh_search_index()
+        backend = type(get_search_backend()).__name__
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt the product search index ({backend})"))
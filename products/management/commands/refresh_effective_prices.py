@@ -0,0 +1,32 @@
+import time
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from products.pricing import refresh_effective_prices, refresh_expired_effective_prices, next_price_boundary
+
+
+class Command(BaseCommand):
+    help = "Recompute materialized product prices whose offer start/end boundary has passed."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--all", action="store_true", help="Rebuild every product, not only expired rows.")
+        parser.add_argument("--loop", action="store_true", help="Keep running and wake up at the next offer boundary.")
+        parser.add_argument("--max-sleep", type=int, default=300, help="Longest wait in seconds between runs with --loop.")
+
+    def handle(self, *args, **options):
+        if options["all"]:
+            count = refresh_effective_prices()
+            self.stdout.write(self.style.SUCCESS(f"Rebuilt {count} effective prices"))
+
+        while True:
+            count = refresh_expired_effective_prices()
+            if count:
+                self.stdout.write(f"Refreshed {count} effective prices")
+
+            if not options["loop"]:
+                break
+
+            boundary = next_price_boundary()
+            sleep_for = options["max_sleep"]
+            if boundary:
+                sleep_for = min(sleep_for, max((boundary - timezone.now()).total_seconds(), 1))
+            time.sleep(sleep_for)
@@ -0,0 +1,94 @@
+# Generated by Django 5.2.8 on 2026-10-18 17:36
+
+from decimal import Decimal
+import django.db.models.deletion
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def backfill_effective_prices(apps, schema_editor):
+    # a frozen copy of products.pricing.resolve_effective_prices, the live module
+    # follows the current models and may change after this migration has shipped
+    Product = apps.get_model("products", "Product")
+    Offer = apps.get_model("products", "Offer")
+    ProductEffectivePrice = apps.get_model("products", "ProductEffectivePrice")
+
+    now = timezone.now()
+    offers = {
+        offer_id: (offer_type, discount_percent, start_date, end_date)
+        for offer_id, offer_type, discount_percent, start_date, end_date in Offer.objects.filter(
+            is_active=True,
+            end_date__gte=now,
+        ).values_list("id", "offer_type", "discount_percent", "start_date", "end_date")
+    }
+
+    by_product = {}
+    for offer_id, product_id in Offer.products.through.objects.filter(
+        offer_id__in=list(offers)
+    ).values_list("offer_id", "product_id"):
+        if offers[offer_id][0] == "product":
+            by_product.setdefault(product_id, []).append(offer_id)
+
+    by_subcategory = {}
+    for offer_id, subcategory_id in Offer.subcategories.through.objects.filter(
+        offer_id__in=list(offers)
+    ).values_list("offer_id", "subcategory_id"):
+        if offers[offer_id][0] == "category":
+            by_subcategory.setdefault(subcategory_id, []).append(offer_id)
+
+    rows = []
+    for product_id, price, subcategory_id in Product.objects.values_list("id", "price", "subcategory_id"):
+        best = None
+        valid_until = None
+
+        for offer_id in by_product.get(product_id, []) + by_subcategory.get(subcategory_id, []):
+            _, discount_percent, start_date, end_date = offers[offer_id]
+
+            if start_date <= now <= end_date:
+                if best is None or (discount_percent, -offer_id) > (best[1], -best[0]):
+                    best = (offer_id, discount_percent)
+                boundary = end_date
+            elif start_date > now:
+                boundary = start_date
+            else:
+                continue
+
+            if valid_until is None or boundary < valid_until:
+                valid_until = boundary
+
+        best_offer_id, discount_percent = best or (None, 0)
+        final_price = price
+        if discount_percent:
+            final_price = (price - price * Decimal(discount_percent) / 100).quantize(Decimal("0.01"))
+
+        rows.append(ProductEffectivePrice(
+            product_id=product_id,
+            best_offer_id=best_offer_id,
+            discount_percent=discount_percent,
+            final_price=final_price,
+            valid_until=valid_until,
+        ))
+
+    ProductEffectivePrice.objects.bulk_create(rows, batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0015_remove_product_old_price'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductEffectivePrice',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='effective_price', serialize=False, to='products.product')),
+                ('discount_percent', models.PositiveIntegerField(default=0)),
+                ('final_price', models.DecimalField(db_index=True, decimal_places=2, max_digits=10)),
+                ('valid_until', models.DateTimeField(blank=True, db_index=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('best_offer', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='products.offer')),
+            ],
+        ),
+        migrations.RunPython(backfill_effective_prices, migrations.RunPython.noop),
+    ]
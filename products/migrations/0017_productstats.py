@@ -0,0 +1,62 @@
+# Generated by Django 5.2.8 on 2026-10-18 17:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+
+
+def backfill_product_stats(apps, schema_editor):
+    Product = apps.get_model("products", "Product")
+    ProductVariant = apps.get_model("products", "ProductVariant")
+    ProductReview = apps.get_model("products", "ProductReview")
+    ProductStats = apps.get_model("products", "ProductStats")
+
+    stats = {product_id: ProductStats(product_id=product_id) for product_id in Product.objects.values_list("id", flat=True)}
+
+    reviews = ProductReview.objects.order_by().values("product").annotate(
+        rating_sum=Sum("rating"),
+        review_count=Count("id"),
+        **{f"rating_{star}": Count("id", filter=Q(rating=star)) for star in range(1, 6)},
+    )
+    for row in reviews:
+        row_stats = stats[row.pop("product")]
+        for field, value in row.items():
+            setattr(row_stats, field, value or 0)
+
+    stock = ProductVariant.objects.filter(is_active=True).order_by().values("product").annotate(
+        total_stock=Sum("stock"),
+        in_stock_variant_count=Count("id", filter=Q(stock__gt=0)),
+    )
+    for row in stock:
+        row_stats = stats[row.pop("product")]
+        for field, value in row.items():
+            setattr(row_stats, field, value or 0)
+
+    ProductStats.objects.bulk_create(stats.values(), batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0016_producteffectiveprice'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductStats',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='products.product')),
+                ('rating_sum', models.PositiveIntegerField(default=0)),
+                ('review_count', models.PositiveIntegerField(default=0)),
+                ('rating_1', models.PositiveIntegerField(default=0)),
+                ('rating_2', models.PositiveIntegerField(default=0)),
+                ('rating_3', models.PositiveIntegerField(default=0)),
+                ('rating_4', models.PositiveIntegerField(default=0)),
+                ('rating_5', models.PositiveIntegerField(default=0)),
+                ('total_stock', models.PositiveIntegerField(default=0)),
+                ('in_stock_variant_count', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(backfill_product_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 5.2.8 on 2026-10-18 17:43
+
+import django.contrib.postgres.search
+import django.db.models.deletion
+from django.contrib.postgres.indexes import GinIndex
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def create_search_index(apps, schema_editor):
+    from products.search import SQLITE_FTS_TABLE, search_vector, sqlite_fts_insert_sql
+
+    Product = apps.get_model("products", "Product")
+    SubCategory = apps.get_model("products", "SubCategory")
+    ProductSearchDocument = apps.get_model("products", "ProductSearchDocument")
+    vendor = schema_editor.connection.vendor
+
+    if vendor == "postgresql":
+        schema_editor.add_index(
+            ProductSearchDocument,
+            GinIndex(fields=["vector"], name="products_search_vector_gin"),
+        )
+        ProductSearchDocument.objects.bulk_create(
+            [ProductSearchDocument(product_id=product_id) for product_id in Product.objects.values_list("id", flat=True)],
+            batch_size=2000,
+        )
+        ProductSearchDocument.objects.update(
+            vector=Subquery(
+                Product.objects.filter(pk=OuterRef("product_id"))
+                .annotate(document=search_vector())
+                .values("document")[:1]
+            )
+        )
+
+    elif vendor == "sqlite":
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE {SQLITE_FTS_TABLE} USING fts5("
+            "name, color, category, highlights, description, "
+            "tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+        )
+        schema_editor.execute(sqlite_fts_insert_sql(Product._meta.db_table, SubCategory._meta.db_table))
+
+
+def drop_search_index(apps, schema_editor):
+    from products.search import SQLITE_FTS_TABLE
+
+    if schema_editor.connection.vendor == "sqlite":
+        schema_editor.execute(f"DROP TABLE IF EXISTS {SQLITE_FTS_TABLE}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0017_productstats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSearchDocument',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='search_document', serialize=False, to='products.product')),
+                ('vector', django.contrib.postgres.search.SearchVectorField(null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
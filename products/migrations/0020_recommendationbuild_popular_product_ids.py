@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-18 18:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0019_recommendations'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recommendationbuild',
+            name='popular_product_ids',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
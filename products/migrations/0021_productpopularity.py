@@ -0,0 +1,27 @@
+# Generated by Django 5.2.8 on 2026-10-18 18:03
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0020_recommendationbuild_popular_product_ids'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductPopularity',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='popularity', serialize=False, to='products.product')),
+                ('views', models.PositiveBigIntegerField(default=0)),
+                ('cart_adds', models.PositiveBigIntegerField(default=0)),
+                ('wishlist_adds', models.PositiveBigIntegerField(default=0)),
+                ('trending_score', models.FloatField(default=0)),
+                ('scored_at', models.FloatField(default=0)),
+                ('trending_rank', models.FloatField(db_index=True, default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
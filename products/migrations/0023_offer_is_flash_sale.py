@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-18 18:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0022_productvariant_reserved'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='offer',
+            name='is_flash_sale',
+            field=models.BooleanField(default=False),
+        ),
+    ]
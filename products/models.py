@@ -6,13 +6,68 @@ from django.conf import settings
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.utils import timezone
 from decimal import Decimal
-from django.db.models import IntegerField
+from django.db.models import DecimalField, IntegerField
 from django.db.models.functions import Cast
+from django.db.models import Case, ExpressionWrapper, F, OuterRef, Q, Subquery, When
+from django.db.models.functions import Coalesce, Round
+from django.contrib.postgres.search import SearchVectorField
 import io
 
 
 # Create your models here.
 
+class ProductQuerySet(models.QuerySet):
+
+    def with_pricing(self):
+        """Annotates every row with its best active offer, so final_price and
+        offer_percentage are read from the row instead of querying Offer per product.
+
+        The materialized ProductEffectivePrice row is used while it is still valid;
+        the live Offer subquery only runs for rows that are missing or past an offer boundary.
+        current_price is final_price as an expression, for price filters and sorting."""
+        now = timezone.now()
+        offers = (
+            Offer.objects.filter(
+                is_active=True,
+                start_date__lte=now,
+                end_date__gte=now,
+            )
+            .filter(
+                Q(offer_type="product", products=OuterRef("pk")) |
+                Q(offer_type="category", subcategories=OuterRef("subcategory"))
+            )
+            .order_by("-discount_percent", "pk")
+        )
+
+        is_fresh = Q(effective_price__isnull=False) & (
+            Q(effective_price__valid_until__isnull=True) |
+            Q(effective_price__valid_until__gt=now)
+        )
+
+        return self.annotate(
+            best_offer_id=Case(
+                When(is_fresh, then=F("effective_price__best_offer_id")),
+                default=Subquery(offers.values("pk")[:1]),
+            ),
+            best_offer_discount=Case(
+                When(is_fresh, then=F("effective_price__discount_percent")),
+                default=Coalesce(Subquery(offers.values("discount_percent")[:1]), 0),
+            ),
+        ).annotate(
+            current_price=Case(
+                When(is_fresh, then=F("effective_price__final_price")),
+                default=Round(
+                    ExpressionWrapper(
+                        F("price") * (100 - F("best_offer_discount")) / 100,
+                        output_field=DecimalField(max_digits=10, decimal_places=2),
+                    ),
+                    2,
+                ),
+                output_field=DecimalField(max_digits=10, decimal_places=2),
+            ),
+        )
+
+
 class Product(models.Model):
     CATEGORY_CHOICE = [
         ('MEN', 'Men'),
@@ -33,6 +88,8 @@ class Product(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = ProductQuerySet.as_manager()
+
     def __str__(self):
         return f"{self.name} ({self.category} - {self.color})"
     
@@ -42,6 +99,12 @@ class Product(models.Model):
     def get_first_available_variant(self):
         """Returns the first active variant with stock > 0"""
         return self.variants.filter(stock__gt=0, is_active=True).first()
+
+    @property
+    def primary_image(self):
+        """Primary image, else the oldest one. Served from prefetch_related("images") when present."""
+        images = sorted(self.images.all(), key=lambda image: (not image.is_primary, image.id))
+        return images[0] if images else None
     
     #offer logics
 
@@ -70,25 +133,26 @@ class Product(models.Model):
         )
     
     def get_best_offer(self):
-        offers = list(self.get_product_offers()) + list(self.get_category_offers())
-
-        if not offers:
-            return None
-        
-        return max(offers, key=lambda o:o.discount_percent)
+        # served from the cached active-offer index instead of get_product_offers/get_category_offers
+        from .offer_cache import get_offer_index
+        return get_offer_index().best_offer(self)
     
     @property
     def offer_percentage(self):
+        # set by Product.objects.with_pricing()
+        if hasattr(self, "best_offer_discount"):
+            return self.best_offer_discount
+
         offer = self.get_best_offer()
         return offer.discount_percent if offer else 0
     
     @property
     def final_price(self):
-        offer = self.get_best_offer()
-        if not offer:
+        discount_percent = self.offer_percentage
+        if not discount_percent:
             return self.price
         
-        discount = (self.price * Decimal(offer.discount_percent) / 100)
+        discount = (self.price * Decimal(discount_percent) / 100)
         return (self.price - discount).quantize(Decimal("0.01"))
            
     
@@ -99,6 +163,8 @@ class ProductVariant(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="variants")
     size = models.CharField(max_length=10)
     stock =  models.PositiveIntegerField(default=0)
+    # units under active shop.StockHold rows, kept in step by shop.reservations
+    reserved = models.PositiveIntegerField(default=0)
     is_active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now = True)
@@ -109,6 +175,11 @@ class ProductVariant(models.Model):
 
     def __str__(self):
         return f"{self.product.name} - Size {self.size}"
+
+    @property
+    def available_stock(self):
+        """Stock not held for a payment in progress."""
+        return max(self.stock - self.reserved, 0)
     
 
 class ProductImage(models.Model):
@@ -199,6 +270,9 @@ class Offer(models.Model):
 
     is_active = models.BooleanField(default=True)
 
+    # checkout for the offer's products goes through the admission queue, see shop.admission
+    is_flash_sale = models.BooleanField(default=False)
+
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -213,3 +287,140 @@ class Offer(models.Model):
     def __str__(self):
         return self.title
     
+
+
+class ProductEffectivePrice(models.Model):
+    """Denormalized best-offer price per product, kept current by products.signals
+    and the refresh_effective_prices command."""
+
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name="effective_price")
+    best_offer = models.ForeignKey(Offer, on_delete=models.SET_NULL, null=True, blank=True, related_name="+")
+    discount_percent = models.PositiveIntegerField(default=0)
+    final_price = models.DecimalField(max_digits=10, decimal_places=2, db_index=True)
+
+    # next offer start/end that can change this row, null when none is scheduled
+    valid_until = models.DateTimeField(null=True, blank=True, db_index=True)
+
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.product_id} - {self.final_price}"
+
+
+class ProductStats(models.Model):
+    """Review and stock aggregates per product, kept current by products.signals
+    and rebuilt from scratch by the rebuild_product_stats command."""
+
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name="stats")
+
+    rating_sum = models.PositiveIntegerField(default=0)
+    review_count = models.PositiveIntegerField(default=0)
+    rating_1 = models.PositiveIntegerField(default=0)
+    rating_2 = models.PositiveIntegerField(default=0)
+    rating_3 = models.PositiveIntegerField(default=0)
+    rating_4 = models.PositiveIntegerField(default=0)
+    rating_5 = models.PositiveIntegerField(default=0)
+
+    # active variants only
+    total_stock = models.PositiveIntegerField(default=0)
+    in_stock_variant_count = models.PositiveIntegerField(default=0)
+
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Stats for {self.product_id}"
+
+    @property
+    def avg_rating(self):
+        if not self.review_count:
+            return 0
+        return round(self.rating_sum / self.review_count, 1)
+
+    @property
+    def star_distribution(self):
+        return {star: getattr(self, f"rating_{star}") for star in range(5, 0, -1)}
+
+
+class ProductSearchDocument(models.Model):
+    """Weighted tsvector per product for the Postgres search backend, see products.search.
+    The GIN index is created in the migration, since it only exists on Postgres."""
+
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name="search_document")
+    vector = SearchVectorField(null=True)
+
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Search document for {self.product_id}"
+
+
+class ProductCoPurchase(models.Model):
+    """Number of orders containing both products, stored once per pair with product_id <= related_id.
+    The row where both are the same product counts the orders containing it. See products.recommendations."""
+
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="+")
+    related = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="+")
+    orders = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["product", "related"], name="unique_co_purchase_pair"),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id} + {self.related_id}: {self.orders}"
+
+
+class ProductRecommendation(models.Model):
+    """Top co-purchased products per product, rank 0 first, built by products.recommendations."""
+
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="recommendations")
+    recommended = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="recommended_in")
+    score = models.FloatField()
+    rank = models.PositiveSmallIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["product", "rank"], name="unique_recommendation_rank"),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id} -> {self.recommended_id} ({self.score:.3f})"
+
+
+class RecommendationBuild(models.Model):
+    """One row per recommendation run; the latest last_order_id is where the next incremental run starts."""
+
+    last_order_id = models.PositiveBigIntegerField(default=0)
+    full = models.BooleanField(default=False)
+    orders = models.PositiveIntegerField(default=0)
+
+    # best sellers at the time of the run, shown to visitors without history
+    popular_product_ids = models.JSONField(default=list, blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{'Full' if self.full else 'Incremental'} build up to order {self.last_order_id}"
+
+
+class ProductPopularity(models.Model):
+    """Engagement counters and the decayed trending score per product, written in batches
+    by products.popularity rather than on every event."""
+
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name="popularity")
+
+    views = models.PositiveBigIntegerField(default=0)
+    cart_adds = models.PositiveBigIntegerField(default=0)
+    wishlist_adds = models.PositiveBigIntegerField(default=0)
+
+    # weighted events as of scored_at (unix time), halving every TRENDING_HALF_LIFE;
+    # trending_rank = log2(score) + scored_at / half-life sorts the same at any later time
+    trending_score = models.FloatField(default=0)
+    scored_at = models.FloatField(default=0)
+    trending_rank = models.FloatField(default=0, db_index=True)
+
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Popularity of {self.product_id}"
@@ -0,0 +1,120 @@
+import math
+from django.core.cache import cache
+from django.db.models import Count, Max
+from django.utils import timezone
+from .models import Offer
+
+
+OFFER_INDEX_MAX_TTL = 60 * 60
+
+# how long this process trusts its copy before re-checking the offers' version
+OFFER_INDEX_LOCAL_TTL = 2
+
+# (version, index, checked_at) shared by every thread of this process
+_local_index = (None, None, None)
+
+
+class ActiveOfferIndex:
+    """Currently running offers, looked up by product id and subcategory id.
+    Valid until expires_at, the earliest upcoming offer start or end."""
+
+    def __init__(self, by_product, by_subcategory, expires_at):
+        self.by_product = by_product
+        self.by_subcategory = by_subcategory
+        self.expires_at = expires_at
+
+    def is_valid(self, now):
+        return self.expires_at is None or now < self.expires_at
+
+    def best_offer(self, product):
+        offers = self.by_product.get(product.id, []) + self.by_subcategory.get(product.subcategory_id, [])
+        if not offers:
+            return None
+
+        # same tie-break as Product.objects.with_pricing()
+        return max(offers, key=lambda o: (o.discount_percent, -o.pk))
+
+    def in_flash_sale(self, product_id, subcategory_id):
+        offers = self.by_product.get(product_id, []) + self.by_subcategory.get(subcategory_id, [])
+        return any(offer.is_flash_sale for offer in offers)
+
+
+def build_offer_index(now=None):
+    now = now or timezone.now()
+
+    offers = list(Offer.objects.filter(is_active=True, end_date__gte=now))
+    running = {o.pk: o for o in offers if o.start_date <= now}
+
+    boundaries = [o.end_date for o in running.values()]
+    boundaries += [o.start_date for o in offers if o.start_date > now]
+
+    by_product = {}
+    for offer_id, product_id in Offer.products.through.objects.filter(
+        offer_id__in=list(running)
+    ).values_list("offer_id", "product_id"):
+        offer = running[offer_id]
+        if offer.offer_type == "product":
+            by_product.setdefault(product_id, []).append(offer)
+
+    by_subcategory = {}
+    for offer_id, subcategory_id in Offer.subcategories.through.objects.filter(
+        offer_id__in=list(running)
+    ).values_list("offer_id", "subcategory_id"):
+        offer = running[offer_id]
+        if offer.offer_type == "category":
+            by_subcategory.setdefault(subcategory_id, []).append(offer)
+
+    return ActiveOfferIndex(by_product, by_subcategory, min(boundaries) if boundaries else None)
+
+
+def offer_version():
+    """
+    Moves with every offer saved, deleted or relinked. Read from the database, not
+    the cache, so every process sees it even when each has its own cache.
+    """
+    row = Offer.objects.aggregate(count=Count("id"), changed=Max("updated_at"))
+    return f"{row['count']}:{row['changed'].timestamp() if row['changed'] else 0}"
+
+
+def get_offer_index():
+    """
+    Process-local copy first, then the shared cache, then the database.
+    Both cached copies are keyed by offer_version(), checked every OFFER_INDEX_LOCAL_TTL.
+    """
+    global _local_index
+    now = timezone.now()
+
+    local_version, index, checked_at = _local_index
+    if index is not None and index.is_valid(now) and (now - checked_at).total_seconds() < OFFER_INDEX_LOCAL_TTL:
+        return index
+
+    version = offer_version()
+    if index is not None and local_version == version and index.is_valid(now):
+        _local_index = (version, index, now)
+        return index
+
+    cache_key = f"offers:index:{version}"
+    index = cache.get(cache_key)
+
+    if index is None or not index.is_valid(now):
+        index = build_offer_index(now)
+
+        timeout = OFFER_INDEX_MAX_TTL
+        if index.expires_at is not None:
+            timeout = min(timeout, math.ceil((index.expires_at - now).total_seconds()))
+        cache.set(cache_key, index, max(timeout, 1))
+
+    _local_index = (version, index, now)
+    return index
+
+
+def invalidate_offer_cache(offer_ids=()):
+    """
+    Called by the Offer signals. Saving or deleting an offer moves offer_version()
+    by itself, relinking one only once `offer_ids` are touched. This process
+    re-checks at once, the others within OFFER_INDEX_LOCAL_TTL.
+    """
+    global _local_index
+    if offer_ids:
+        Offer.objects.filter(id__in=list(offer_ids)).update(updated_at=timezone.now())
+    _local_index = (None, None, None)
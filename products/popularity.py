@@ -0,0 +1,155 @@
+import atexit
+import logging
+import math
+import os
+import threading
+import time
+from django.db import DatabaseError, connection
+from django.utils import timezone
+from .models import Product, ProductPopularity
+
+
+logger = logging.getLogger(__name__)
+
+# trending_score weight of one event
+EVENT_WEIGHTS = {"views": 1.0, "cart_adds": 5.0, "wishlist_adds": 3.0}
+
+TRENDING_HALF_LIFE = 60 * 60 * 24 * 3
+
+# a process's flusher thread writes its buffered counts this often, a request does once this many products are buffered
+FLUSH_INTERVAL = 5
+MAX_BUFFERED_PRODUCTS = 1000
+
+# rows per INSERT ... ON CONFLICT statement
+FLUSH_BATCH_SIZE = 500
+
+
+def trending_rank(score, scored_at):
+    """Comparable across rows scored at different times, higher is more trending."""
+    return math.log2(score) + scored_at / TRENDING_HALF_LIFE
+
+
+def _upsert_sql(rows):
+    table = connection.ops.quote_name(ProductPopularity._meta.db_table)
+    # decays the stored score to the new scored_at before adding the increment
+    decayed = (
+        f"{table}.trending_score * POWER(0.5, (EXCLUDED.scored_at - {table}.scored_at) / {TRENDING_HALF_LIFE})"
+        " + EXCLUDED.trending_score"
+    )
+    values = ", ".join(["(%s, %s, %s, %s, %s, %s, %s, %s)"] * rows)
+    return f"""
+        INSERT INTO {table}
+            (product_id, views, cart_adds, wishlist_adds, trending_score, scored_at, trending_rank, updated_at)
+        VALUES {values}
+        ON CONFLICT (product_id) DO UPDATE SET
+            views = {table}.views + EXCLUDED.views,
+            cart_adds = {table}.cart_adds + EXCLUDED.cart_adds,
+            wishlist_adds = {table}.wishlist_adds + EXCLUDED.wishlist_adds,
+            trending_score = {decayed},
+            scored_at = EXCLUDED.scored_at,
+            trending_rank = LN({decayed}) / LN(2) + EXCLUDED.scored_at / {TRENDING_HALF_LIFE},
+            updated_at = EXCLUDED.updated_at
+    """
+
+
+def write_increments(counts):
+    """Adds {product id: {event: count}} to ProductPopularity, one multi-row upsert per batch."""
+    existing = set(Product.objects.filter(id__in=list(counts)).values_list("id", flat=True))
+    now = time.time()
+    updated_at = connection.ops.adapt_datetimefield_value(timezone.now())
+
+    rows = []
+    for product_id, events in counts.items():
+        if product_id not in existing:
+            continue
+        score = sum(EVENT_WEIGHTS[event] * count for event, count in events.items())
+        rows.append([
+            product_id, events["views"], events["cart_adds"], events["wishlist_adds"],
+            score, now, trending_rank(score, now), updated_at,
+        ])
+
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), FLUSH_BATCH_SIZE):
+            batch = rows[start:start + FLUSH_BATCH_SIZE]
+            cursor.execute(_upsert_sql(len(batch)), [value for row in batch for value in row])
+
+
+class CounterBuffer:
+    """
+    Per-process event counts, written as aggregated increments instead of a row
+    update per event, by a flusher thread every FLUSH_INTERVAL seconds whether or
+    not more events come. Counts still buffered when a process is killed are lost,
+    which is acceptable for a popularity signal.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = {}
+        # the process the flusher thread runs in, a forked worker starts its own
+        self.flusher_pid = None
+
+    def add(self, product_id, event, amount=1):
+        with self.lock:
+            events = self.counts.get(product_id)
+            if events is None:
+                events = self.counts[product_id] = dict.fromkeys(EVENT_WEIGHTS, 0)
+            events[event] += amount
+            due = len(self.counts) >= MAX_BUFFERED_PRODUCTS
+
+            if self.flusher_pid != os.getpid():
+                self.flusher_pid = os.getpid()
+                threading.Thread(target=self._flush_periodically, daemon=True).start()
+
+        # never inside a caller's transaction, a failed flush would break it
+        if due and not connection.in_atomic_block:
+            self.flush()
+
+    def _flush_periodically(self):
+        while True:
+            time.sleep(FLUSH_INTERVAL)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Could not flush popularity counters")
+            finally:
+                # the thread's own database connection
+                connection.close()
+
+    def _merge(self, counts):
+        for product_id, events in counts.items():
+            buffered = self.counts.setdefault(product_id, dict.fromkeys(EVENT_WEIGHTS, 0))
+            for event, count in events.items():
+                buffered[event] += count
+
+    def flush(self):
+        with self.lock:
+            counts, self.counts = self.counts, {}
+        if not counts:
+            return
+
+        try:
+            write_increments(counts)
+        except DatabaseError:
+            logger.exception("Could not write %s buffered popularity counters, retrying later", len(counts))
+            with self.lock:
+                self._merge(counts)
+
+
+_buffer = CounterBuffer()
+
+
+@atexit.register
+def _flush_on_exit():
+    try:
+        _buffer.flush()
+    except Exception:
+        pass
+
+
+def record_event(product_id, event, amount=1):
+    """Counts a "views", "cart_adds" or "wishlist_adds" event for a product."""
+    _buffer.add(product_id, event, amount)
+
+
+def flush_counters():
+    _buffer.flush()
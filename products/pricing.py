@@ -0,0 +1,155 @@
+from decimal import Decimal
+from django.db.models import Q
+from django.utils import timezone
+from .models import Product, Offer, ProductEffectivePrice
+
+
+def apply_discount(price, discount_percent):
+    if not discount_percent:
+        return price
+
+    discount = (price * Decimal(discount_percent) / 100)
+    return (price - discount).quantize(Decimal("0.01"))
+
+
+def resolve_effective_prices(products, offers, product_links, subcategory_links, now):
+    """
+    Works out the best offer for each product from plain rows, so it can be
+    shared by the signals and the refresh command. Migration 0016 keeps its own copy.
+
+    products: (id, price, subcategory_id)
+    offers: {offer_id: (offer_type, discount_percent, start_date, end_date)}
+    product_links / subcategory_links: (offer_id, product_id / subcategory_id)
+
+    Returns (product_id, best_offer_id, discount_percent, final_price, valid_until) rows.
+    """
+    by_product = {}
+    for offer_id, product_id in product_links:
+        if offers[offer_id][0] == "product":
+            by_product.setdefault(product_id, []).append(offer_id)
+
+    by_subcategory = {}
+    for offer_id, subcategory_id in subcategory_links:
+        if offers[offer_id][0] == "category":
+            by_subcategory.setdefault(subcategory_id, []).append(offer_id)
+
+    rows = []
+    for product_id, price, subcategory_id in products:
+        best = None
+        valid_until = None
+
+        for offer_id in by_product.get(product_id, []) + by_subcategory.get(subcategory_id, []):
+            _, discount_percent, start_date, end_date = offers[offer_id]
+
+            if start_date <= now <= end_date:
+                # same tie-break as Product.objects.with_pricing()
+                if best is None or (discount_percent, -offer_id) > (best[1], -best[0]):
+                    best = (offer_id, discount_percent)
+                boundary = end_date
+            elif start_date > now:
+                boundary = start_date
+            else:
+                continue
+
+            if valid_until is None or boundary < valid_until:
+                valid_until = boundary
+
+        best_offer_id, discount_percent = best or (None, 0)
+        rows.append((
+            product_id,
+            best_offer_id,
+            discount_percent,
+            apply_discount(price, discount_percent),
+            valid_until,
+        ))
+
+    return rows
+
+
+def refresh_effective_prices(product_ids=None, batch_size=2000):
+    """Recomputes ProductEffectivePrice rows, for every product when product_ids is None."""
+    now = timezone.now()
+
+    products = Product.objects.order_by()
+    if product_ids is not None:
+        product_ids = set(product_ids)
+        if not product_ids:
+            return 0
+        products = products.filter(id__in=product_ids)
+    products = list(products.values_list("id", "price", "subcategory_id"))
+
+    if not products:
+        return 0
+
+    offers = {
+        offer_id: (offer_type, discount_percent, start_date, end_date)
+        for offer_id, offer_type, discount_percent, start_date, end_date in Offer.objects.filter(
+            is_active=True,
+            end_date__gte=now,
+        ).values_list("id", "offer_type", "discount_percent", "start_date", "end_date")
+    }
+
+    product_links = Offer.products.through.objects.filter(offer_id__in=list(offers))
+    subcategory_links = Offer.subcategories.through.objects.filter(offer_id__in=list(offers))
+    if product_ids is not None:
+        product_links = product_links.filter(product_id__in=product_ids)
+        subcategory_links = subcategory_links.filter(
+            subcategory_id__in={sub_id for _, _, sub_id in products if sub_id}
+        )
+
+    rows = resolve_effective_prices(
+        products,
+        offers,
+        product_links.values_list("offer_id", "product_id"),
+        subcategory_links.values_list("offer_id", "subcategory_id"),
+        now,
+    )
+
+    ProductEffectivePrice.objects.bulk_create(
+        [
+            ProductEffectivePrice(
+                product_id=product_id,
+                best_offer_id=best_offer_id,
+                discount_percent=discount_percent,
+                final_price=final_price,
+                valid_until=valid_until,
+                updated_at=now,
+            )
+            for product_id, best_offer_id, discount_percent, final_price, valid_until in rows
+        ],
+        batch_size=batch_size,
+        update_conflicts=True,
+        unique_fields=["product"],
+        update_fields=["best_offer", "discount_percent", "final_price", "valid_until", "updated_at"],
+    )
+    return len(rows)
+
+
+def refresh_expired_effective_prices():
+    """Recomputes rows whose offer boundary has passed, plus products that have no row yet."""
+    now = timezone.now()
+    product_ids = set(
+        ProductEffectivePrice.objects.filter(valid_until__lte=now).values_list("product_id", flat=True)
+    )
+    product_ids.update(
+        Product.objects.filter(effective_price__isnull=True).values_list("id", flat=True)
+    )
+    return refresh_effective_prices(product_ids)
+
+
+def next_price_boundary():
+    return (
+        ProductEffectivePrice.objects.filter(valid_until__isnull=False)
+        .order_by("valid_until")
+        .values_list("valid_until", flat=True)
+        .first()
+    )
+
+
+def offer_product_ids(offer):
+    """Products whose price depends on this offer, through either of its M2M links."""
+    return set(
+        Product.objects.filter(
+            Q(product_offers=offer) | Q(subcategory__category_offers=offer)
+        ).values_list("id", flat=True)
+    )
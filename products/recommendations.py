@@ -0,0 +1,236 @@
+import heapq
+import math
+from collections import Counter
+from itertools import combinations
+from datetime import timedelta
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, Max, Q, Sum
+from django.utils import timezone
+from .models import Product, ProductCoPurchase, ProductRecommendation, RecommendationBuild
+
+
+RECOMMENDATIONS_PER_PRODUCT = 12
+
+# pairs grow quadratically with basket size, bulk orders past this only count their first products
+MAX_BASKET_SIZE = 50
+
+BATCH_SIZE = 5000
+
+EXCLUDED_ITEM_STATUSES = ["Cancelled", "Returned", "Refunded"]
+
+POPULAR_PRODUCTS = 24
+POPULARITY_DAYS = 30
+POPULAR_CACHE_KEY = "recommendations:popular"
+
+# orders newer than this are left to the next run: a lower order id can still be
+# in an open transaction, and the incremental watermark must not pass it
+ORDER_COMMIT_LAG = timedelta(minutes=5)
+
+# incremental runs never subtract items cancelled or returned after they were
+# counted, so update_recommendations recounts everything at least this often
+FULL_REBUILD_EVERY = timedelta(days=1)
+
+
+def _baskets(after_order_id, upto_order_id):
+    """(order id, set of product ids) per order, streamed in order id order."""
+    from shop.models import OrderItem
+
+    rows = (
+        OrderItem.objects.filter(order_id__gt=after_order_id, order_id__lte=upto_order_id)
+        .exclude(status__in=EXCLUDED_ITEM_STATUSES)
+        .order_by("order_id")
+        .values_list("order_id", "variant__product_id")
+    )
+
+    current, basket = None, set()
+    for order_id, product_id in rows.iterator(chunk_size=BATCH_SIZE):
+        if order_id != current:
+            if basket:
+                yield current, basket
+            current, basket = order_id, set()
+        basket.add(product_id)
+    if basket:
+        yield current, basket
+
+
+def count_co_purchases(baskets):
+    """
+    Sparse co-occurrence counts as a Counter of (a, b) -> orders with a <= b,
+    the diagonal (a, a) being the orders containing a. Returns (counts, orders seen).
+    """
+    counts = Counter()
+    orders = 0
+    for _, basket in baskets:
+        orders += 1
+        products = sorted(basket)[:MAX_BASKET_SIZE]
+        counts.update((product_id, product_id) for product_id in products)
+        counts.update(combinations(products, 2))
+    return counts, orders
+
+
+def rank_neighbors(counts, product_ids):
+    """
+    Top RECOMMENDATIONS_PER_PRODUCT neighbors of each product by cosine similarity
+    of their order vectors, orders(a, b) / sqrt(orders(a) * orders(b)).
+    `counts` must hold the diagonal of every product appearing in a pair.
+    """
+    neighbors = {product_id: [] for product_id in product_ids}
+    for (a, b), orders in counts.items():
+        if a == b:
+            continue
+        score = orders / math.sqrt(counts[(a, a)] * counts[(b, b)])
+        if a in neighbors:
+            neighbors[a].append((score, orders, b))
+        if b in neighbors:
+            neighbors[b].append((score, orders, a))
+
+    return {
+        product_id: heapq.nlargest(RECOMMENDATIONS_PER_PRODUCT, candidates)
+        for product_id, candidates in neighbors.items()
+    }
+
+
+def _save_recommendations(ranked):
+    ProductRecommendation.objects.bulk_create(
+        [
+            ProductRecommendation(product_id=product_id, recommended_id=other_id, score=score, rank=rank)
+            for product_id, neighbors in ranked.items()
+            for rank, (score, _, other_id) in enumerate(neighbors)
+        ],
+        batch_size=BATCH_SIZE,
+    )
+
+
+def _max_order_id():
+    """The watermark: the last order id placed at least ORDER_COMMIT_LAG ago."""
+    from shop.models import Order
+    settled = timezone.now() - ORDER_COMMIT_LAG
+    return Order.objects.filter(created_at__lte=settled).aggregate(last=Max("id"))["last"] or 0
+
+
+def compute_popular_products():
+    """Active products by units sold in the last POPULARITY_DAYS, topped up with the newest ones."""
+    from shop.models import OrderItem
+
+    since = timezone.now() - timedelta(days=POPULARITY_DAYS)
+    product_ids = [
+        row["variant__product_id"]
+        for row in OrderItem.objects.filter(order__created_at__gte=since, variant__product__is_active=True)
+        .exclude(status__in=EXCLUDED_ITEM_STATUSES)
+        .values("variant__product_id")
+        .annotate(units=Sum("quantity"))
+        .order_by("-units", "-variant__product_id")[:POPULAR_PRODUCTS]
+    ]
+    if len(product_ids) < POPULAR_PRODUCTS:
+        product_ids += (
+            Product.objects.filter(is_active=True)
+            .exclude(id__in=product_ids)
+            .order_by("-created_at")
+            .values_list("id", flat=True)[:POPULAR_PRODUCTS - len(product_ids)]
+        )
+    return product_ids
+
+
+def get_popular_product_ids():
+    """The list stored by the last build, from the cache when possible."""
+    product_ids = cache.get(POPULAR_CACHE_KEY)
+    if product_ids is None:
+        build = RecommendationBuild.objects.order_by("-id").first()
+        if build is not None and build.popular_product_ids:
+            cache.set(POPULAR_CACHE_KEY, build.popular_product_ids, None)
+            return build.popular_product_ids
+
+        # build_recommendations has never run, or ran before there was anything to list
+        product_ids = compute_popular_products()
+        cache.set(POPULAR_CACHE_KEY, product_ids, 60 * 60)
+    return product_ids
+
+
+def _finish_build(**fields):
+    build = RecommendationBuild.objects.create(popular_product_ids=compute_popular_products(), **fields)
+    if build.popular_product_ids:
+        transaction.on_commit(lambda: cache.set(POPULAR_CACHE_KEY, build.popular_product_ids, None))
+    else:
+        transaction.on_commit(lambda: cache.delete(POPULAR_CACHE_KEY))
+    return build
+
+
+def rebuild_recommendations():
+    """Recounts every order and replaces both tables. Returns the RecommendationBuild row."""
+    with transaction.atomic():
+        # serializes with other runs, so no order is counted twice
+        RecommendationBuild.objects.select_for_update().order_by("-id").first()
+
+        upto = _max_order_id()
+        counts, orders = count_co_purchases(_baskets(0, upto))
+
+        ProductCoPurchase.objects.all().delete()
+        ProductCoPurchase.objects.bulk_create(
+            [ProductCoPurchase(product_id=a, related_id=b, orders=n) for (a, b), n in counts.items()],
+            batch_size=BATCH_SIZE,
+        )
+
+        ProductRecommendation.objects.all().delete()
+        _save_recommendations(rank_neighbors(counts, {a for a, b in counts if a == b}))
+
+        return _finish_build(last_order_id=upto, full=True, orders=orders)
+
+
+def update_recommendations():
+    """
+    Adds orders placed since the last run to the pair counts and re-ranks the
+    products in them. Neighbors of those products keep their lists until they sell
+    again or the next full rebuild, even though their scores moved slightly.
+
+    Only a full rebuild is exact: items cancelled or returned after they were
+    counted stay counted, and an order whose transaction outlived ORDER_COMMIT_LAG
+    is missed. So this runs one instead once the last is FULL_REBUILD_EVERY old.
+    """
+    with transaction.atomic():
+        last_build = RecommendationBuild.objects.select_for_update().order_by("-id").first()
+        last_full = RecommendationBuild.objects.filter(full=True).order_by("-id").first()
+        if last_full is None or last_full.created_at < timezone.now() - FULL_REBUILD_EVERY:
+            return rebuild_recommendations()
+
+        upto = _max_order_id()
+        counts, orders = count_co_purchases(_baskets(last_build.last_order_id, upto))
+        if counts:
+            affected = {a for a, b in counts if a == b}
+
+            # every counted pair has its lower id in affected, so this holds all rows to merge
+            existing = {
+                (row.product_id, row.related_id): row
+                for row in ProductCoPurchase.objects.filter(product_id__in=affected)
+            }
+            rows = []
+            for pair, n in counts.items():
+                row = existing.get(pair) or ProductCoPurchase(product_id=pair[0], related_id=pair[1])
+                row.orders += n
+                rows.append(row)
+            ProductCoPurchase.objects.bulk_create(
+                rows,
+                batch_size=BATCH_SIZE,
+                update_conflicts=True,
+                unique_fields=["product", "related"],
+                update_fields=["orders"],
+            )
+
+            pairs = {
+                (a, b): n
+                for a, b, n in ProductCoPurchase.objects.filter(
+                    Q(product_id__in=affected) | Q(related_id__in=affected)
+                ).values_list("product_id", "related_id", "orders")
+            }
+            others = {product_id for pair in pairs for product_id in pair} - affected
+            pairs.update(
+                ((a, a), n)
+                for a, n in ProductCoPurchase.objects.filter(
+                    product_id__in=others, related_id=F("product_id")
+                ).values_list("product_id", "orders")
+            )
+
+            ProductRecommendation.objects.filter(product_id__in=affected).delete()
+            _save_recommendations(rank_neighbors(pairs, affected))
+
+        return _finish_build(last_order_id=upto, orders=orders)
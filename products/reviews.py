@@ -0,0 +1,50 @@
+from django.core.cache import cache
+from django.db import transaction
+from .models import ProductReview, ProductStats
+
+
+REVIEW_SUMMARY_TTL = 60 * 60
+
+REVIEWS_PER_PAGE = 5
+
+
+def _summary_key(product_id):
+    return f"reviews:summary:{product_id}"
+
+
+def compute_review_summary(product_id):
+    """Count, average and the 5..1 star histogram, read from the product's stats row."""
+    stats = ProductStats.objects.filter(product_id=product_id).first() or ProductStats(product_id=product_id)
+    return {
+        "count": stats.review_count,
+        "average": stats.avg_rating,
+        "distribution": stats.star_distribution,
+    }
+
+
+def get_review_summary(product_id):
+    key = _summary_key(product_id)
+    summary = cache.get(key)
+    if summary is None:
+        summary = compute_review_summary(product_id)
+        cache.set(key, summary, REVIEW_SUMMARY_TTL)
+    return summary
+
+
+def invalidate_review_summary(product_id):
+    # after commit, otherwise a concurrent read could cache the old numbers again
+    transaction.on_commit(lambda: cache.delete(_summary_key(product_id)))
+
+
+def review_page(product_id, page=1, per_page=REVIEWS_PER_PAGE):
+    """
+    (reviews, has_next) for one page, newest first. Reads one extra row instead
+    of counting, the total is already in the summary.
+    """
+    offset = (page - 1) * per_page
+    reviews = list(
+        ProductReview.objects.filter(product_id=product_id)
+        .select_related("user")
+        .order_by("-created_at", "-id")[offset:offset + per_page + 1]
+    )
+    return reviews[:per_page], len(reviews) > per_page
@@ -0,0 +1,188 @@
+import re
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db import connection
+from django.db.models import Case, F, FloatField, OuterRef, Q, Subquery, Value, When
+from django.utils import timezone
+from .models import Product, ProductSearchDocument, SubCategory
+
+
+# no stemming, so prefix matches behave the same for names, colors and models
+SEARCH_CONFIG = "simple"
+
+SQLITE_FTS_TABLE = "products_product_fts"
+
+# the SQLite backend hands matches back to the ORM as an id list
+SQLITE_MAX_MATCHES = 1000
+
+MAX_SEARCH_TERMS = 8
+
+
+def search_terms(query):
+    """Splits user input into plain word tokens, safe to place inside tsquery / FTS5 syntax."""
+    return re.findall(r"[^\W_]+", query.lower())[:MAX_SEARCH_TERMS]
+
+
+def search_vector():
+    return (
+        SearchVector("name", weight="A", config=SEARCH_CONFIG)
+        + SearchVector("color", "category", "subcategory__name", weight="B", config=SEARCH_CONFIG)
+        + SearchVector("highlights", weight="C", config=SEARCH_CONFIG)
+        + SearchVector("description", weight="D", config=SEARCH_CONFIG)
+    )
+
+
+def sqlite_fts_insert_sql(product_table, subcategory_table, where=""):
+    # column order matches the bm25() weights in SQLiteSearchBackend
+    return f"""
+        INSERT INTO {SQLITE_FTS_TABLE} (rowid, name, color, category, highlights, description)
+        SELECT p.id, p.name, p.color, p.category || ' ' || COALESCE(s.name, ''), COALESCE(p.highlights, ''), p.description
+        FROM {product_table} p
+        LEFT JOIN {subcategory_table} s ON s.id = p.subcategory_id
+        {where}
+    """
+
+
+class PostgresSearchBackend:
+    """ProductSearchDocument.vector with a GIN index, ranked by ts_rank."""
+
+    def refresh(self, product_ids=None):
+        if product_ids is None:
+            product_ids = list(Product.objects.values_list("id", flat=True))
+
+        ProductSearchDocument.objects.bulk_create(
+            [ProductSearchDocument(product_id=product_id) for product_id in product_ids],
+            batch_size=2000,
+            ignore_conflicts=True,
+        )
+        ProductSearchDocument.objects.filter(product_id__in=product_ids).update(
+            vector=Subquery(
+                Product.objects.filter(pk=OuterRef("product_id"))
+                .annotate(document=search_vector())
+                .values("document")[:1]
+            ),
+            updated_at=timezone.now(),
+        )
+
+    def remove(self, product_ids):
+        # rows go with the product (on_delete=CASCADE)
+        pass
+
+    def search(self, queryset, terms):
+        query = SearchQuery(
+            " & ".join(f"{term}:*" for term in terms),
+            search_type="raw",
+            config=SEARCH_CONFIG,
+        )
+        return queryset.filter(search_document__vector=query).annotate(
+            search_rank=SearchRank(F("search_document__vector"), query)
+        )
+
+
+class SQLiteSearchBackend:
+    """FTS5 virtual table keyed by product id, for local development."""
+
+    weights = (10.0, 4.0, 4.0, 2.0, 1.0)
+
+    def refresh(self, product_ids=None):
+        with connection.cursor() as cursor:
+            if product_ids is None:
+                cursor.execute(f"DELETE FROM {SQLITE_FTS_TABLE}")
+                cursor.execute(sqlite_fts_insert_sql(Product._meta.db_table, SubCategory._meta.db_table))
+                return
+
+            product_ids = [int(product_id) for product_id in product_ids]
+            if not product_ids:
+                return
+            placeholders = ", ".join(["%s"] * len(product_ids))
+            cursor.execute(f"DELETE FROM {SQLITE_FTS_TABLE} WHERE rowid IN ({placeholders})", product_ids)
+            cursor.execute(
+                sqlite_fts_insert_sql(
+                    Product._meta.db_table, SubCategory._meta.db_table, f"WHERE p.id IN ({placeholders})"
+                ),
+                product_ids,
+            )
+
+    def remove(self, product_ids):
+        product_ids = [int(product_id) for product_id in product_ids]
+        if not product_ids:
+            return
+        placeholders = ", ".join(["%s"] * len(product_ids))
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {SQLITE_FTS_TABLE} WHERE rowid IN ({placeholders})", product_ids)
+
+    def search(self, queryset, terms):
+        match = " AND ".join(f'"{term}"*' for term in terms)
+        weights = ", ".join(str(w) for w in self.weights)
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT rowid, bm25({SQLITE_FTS_TABLE}, {weights}) FROM {SQLITE_FTS_TABLE} "
+                f"WHERE {SQLITE_FTS_TABLE} MATCH %s ORDER BY 2 LIMIT %s",
+                [match, SQLITE_MAX_MATCHES],
+            )
+            # bm25() is lower-is-better, flip it so both backends sort by -search_rank
+            ranks = {product_id: -score for product_id, score in cursor.fetchall()}
+
+        return queryset.filter(id__in=list(ranks)).annotate(
+            search_rank=Case(
+                *[When(id=product_id, then=Value(rank)) for product_id, rank in ranks.items()],
+                default=Value(0.0),
+                output_field=FloatField(),
+            )
+        )
+
+
+class BasicSearchBackend:
+    """Unindexed icontains fallback for other databases."""
+
+    def refresh(self, product_ids=None):
+        pass
+
+    def remove(self, product_ids):
+        pass
+
+    def search(self, queryset, terms):
+        for term in terms:
+            queryset = queryset.filter(
+                Q(name__icontains=term) |
+                Q(color__icontains=term) |
+                Q(category__icontains=term) |
+                Q(subcategory__name__icontains=term) |
+                Q(highlights__icontains=term) |
+                Q(description__icontains=term)
+            )
+        return queryset.annotate(search_rank=Value(0.0, output_field=FloatField()))
+
+
+SEARCH_BACKENDS = {
+    "postgresql": PostgresSearchBackend,
+    "sqlite": SQLiteSearchBackend,
+}
+
+
+def get_search_backend():
+    return SEARCH_BACKENDS.get(connection.vendor, BasicSearchBackend)()
+
+
+def search_products(queryset, query):
+    """
+    Filters a Product queryset down to matches for `query` (every word, as a prefix)
+    and annotates search_rank, higher is more relevant.
+    """
+    terms = search_terms(query)
+    if not terms:
+        return queryset.annotate(search_rank=Value(0.0, output_field=FloatField()))
+    return get_search_backend().search(queryset, terms)
+
+
+def refresh_search_index(product_ids=None):
+    """Re-indexes the given products, or every product when product_ids is None."""
+    if product_ids is not None:
+        product_ids = set(product_ids)
+        if not product_ids:
+            return
+    get_search_backend().refresh(product_ids)
+
+
+def remove_from_search_index(product_ids):
+    get_search_backend().remove(set(product_ids))
@@ -0,0 +1,179 @@
+from django.conf import settings
+from django.db.models.signals import pre_save, post_save, post_delete, pre_delete, m2m_changed
+from django.dispatch import receiver
+from .models import Product, ProductVariant, ProductReview, Offer, SubCategory
+from .pricing import refresh_effective_prices, offer_product_ids
+from .stats import ensure_stats, refresh_stock_stats, apply_review_delta
+from .search import refresh_search_index, remove_from_search_index
+from .typeahead import typeahead_product_changed, typeahead_subcategory_changed
+from .bitmaps import bitmaps_products_changed
+from .reviews import invalidate_review_summary
+from .offer_cache import invalidate_offer_cache
+
+
+#effective price
+
+@receiver(post_save, sender=Product)
+def refresh_product_price(sender, instance, **kwargs):
+    refresh_effective_prices([instance.id])
+
+
+@receiver(post_save, sender=Offer)
+def refresh_offer_prices(sender, instance, **kwargs):
+    refresh_effective_prices(offer_product_ids(instance))
+    invalidate_offer_cache()
+
+
+@receiver(pre_delete, sender=Offer)
+def remember_offer_products(sender, instance, **kwargs):
+    # the M2M rows are gone by post_delete
+    instance._affected_product_ids = offer_product_ids(instance)
+
+
+@receiver(post_delete, sender=Offer)
+def refresh_deleted_offer_prices(sender, instance, **kwargs):
+    refresh_effective_prices(getattr(instance, "_affected_product_ids", set()))
+    invalidate_offer_cache()
+
+
+@receiver(m2m_changed, sender=Offer.products.through)
+@receiver(m2m_changed, sender=Offer.subcategories.through)
+def refresh_offer_link_prices(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse:
+        # edited from the Product / SubCategory side, pk_set holds offers
+        if isinstance(instance, Product):
+            product_ids = {instance.id}
+            offers = instance.product_offers
+        else:
+            product_ids = set(instance.products.values_list("id", flat=True))
+            offers = instance.category_offers
+
+        if action == "pre_clear":
+            instance._affected_offer_ids = set(offers.values_list("id", flat=True))
+        elif action.startswith("post_"):
+            refresh_effective_prices(product_ids)
+            invalidate_offer_cache(pk_set or getattr(instance, "_affected_offer_ids", ()))
+        return
+
+    if action.startswith("pre_"):
+        instance._affected_product_ids = offer_product_ids(instance)
+    else:
+        product_ids = offer_product_ids(instance) | getattr(instance, "_affected_product_ids", set())
+        refresh_effective_prices(product_ids)
+        invalidate_offer_cache([instance.id])
+
+
+@receiver(pre_delete, sender=SubCategory)
+def remember_subcategory_products(sender, instance, **kwargs):
+    # products are moved to subcategory=NULL with a queryset update, which sends no signals
+    instance._affected_product_ids = set(instance.products.values_list("id", flat=True))
+
+
+@receiver(post_delete, sender=SubCategory)
+def refresh_deleted_subcategory_prices(sender, instance, **kwargs):
+    product_ids = getattr(instance, "_affected_product_ids", set())
+    refresh_effective_prices(product_ids)
+    refresh_search_index(product_ids)
+
+
+#review and stock aggregates
+
+@receiver(post_save, sender=Product)
+def create_product_stats(sender, instance, created, **kwargs):
+    if created:
+        ensure_stats([instance.id])
+
+
+@receiver(pre_save, sender=ProductReview)
+def remember_review_rating(sender, instance, **kwargs):
+    instance._old_rating = None
+    if instance.pk:
+        instance._old_rating = (
+            ProductReview.objects.filter(pk=instance.pk).values_list("rating", flat=True).first()
+        )
+
+
+@receiver(post_save, sender=ProductReview)
+def update_review_stats(sender, instance, created, **kwargs):
+    # rating can still be the raw POST string here
+    apply_review_delta(
+        instance.product_id,
+        old_rating=None if created else instance._old_rating,
+        new_rating=int(instance.rating),
+    )
+
+
+@receiver(post_delete, sender=ProductReview)
+def remove_review_stats(sender, instance, **kwargs):
+    apply_review_delta(instance.product_id, old_rating=int(instance.rating))
+
+
+@receiver(post_save, sender=ProductVariant)
+@receiver(post_delete, sender=ProductVariant)
+def update_stock_stats(sender, instance, **kwargs):
+    refresh_stock_stats([instance.product_id])
+
+
+#review summary
+
+@receiver(post_save, sender=ProductReview)
+@receiver(post_delete, sender=ProductReview)
+def clear_review_summary(sender, instance, **kwargs):
+    invalidate_review_summary(instance.product_id)
+
+
+#search index
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, **kwargs):
+    refresh_search_index([instance.id])
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, **kwargs):
+    remove_from_search_index([instance.id])
+
+
+@receiver(post_save, sender=SubCategory)
+def reindex_subcategory_products(sender, instance, created, **kwargs):
+    # the subcategory name is part of each product's document
+    if not created:
+        refresh_search_index(instance.products.values_list("id", flat=True))
+
+
+#typeahead
+
+@receiver(post_save, sender=Product)
+def update_typeahead_product(sender, instance, **kwargs):
+    typeahead_product_changed(instance)
+
+
+@receiver(post_delete, sender=Product)
+def remove_typeahead_product(sender, instance, **kwargs):
+    typeahead_product_changed(instance, deleted=True)
+
+
+@receiver(post_save, sender=SubCategory)
+def update_typeahead_subcategory(sender, instance, **kwargs):
+    typeahead_subcategory_changed(instance)
+
+
+@receiver(post_delete, sender=SubCategory)
+def remove_typeahead_subcategory(sender, instance, **kwargs):
+    typeahead_subcategory_changed(instance, deleted=True)
+
+
+#catalog bitmaps
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def update_product_bitmaps(sender, instance, **kwargs):
+    if settings.CATALOG_BITMAP_INDEX:
+        bitmaps_products_changed([instance.id])
+
+
+@receiver(post_save, sender=ProductVariant)
+@receiver(post_delete, sender=ProductVariant)
+def update_variant_bitmaps(sender, instance, **kwargs):
+    if settings.CATALOG_BITMAP_INDEX:
+        bitmaps_products_changed([instance.product_id])
@@ -0,0 +1,93 @@
+from django.db.models import Count, F, IntegerField, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from .models import Product, ProductReview, ProductStats, ProductVariant
+
+
+def ensure_stats(product_ids):
+    ProductStats.objects.bulk_create(
+        [ProductStats(product_id=product_id) for product_id in product_ids],
+        batch_size=2000,
+        ignore_conflicts=True,
+    )
+
+
+def _aggregate_subquery(queryset, aggregate):
+    # correlated on the ProductStats row being updated
+    return Coalesce(
+        Subquery(
+            queryset.filter(product=OuterRef("product_id"))
+            .order_by()
+            .values("product")
+            .annotate(value=aggregate)
+            .values("value")[:1],
+            output_field=IntegerField(),
+        ),
+        Value(0),
+    )
+
+
+def stock_aggregates():
+    variants = ProductVariant.objects.filter(is_active=True)
+    return {
+        "total_stock": _aggregate_subquery(variants, Sum("stock")),
+        "in_stock_variant_count": _aggregate_subquery(variants, Count("id", filter=Q(stock__gt=0))),
+    }
+
+
+def review_aggregates():
+    aggregates = {
+        "rating_sum": _aggregate_subquery(ProductReview.objects, Sum("rating")),
+        "review_count": _aggregate_subquery(ProductReview.objects, Count("id")),
+    }
+    for star in range(1, 6):
+        aggregates[f"rating_{star}"] = _aggregate_subquery(
+            ProductReview.objects, Count("id", filter=Q(rating=star))
+        )
+    return aggregates
+
+
+def _update_stats(product_ids, aggregates):
+    # one UPDATE ... SET col = (SELECT ...), no rows loaded into Python
+    stats = ProductStats.objects.all()
+    if product_ids is not None:
+        stats = stats.filter(product_id__in=product_ids)
+    return stats.update(**aggregates)
+
+
+def refresh_stock_stats(product_ids):
+    """Recomputes stock aggregates, call after stock changes that bypass ProductVariant.save()."""
+    product_ids = set(product_ids)
+    if not product_ids:
+        return 0
+
+    ensure_stats(product_ids)
+    return _update_stats(product_ids, stock_aggregates())
+
+
+def rebuild_product_stats():
+    ensure_stats(Product.objects.values_list("id", flat=True))
+    return _update_stats(None, {**review_aggregates(), **stock_aggregates()})
+
+
+def apply_review_delta(product_id, old_rating=None, new_rating=None):
+    """Adjusts review aggregates for one created (old=None), edited or deleted (new=None) review."""
+    ensure_stats([product_id])
+
+    changes = {}
+    if old_rating is not None:
+        changes[f"rating_{old_rating}"] = -1
+    if new_rating is not None:
+        changes[f"rating_{new_rating}"] = changes.get(f"rating_{new_rating}", 0) + 1
+
+    updates = {field: F(field) + delta for field, delta in changes.items() if delta}
+    if old_rating is None:
+        updates["review_count"] = F("review_count") + 1
+    elif new_rating is None:
+        updates["review_count"] = F("review_count") - 1
+
+    rating_delta = (new_rating or 0) - (old_rating or 0)
+    if rating_delta:
+        updates["rating_sum"] = F("rating_sum") + rating_delta
+
+    if updates:
+        ProductStats.objects.filter(product_id=product_id).update(**updates)
@@ -1,3 +1,67 @@
+from unittest import mock, skipUnless
+from django.core.cache import cache
+from django.db import connection
 from django.test import TestCase
+from .models import Product, SubCategory
+from .recommendations import get_popular_product_ids, rebuild_recommendations
+from .search import search_products
 
-# Create your tests here.
+
+@skipUnless(connection.vendor == "sqlite", "the FTS5 backend is only used on SQLite")
+class SQLiteSearchTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        running = SubCategory.objects.create(name="Running", category="MEN")
+        # indexed by the post_save signal
+        cls.air_max = Product.objects.create(
+            name="Nike Air Max", price=9000, color="white", category="MEN", subcategory=running,
+        )
+        cls.air_force = Product.objects.create(name="Air Force", price=8000, color="black", category="MEN")
+        cls.loafer = Product.objects.create(
+            name="City Loafer", price=4000, color="brown", category="MEN",
+            description="Light enough to wear on a run to the station",
+        )
+        cls.runner = Product.objects.create(name="Trail Runner", price=6000, color="red", category="WOMEN")
+
+    def search(self, query):
+        return list(search_products(Product.objects.all(), query).order_by("-search_rank", "id"))
+
+    def test_every_word_must_match(self):
+        self.assertEqual(self.search("air max"), [self.air_max])
+        self.assertEqual(set(self.search("air")), {self.air_max, self.air_force})
+
+    def test_words_match_as_prefixes(self):
+        self.assertIn(self.runner, self.search("run"))
+        self.assertEqual(self.search("runn wom"), [self.runner])
+
+    def test_name_matches_rank_above_description_matches(self):
+        results = self.search("run")
+        self.assertEqual(set(results), {self.air_max, self.loafer, self.runner})
+        # "Trail Runner" by name, "Running" by subcategory, the loafer only by its description
+        self.assertEqual(results[0], self.runner)
+        self.assertEqual(results[-1], self.loafer)
+
+    def test_matches_are_capped(self):
+        with mock.patch("products.search.SQLITE_MAX_MATCHES", 2):
+            self.assertEqual(len(self.search("air")), 2)
+            self.assertEqual(len(self.search("r")), 2)
+
+    def test_punctuation_is_not_fts_syntax(self):
+        self.assertEqual(self.search('"air" max*'), [self.air_max])
+        self.assertEqual(len(search_products(Product.objects.all(), "--")), 4)
+
+
+class PopularProductsTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_a_build_of_an_empty_catalogue_is_not_served_forever(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            build = rebuild_recommendations()
+        self.assertEqual(build.popular_product_ids, [])
+
+        product = Product.objects.create(name="Court Classic", price=3000, color="white", category="MEN")
+
+        self.assertEqual(get_popular_product_ids(), [product.id])
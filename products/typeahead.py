@@ -0,0 +1,404 @@
+import heapq
+import logging
+import re
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Sum
+from .models import Product, SubCategory
+
+
+logger = logging.getLogger(__name__)
+
+
+TYPEAHEAD_VERSION_KEY = "typeahead:version"
+
+# full rebuild, mainly to pick up new sales counts
+TYPEAHEAD_MAX_AGE = 60 * 15
+
+# how often a process checks whether another process changed the catalog
+TYPEAHEAD_SYNC_INTERVAL = 60
+
+TYPEAHEAD_MAX_RESULTS = 10
+
+# memory bound: at most MAX_WORD_STARTS keys of MAX_KEY_LENGTH chars per entry
+MAX_KEY_LENGTH = 32
+MAX_WORD_STARTS = 3
+
+# prefixes matching more keys than this have their ranking memoized until the next change
+WIDE_PREFIX_KEYS = 256
+MAX_MEMOIZED_PREFIXES = 2048
+
+KIND_PRIORITY = {"subcategory": 2, "color": 1, "product": 0}
+
+# (version, index, built_at, checked_at) for this process
+_local_index = (None, None, 0, 0)
+
+# at most one rebuild per process, requests keep reading the old index meanwhile
+_rebuild_lock = threading.Lock()
+_rebuilding = False
+
+
+def normalize(text):
+    return " ".join(re.findall(r"[^\W_]+", (text or "").lower()))
+
+
+def index_keys(label):
+    """The label from each of its first few word starts, so "air" finds "Nike Air Max"."""
+    words = normalize(label).split()
+    keys = set()
+    for i in range(min(len(words), MAX_WORD_STARTS)):
+        keys.add(" ".join(words[i:])[:MAX_KEY_LENGTH])
+    return keys
+
+
+class Suggestion:
+    __slots__ = ("kind", "target", "label", "category", "popularity")
+
+    def __init__(self, kind, target, label, category=None, popularity=0):
+        self.kind = kind
+        self.target = target
+        self.label = label
+        self.category = category
+        self.popularity = popularity
+
+    def rank(self):
+        return (self.popularity, KIND_PRIORITY[self.kind], -len(self.label))
+
+    def as_dict(self):
+        return {"type": self.kind, "id": self.target, "label": self.label, "category": self.category}
+
+
+class PrefixIndex:
+    """
+    Sorted keys with bisect for active product names, colors and subcategory names.
+    Keys and their entry slots are parallel arrays, so memory grows linearly
+    (roughly 600 bytes per product); every read and write holds the lock.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.keys = []
+        self.slots = array("l")
+        self.entries = {}           # slot -> Suggestion
+        self.slot_of = {}           # (kind, target) -> slot
+        self.next_slot = 0
+        self.memo = {}
+
+        self.products = {}          # product id -> (color, subcategory id)
+        self.subcategories = {}     # active subcategory id -> (name, category)
+        self.group_counts = {}      # ("color", color) / ("subcategory", id) -> active products
+
+    # keys
+
+    def _rerank(self, entry, removed=False):
+        """Patches memoized rankings for prefixes of this entry's keys."""
+        prefixes = {key[:end] for key in index_keys(entry.label) for end in range(1, len(key) + 1)}
+        for prefix in prefixes & self.memo.keys():
+            ranked = self.memo[prefix]
+            if any(e is entry for e in ranked):
+                # it may drop below entries that are not in the list, recompute on next read
+                del self.memo[prefix]
+            elif not removed and (
+                len(ranked) < TYPEAHEAD_MAX_RESULTS or entry.rank() > ranked[-1].rank()
+            ):
+                self.memo[prefix] = sorted(ranked + [entry], key=Suggestion.rank, reverse=True)[:TYPEAHEAD_MAX_RESULTS]
+
+    def _insert(self, kind, target, label, category=None, popularity=0):
+        self._delete(kind, target)
+
+        slot = self.next_slot
+        self.next_slot += 1
+        entry = self.entries[slot] = Suggestion(kind, target, label, category, popularity)
+        self.slot_of[(kind, target)] = slot
+        self._rerank(entry)
+
+        for key in index_keys(label):
+            i = bisect_left(self.keys, key)
+            self.keys.insert(i, key)
+            self.slots.insert(i, slot)
+
+    def _delete(self, kind, target):
+        slot = self.slot_of.pop((kind, target), None)
+        if slot is None:
+            return None
+
+        entry = self.entries.pop(slot)
+        self._rerank(entry, removed=True)
+        for key in index_keys(entry.label):
+            i = bisect_left(self.keys, key)
+            while i < len(self.keys) and self.keys[i] == key:
+                if self.slots[i] == slot:
+                    del self.keys[i]
+                    del self.slots[i]
+                    break
+                i += 1
+        return entry
+
+    def _load(self, entries):
+        """Bulk load into an empty index, one sort instead of an insert per key."""
+        pairs = []
+        for entry in entries:
+            slot = self.next_slot
+            self.next_slot += 1
+            self.entries[slot] = entry
+            self.slot_of[(entry.kind, entry.target)] = slot
+            pairs.extend((key, slot) for key in index_keys(entry.label))
+
+        pairs.sort()
+        self.keys = [key for key, _ in pairs]
+        self.slots = array("l", (slot for _, slot in pairs))
+
+    # colors and subcategories are shown while at least one active product has them
+
+    def _count(self, group, delta):
+        count = self.group_counts.get(group, 0) + delta
+        if count > 0:
+            self.group_counts[group] = count
+        else:
+            self.group_counts.pop(group, None)
+        self._sync_group(group)
+
+    def _sync_group(self, group):
+        kind, target = group
+        count = self.group_counts.get(group, 0)
+
+        if kind == "subcategory" and target not in self.subcategories:
+            count = 0
+
+        if not count:
+            self._delete(kind, target)
+            return
+
+        slot = self.slot_of.get(group)
+        if slot is not None:
+            entry = self.entries[slot]
+            entry.popularity = count
+            self._rerank(entry)
+        elif kind == "color":
+            self._insert("color", target, target, popularity=count)
+        else:
+            name, category = self.subcategories[target]
+            self._insert("subcategory", target, name, category, count)
+
+    # public updates
+
+    def update_product(self, product_id, name=None, color=None, subcategory_id=None, category=None, active=True):
+        with self.lock:
+            old = self.products.pop(product_id, None)
+            entry = self._delete("product", product_id)
+            if old:
+                if old[0]:
+                    self._count(("color", old[0]), -1)
+                if old[1]:
+                    self._count(("subcategory", old[1]), -1)
+
+            if not active:
+                return
+
+            color = normalize(color)
+            self.products[product_id] = (color, subcategory_id)
+            self._insert("product", product_id, name, category, entry.popularity if entry else 0)
+            if color:
+                self._count(("color", color), 1)
+            if subcategory_id:
+                self._count(("subcategory", subcategory_id), 1)
+
+    def update_subcategory(self, subcategory_id, name=None, category=None, active=True):
+        with self.lock:
+            self._delete("subcategory", subcategory_id)
+            self.subcategories.pop(subcategory_id, None)
+            if active:
+                self.subcategories[subcategory_id] = (name, category)
+            self._sync_group(("subcategory", subcategory_id))
+
+    # reads
+
+    def suggest(self, query, limit=TYPEAHEAD_MAX_RESULTS):
+        prefix = normalize(query)[:MAX_KEY_LENGTH]
+        if not prefix:
+            return []
+
+        with self.lock:
+            ranked = self.memo.get(prefix)
+            if ranked is None:
+                lo = bisect_left(self.keys, prefix)
+                hi = bisect_left(self.keys, prefix + "\uffff", lo)
+
+                # an entry can match on more than one of its word starts
+                matches = {self.slots[i] for i in range(lo, hi)}
+                ranked = heapq.nlargest(
+                    TYPEAHEAD_MAX_RESULTS,
+                    (self.entries[slot] for slot in matches),
+                    key=Suggestion.rank,
+                )
+
+                if hi - lo > WIDE_PREFIX_KEYS:
+                    if len(self.memo) >= MAX_MEMOIZED_PREFIXES:
+                        self.memo.clear()
+                    self.memo[prefix] = ranked
+
+            return [entry.as_dict() for entry in ranked[:limit]]
+
+    def __len__(self):
+        return len(self.entries)
+
+
+def build_typeahead_index():
+    from shop.models import OrderItem
+
+    units_sold = dict(
+        OrderItem.objects.exclude(status__in=["Cancelled", "Returned", "Refunded"])
+        .order_by()
+        .values_list("variant__product")
+        .annotate(units=Sum("quantity"))
+    )
+
+    index = PrefixIndex()
+    index.subcategories = {
+        sub_id: (name, category)
+        for sub_id, name, category in SubCategory.objects.filter(is_active=True).values_list("id", "name", "category")
+    }
+
+    entries = []
+    for product_id, name, color, subcategory_id, category in (
+        Product.objects.filter(is_active=True).values_list("id", "name", "color", "subcategory_id", "category").iterator()
+    ):
+        color = normalize(color)
+        index.products[product_id] = (color, subcategory_id)
+        entries.append(Suggestion("product", product_id, name, category, units_sold.get(product_id, 0)))
+
+        if color:
+            index.group_counts[("color", color)] = index.group_counts.get(("color", color), 0) + 1
+        if subcategory_id:
+            group = ("subcategory", subcategory_id)
+            index.group_counts[group] = index.group_counts.get(group, 0) + 1
+
+    for (kind, target), count in index.group_counts.items():
+        if kind == "color":
+            entries.append(Suggestion("color", target, target, popularity=count))
+        elif target in index.subcategories:
+            name, category = index.subcategories[target]
+            entries.append(Suggestion("subcategory", target, name, category, count))
+
+    index._load(entries)
+
+    # single letters are the widest ranges, rank them up front
+    for letter in {key[0] for key in index.keys}:
+        index.suggest(letter)
+
+    return index
+
+
+def _shared_version():
+    version = cache.get(TYPEAHEAD_VERSION_KEY)
+    if version is None:
+        # never restart from a fixed number, an evicted version must not match an old index
+        cache.add(TYPEAHEAD_VERSION_KEY, time.time_ns(), None)
+        version = cache.get(TYPEAHEAD_VERSION_KEY)
+    return version
+
+
+def _bump_version():
+    """Atomically moves the shared version on and returns the new one."""
+    try:
+        return cache.incr(TYPEAHEAD_VERSION_KEY)
+    except ValueError:
+        _shared_version()
+        return cache.incr(TYPEAHEAD_VERSION_KEY)
+
+
+def _rebuild(version):
+    global _local_index, _rebuilding
+    try:
+        index = build_typeahead_index()
+        now = time.monotonic()
+        # stamped with the version read before the build, a change made meanwhile triggers another
+        _local_index = (version, index, now, now)
+    except Exception:
+        logger.exception("Could not rebuild the typeahead index")
+    finally:
+        with _rebuild_lock:
+            _rebuilding = False
+        # the thread's own database connection
+        connection.close()
+
+
+def _rebuild_in_background(version):
+    global _rebuilding
+    with _rebuild_lock:
+        if _rebuilding:
+            return
+        _rebuilding = True
+    threading.Thread(target=_rebuild, args=(version,), daemon=True).start()
+
+
+def get_typeahead_index():
+    """
+    This process's index. Changes saved in this process are applied in place;
+    changes from other processes, and age, trigger a rebuild within
+    TYPEAHEAD_SYNC_INTERVAL. It runs in a background thread while requests keep
+    reading the old index, only the first request of a process waits for a build.
+    """
+    global _local_index
+    now = time.monotonic()
+
+    version, index, built_at, checked_at = _local_index
+    if index is not None and now - checked_at < TYPEAHEAD_SYNC_INTERVAL:
+        return index
+
+    shared_version = _shared_version()
+    if index is None:
+        index = build_typeahead_index()
+        _local_index = (shared_version, index, now, now)
+        return index
+
+    if shared_version != version or now - built_at >= TYPEAHEAD_MAX_AGE:
+        _rebuild_in_background(shared_version)
+    _local_index = (version, index, built_at, now)
+    return index
+
+
+def _changed(apply):
+    """Applies a change to this process's index (if built) and tells the other processes."""
+    global _local_index
+    version, index, built_at, checked_at = _local_index
+
+    new_version = _bump_version()
+    if index is None:
+        return
+
+    apply(index)
+    if version == new_version - 1:
+        _local_index = (new_version, index, built_at, checked_at)
+    else:
+        # behind another process's changes, stamping it would hide them: keep the old
+        # stamp so the next read rebuilds, and serve this index with the change until then
+        _local_index = (version, index, built_at, 0)
+
+
+def typeahead_product_changed(product, deleted=False):
+    _changed(lambda index: index.update_product(
+        product.id,
+        name=product.name,
+        color=product.color,
+        subcategory_id=product.subcategory_id,
+        category=product.category,
+        active=product.is_active and not deleted,
+    ))
+
+
+def typeahead_subcategory_changed(subcategory, deleted=False):
+    _changed(lambda index: index.update_subcategory(
+        subcategory.id,
+        name=subcategory.name,
+        category=subcategory.category,
+        active=subcategory.is_active and not deleted,
+    ))
+
+
+def suggest(query, limit=TYPEAHEAD_MAX_RESULTS):
+    return get_typeahead_index().suggest(query, limit)
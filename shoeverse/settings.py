@@ -141,6 +141,40 @@ DATABASES = {
 }
 
 
+# Cache
+# Shared across workers when REDIS_URL is set, otherwise local to each process
+
+if os.getenv("REDIS_URL"):
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": os.getenv("REDIS_URL"),
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        }
+    }
+
+# Answer catalog filters from in-process bitmaps (products.bitmaps) instead of SQL joins
+CATALOG_BITMAP_INDEX = os.getenv("CATALOG_BITMAP_INDEX", "").lower() in ("1", "true")
+
+# Seconds anonymous catalog pages are served from the page cache (shop.page_cache), 0 disables it
+PAGE_CACHE_TTL = int(os.getenv("PAGE_CACHE_TTL", "60"))
+
+# Seconds stock stays held for an online payment before shop.reservations releases it
+STOCK_HOLD_TTL = int(os.getenv("STOCK_HOLD_TTL", "900"))
+
+# Where flash-sale admission queues live (shop.admission): "database" for any deployment,
+# "local" keeps them in process memory and is only correct with a single server process
+FLASH_SALE_QUEUE = os.getenv("FLASH_SALE_QUEUE", "database")
+
+# Seconds an admitted flash-sale buyer has to place the order before the stock goes back on sale
+FLASH_SALE_ADMISSION_TTL = int(os.getenv("FLASH_SALE_ADMISSION_TTL", "300"))
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -286,6 +320,18 @@ SESSION_SAVE_EVERY_REQUEST = True
 RAZORPAY_KEY_ID = os.getenv("RAZORPAY_KEY_ID")
 RAZORPAY_KEY_SECRET = os.getenv("RAZORPAY_KEY_SECRET")
 
+# Gateway class payments go through, payments.gateway.FakeGateway answers locally for tests and benchmarks
+PAYMENT_GATEWAY = os.getenv("PAYMENT_GATEWAY", "payments.gateway.RazorpayGateway")
+
+# Seconds to wait for a payment gateway response before the call fails (payments.client)
+PAYMENT_GATEWAY_TIMEOUT = float(os.getenv("PAYMENT_GATEWAY_TIMEOUT", "10"))
+
+# Connections to the payment gateway each process keeps alive, about one per worker thread
+PAYMENT_GATEWAY_POOL_SIZE = int(os.getenv("PAYMENT_GATEWAY_POOL_SIZE", "10"))
+
+# Seconds a gateway order is reused for the same payment before a fresh one is created (payments.intents)
+PAYMENT_INTENT_TTL = int(os.getenv("PAYMENT_INTENT_TTL", "1800"))
+
 SECURE_CROSS_ORIGIN_OPENER_POLICY = "same-origin-allow-popups"
 
 CSRF_TRUSTED_ORIGINS = [
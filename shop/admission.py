@@ -0,0 +1,329 @@
+import itertools
+import logging
+import threading
+import time
+from collections import deque
+from datetime import timedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError, connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from products.models import ProductVariant
+from products.offer_cache import get_offer_index
+from .models import AdmissionTicket, StockHold
+from .orders import stock_changed, variant_quantities
+
+
+# During a flash sale checkout does not race for a hot variant's row. Every buyer
+# gets a ticket in the variant's queue, and a single worker per variant hands out
+# its stock in arrival order, a batch of tickets per locked read and UPDATE.
+# Admitted buyers get a StockHold of their units, which place_order then converts.
+
+logger = logging.getLogger(__name__)
+
+# tickets decided per allocation transaction
+ADMISSION_BATCH_SIZE = 50
+
+# a database queue worker's lock, outlives a crashed worker by at most this long
+WORKER_LOCK_TTL = 30
+
+# a local worker thread with nothing queued exits after this many seconds
+LOCAL_WORKER_IDLE = 30
+
+# decided tickets a local queue keeps around for polling
+LOCAL_TICKETS_KEPT = 10000
+
+
+def flash_sale_lines(items):
+    """The cart lines whose product is in a running flash sale offer."""
+    index = get_offer_index()
+    return [
+        item for item in items
+        if index.in_flash_sale(item.variant.product_id, item.variant.product.subcategory_id)
+    ]
+
+
+def sold_out_since():
+    """
+    A buyer's sold out ticket stays final after this moment: units only come back
+    when admissions granted to others expire, which takes at most as long.
+    """
+    return timezone.now() - timedelta(seconds=settings.FLASH_SALE_ADMISSION_TTL)
+
+
+def allocate_batch(variant_id, tickets):
+    """
+    Decides one variant's tickets in arrival order: a ticket is admitted when the
+    units still available cover it, with a StockHold for its user, else it is sold
+    out. One locked read and one UPDATE of the variant row for the whole batch.
+    Returns (admitted, sold_out), the ticket statuses are left to the queue.
+    """
+    with transaction.atomic():
+        variant = ProductVariant.objects.select_for_update().only("stock", "reserved", "product_id").filter(id=variant_id).first()
+        if variant is None:
+            return [], list(tickets)
+
+        available = variant.available_stock
+        admitted, sold_out = [], []
+        for ticket in tickets:
+            if ticket.quantity <= available:
+                available -= ticket.quantity
+                admitted.append(ticket)
+            else:
+                sold_out.append(ticket)
+
+        if admitted:
+            ProductVariant.objects.filter(id=variant_id).update(
+                reserved=F("reserved") + sum(ticket.quantity for ticket in admitted),
+            )
+            expires_at = timezone.now() + timedelta(seconds=settings.FLASH_SALE_ADMISSION_TTL)
+            StockHold.objects.bulk_create([
+                StockHold(user_id=ticket.user_id, variant_id=variant_id, quantity=ticket.quantity, expires_at=expires_at)
+                for ticket in admitted
+            ])
+            stock_changed([variant.product_id])
+    return admitted, sold_out
+
+
+class DatabaseQueue:
+    """
+    Tickets are AdmissionTicket rows, so any process can queue a buyer. The poll
+    endpoint pumps a variant's queue and the run_admission_queue command drains
+    it. Workers claim their batch in the database, the variant's cache lock only
+    saves a second worker the trip when the cache is shared.
+    """
+
+    def enqueue(self, user_id, variant_id, quantity):
+        """The buyer's queued or recently sold out ticket for the variant, else a new one at the back of the queue."""
+        ticket = (
+            AdmissionTicket.objects.filter(user_id=user_id, variant_id=variant_id)
+            .filter(Q(status=AdmissionTicket.QUEUED) | Q(status=AdmissionTicket.SOLD_OUT, decided_at__gte=sold_out_since()))
+            .order_by("-id")
+            .first()
+        )
+        if ticket is None:
+            ticket = AdmissionTicket.objects.create(user_id=user_id, variant_id=variant_id, quantity=quantity)
+        return ticket
+
+    def get(self, ticket_id, user_id):
+        return AdmissionTicket.objects.filter(id=ticket_id, user_id=user_id).first()
+
+    def position(self, ticket):
+        """Tickets ahead of this one in its variant's queue."""
+        return AdmissionTicket.objects.filter(
+            variant_id=ticket.variant_id, status=AdmissionTicket.QUEUED, id__lt=ticket.id,
+        ).count()
+
+    def pump(self, variant_id):
+        """Decides the next batch of the variant's queue, unless another worker holds it. Returns how many were decided."""
+        lock = f"admission:worker:{variant_id}"
+        if not cache.add(lock, 1, WORKER_LOCK_TTL):
+            return 0
+        try:
+            with transaction.atomic():
+                # skip_locked, tickets another worker is deciding are its own
+                tickets = list(
+                    AdmissionTicket.objects.filter(variant_id=variant_id, status=AdmissionTicket.QUEUED)
+                    .select_for_update(skip_locked=True)
+                    .order_by("id")[:ADMISSION_BATCH_SIZE]
+                )
+                return self.decide(variant_id, tickets)
+        finally:
+            cache.delete(lock)
+
+    def decide(self, variant_id, tickets):
+        """Claims and decides tickets read as queued. Returns how many were decided, 0 when another worker got to them first."""
+        if not tickets:
+            return 0
+
+        with transaction.atomic():
+            # the claim: a worker that read the same tickets before they were decided
+            # updates fewer rows here and backs off, so a ticket is never decided twice
+            now = timezone.now()
+            claimed = AdmissionTicket.objects.filter(
+                id__in=[ticket.id for ticket in tickets], status=AdmissionTicket.QUEUED,
+            ).update(decided_at=now)
+            if claimed < len(tickets):
+                transaction.set_rollback(True)
+                return 0
+
+            admitted, sold_out = allocate_batch(variant_id, tickets)
+            for status, decided in ((AdmissionTicket.ADMITTED, admitted), (AdmissionTicket.SOLD_OUT, sold_out)):
+                if decided:
+                    AdmissionTicket.objects.filter(id__in=[ticket.id for ticket in decided]).update(status=status)
+        return len(tickets)
+
+    def drain(self):
+        """Works every variant's queue until empty. Returns how many tickets were decided."""
+        decided = 0
+        for variant_id in AdmissionTicket.objects.filter(status=AdmissionTicket.QUEUED).values_list("variant_id", flat=True).distinct():
+            while batch := self.pump(variant_id):
+                decided += batch
+        return decided
+
+
+class LocalTicket:
+    __slots__ = ("id", "user_id", "variant_id", "quantity", "status", "created_at", "decided_at")
+
+    def __init__(self, ticket_id, user_id, variant_id, quantity):
+        self.id = ticket_id
+        self.user_id = user_id
+        self.variant_id = variant_id
+        self.quantity = quantity
+        self.status = AdmissionTicket.QUEUED
+        self.created_at = timezone.now()
+        self.decided_at = None
+
+
+class LocalQueue:
+    """
+    Queues in process memory with one worker thread per variant, started by the
+    first ticket. For runserver, tests and the flash_sale_benchmark command: a
+    ticket queued by one server process is invisible to the others.
+    """
+
+    def __init__(self, batch_size=ADMISSION_BATCH_SIZE):
+        self.batch_size = batch_size
+        self.changed = threading.Condition()
+        self.ids = itertools.count(1)
+        self.tickets = {}
+        self.queues = {}
+        self.waiting = {}
+        self.sold_out = {}
+        self.workers = {}
+        # (variant id, tickets decided) per allocation, for the benchmark
+        self.batches = []
+
+    def enqueue(self, user_id, variant_id, quantity):
+        with self.changed:
+            ticket = self.waiting.get((user_id, variant_id))
+            if ticket is not None:
+                return ticket
+            ticket = self.sold_out.get((user_id, variant_id))
+            if ticket is not None and ticket.decided_at >= sold_out_since():
+                return ticket
+
+            ticket = LocalTicket(next(self.ids), user_id, variant_id, quantity)
+            self.tickets[ticket.id] = ticket
+            self.waiting[(user_id, variant_id)] = ticket
+            self.queues.setdefault(variant_id, deque()).append(ticket)
+            self._forget_decided()
+
+            if variant_id not in self.workers:
+                worker = threading.Thread(target=self._work, args=(variant_id,), daemon=True)
+                self.workers[variant_id] = worker
+                worker.start()
+            self.changed.notify_all()
+        return ticket
+
+    def get(self, ticket_id, user_id):
+        ticket = self.tickets.get(ticket_id)
+        return ticket if ticket is not None and ticket.user_id == user_id else None
+
+    def position(self, ticket):
+        with self.changed:
+            for position, queued in enumerate(self.queues.get(ticket.variant_id, ())):
+                if queued is ticket:
+                    return position
+        return 0
+
+    def pump(self, variant_id):
+        # the variant's worker thread is already on it
+        return 0
+
+    def wait(self, timeout=None):
+        """Blocks until every ticket queued so far is decided."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.changed:
+            while self.waiting:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.changed.wait(remaining)
+        return True
+
+    def _forget_decided(self):
+        while len(self.tickets) > LOCAL_TICKETS_KEPT:
+            oldest = next(iter(self.tickets.values()))
+            if oldest.status == AdmissionTicket.QUEUED:
+                return
+            del self.tickets[oldest.id]
+
+    def _next_batch(self, variant_id):
+        with self.changed:
+            queue = self.queues[variant_id]
+            while not queue:
+                if not self.changed.wait(LOCAL_WORKER_IDLE) and not queue:
+                    del self.workers[variant_id]
+                    return None
+            return [queue.popleft() for _ in range(min(len(queue), self.batch_size))]
+
+    def _work(self, variant_id):
+        try:
+            while (batch := self._next_batch(variant_id)) is not None:
+                try:
+                    admitted, sold_out = allocate_batch(variant_id, batch)
+                except DatabaseError:
+                    logger.exception("Could not allocate %s admission tickets of variant %s, retrying", len(batch), variant_id)
+                    with self.changed:
+                        self.queues[variant_id].extendleft(reversed(batch))
+                    time.sleep(1)
+                    continue
+
+                now = timezone.now()
+                with self.changed:
+                    for status, decided in ((AdmissionTicket.ADMITTED, admitted), (AdmissionTicket.SOLD_OUT, sold_out)):
+                        for ticket in decided:
+                            ticket.status = status
+                            ticket.decided_at = now
+                            self.waiting.pop((ticket.user_id, variant_id), None)
+                            if status == AdmissionTicket.SOLD_OUT:
+                                self.sold_out[(ticket.user_id, variant_id)] = ticket
+                    self.batches.append((variant_id, len(batch)))
+                    self.changed.notify_all()
+        finally:
+            # the thread's own database connection
+            connection.close()
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_admission_queue():
+    """The queue backend chosen by settings.FLASH_SALE_QUEUE, one per process."""
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = LocalQueue() if settings.FLASH_SALE_QUEUE == "local" else DatabaseQueue()
+        return _queue
+
+
+def admitted_quantities(user):
+    """{variant id: units} the user's active admissions hold."""
+    return variant_quantities(
+        StockHold.objects.filter(user=user, payment=None, status=StockHold.ACTIVE).only("variant_id", "quantity")
+    )
+
+
+def admit(user, items):
+    """
+    Queues a ticket for every flash-sale line the user's admissions do not cover
+    yet and gives each queue a pump. Returns the tickets as they stand now, none
+    when checkout can go ahead.
+    """
+    needed = variant_quantities(flash_sale_lines(items))
+    if not needed:
+        return []
+
+    admitted = admitted_quantities(user)
+    queue = get_admission_queue()
+    tickets = [
+        queue.enqueue(user.pk, variant_id, quantity - admitted[variant_id])
+        for variant_id, quantity in needed.items()
+        if quantity > admitted[variant_id]
+    ]
+    for ticket in tickets:
+        queue.pump(ticket.variant_id)
+    return [queue.get(ticket.id, user.pk) for ticket in tickets]
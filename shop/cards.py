@@ -0,0 +1,77 @@
+import uuid
+from django.core.cache import cache
+from django.db.models import prefetch_related_objects
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+from products.models import ProductVariant
+
+
+CARD_TEMPLATE = "shop/partials/product_card.html"
+CARD_CACHE_TTL = 60 * 60
+
+
+def _version_key(product_id):
+    return f"card:version:{product_id}"
+
+
+def get_card_versions(product_ids):
+    keys = {product_id: _version_key(product_id) for product_id in product_ids}
+    found = cache.get_many(keys.values())
+
+    versions = {}
+    missing = {}
+    for product_id, key in keys.items():
+        if key in found:
+            versions[product_id] = found[key]
+        else:
+            # never fall back to a fixed default, an evicted token must not revive old fragments
+            versions[product_id] = missing[key] = uuid.uuid4().hex
+    if missing:
+        cache.set_many(missing, None)
+    return versions
+
+
+def bump_card_versions(product_ids):
+    """Call when anything shown on these products' cards changes."""
+    product_ids = set(product_ids)
+    if product_ids:
+        cache.set_many({_version_key(product_id): uuid.uuid4().hex for product_id in product_ids}, None)
+
+
+def _attach_first_available_variants(products):
+    first = {}
+    for variant in ProductVariant.objects.filter(
+        product__in=products, stock__gt=0, is_active=True
+    ):
+        # Meta ordering is by numeric size, so the first one seen is the smallest
+        first.setdefault(variant.product_id, variant)
+
+    for product in products:
+        product.first_available_variant = first.get(product.id)
+
+
+def render_product_cards(products):
+    """
+    [(product, html)] for a page of products from the listing queryset
+    (with_pricing() and the stats annotations). Cached fragments are keyed by
+    product id, its version token and its current discount, so an offer
+    starting or ending changes the key even without a bump.
+    """
+    products = list(products)
+    versions = get_card_versions([p.id for p in products])
+    keys = {
+        p.id: f"card:{p.id}:{versions[p.id]}:{p.offer_percentage}"
+        for p in products
+    }
+    cached = cache.get_many(keys.values())
+
+    misses = [p for p in products if keys[p.id] not in cached]
+    if misses:
+        prefetch_related_objects(misses, "images")
+        _attach_first_available_variants(misses)
+
+        rendered = {keys[p.id]: render_to_string(CARD_TEMPLATE, {"p": p}) for p in misses}
+        cache.set_many(rendered, CARD_CACHE_TTL)
+        cached.update(rendered)
+
+    return [(p, mark_safe(cached[keys[p.id]])) for p in products]
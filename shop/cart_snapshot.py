@@ -0,0 +1,262 @@
+import uuid
+from decimal import Decimal
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Prefetch
+from django.utils import timezone
+from coupons.models import Coupon
+from products.models import Product
+from .models import MAX_LINE_QUANTITY, CartItem
+
+
+GST_RATE = Decimal("0.18")
+
+FREE_DELIVERY_THRESHOLD = Decimal("1000")
+DELIVERY_CHARGE = Decimal("100")
+
+CENTS = Decimal("0.01")
+
+# why a session coupon does not apply to this cart
+COUPON_EXPIRED = "expired"
+COUPON_MIN_CART_VALUE = "min_cart_value"
+COUPON_CATEGORY = "category"
+
+
+class CartTotals:
+    """Money figures for a cart subtotal, with or without a coupon discount."""
+
+    __slots__ = (
+        "subtotal", "discount_amount", "taxable_amount", "gst",
+        "delivery_charge", "grand_total", "total_items",
+    )
+
+    def __init__(self, subtotal, total_items, coupon=None):
+        self.total_items = total_items
+        self.subtotal = subtotal.quantize(CENTS)
+
+        discount = Decimal("0")
+        if coupon is not None:
+            if coupon.discountType == "percent":
+                discount = self.subtotal * coupon.discountValue / 100
+            else:
+                discount = coupon.discountValue
+        self.discount_amount = min(discount, self.subtotal).quantize(CENTS)
+
+        self.taxable_amount = (self.subtotal - self.discount_amount).quantize(CENTS)
+        self.gst = (self.taxable_amount * GST_RATE).quantize(CENTS)
+
+        if not total_items:
+            self.delivery_charge = Decimal("0.00")
+        elif self.taxable_amount >= FREE_DELIVERY_THRESHOLD:
+            self.delivery_charge = Decimal("0.00")
+        else:
+            self.delivery_charge = DELIVERY_CHARGE
+        self.grand_total = (self.taxable_amount + self.gst + self.delivery_charge).quantize(CENTS)
+
+    @classmethod
+    def for_items(cls, items, coupon=None):
+        return cls(
+            sum((item.total_price for item in items), Decimal("0")),
+            sum(item.quantity for item in items),
+            coupon,
+        )
+
+    @property
+    def is_free_delivery(self):
+        return self.delivery_charge == 0
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class CartSnapshot:
+    """
+    A user's cart priced once: lines with their variant, priced product, images and
+    sizes, plus the session coupon, loaded in a fixed number of queries whatever the
+    cart size. Views read lines and totals from here instead of pricing items again.
+    """
+
+    def __init__(self, items, coupon_code=None, coupon=None):
+        self.items = items
+        self.coupon_code = coupon_code
+
+        # listed = both the product and the size are active
+        self.unlisted_items = [item for item in items if not _is_listed(item)]
+        listed = [item for item in items if _is_listed(item)]
+        self.listed_items = listed
+        self.in_stock_items = [item for item in listed if item.variant.stock > 0]
+        self.out_of_stock_items = [item for item in listed if item.variant.stock <= 0]
+
+        # computed before the coupon check, the minimum cart value is compared to it
+        self.base_totals = CartTotals.for_items(self.in_stock_items)
+
+        # the session's coupon as loaded, and the same coupon once it passed check_coupon
+        self.requested_coupon = coupon
+        self.coupon_problem = self.check_coupon(coupon) if coupon is not None else None
+        self.coupon = coupon if coupon is not None and self.coupon_problem is None else None
+
+        self.totals = CartTotals.for_items(self.in_stock_items, self.coupon) if self.coupon else self.base_totals
+
+    @classmethod
+    def load(cls, user, coupon_code=None):
+        products = (
+            Product.objects.with_pricing()
+            .prefetch_related("images", "variants")
+        )
+        items = list(
+            CartItem.objects.filter(user=user)
+            .select_related("variant")
+            .prefetch_related(Prefetch("variant__product", queryset=products))
+            .order_by("id")
+        )
+        for item in items:
+            # variants are ordered by numeric size on the model
+            item.sorted_variants = item.variant.product.variants.all()
+
+        coupon = None
+        if coupon_code:
+            coupon = Coupon.objects.select_related("category").filter(code=coupon_code, isActive=True).first()
+        return cls(items, coupon_code, coupon)
+
+    def check_coupon(self, coupon):
+        """None when the coupon applies to this cart, else one of the COUPON_* reasons."""
+        today = timezone.localtime().date()
+        if not (timezone.localtime(coupon.validFrom).date() <= today <= timezone.localtime(coupon.validTill).date()):
+            return COUPON_EXPIRED
+        if self.base_totals.subtotal < coupon.minCartValue:
+            return COUPON_MIN_CART_VALUE
+        if coupon.category_id and not any(
+            item.variant.product.subcategory_id == coupon.category_id for item in self.in_stock_items
+        ):
+            return COUPON_CATEGORY
+        return None
+
+    @property
+    def is_empty(self):
+        return not self.in_stock_items
+
+    @property
+    def has_stock_shortfall(self):
+        """Some listed line asks for more than is left of its size."""
+        return any(item.quantity > item.variant.stock for item in self.listed_items)
+
+    def get_item(self, item_id):
+        return next((item for item in self.items if item.id == item_id), None)
+
+    @property
+    def product_ids(self):
+        return {item.variant.product_id for item in self.items}
+
+
+def _is_listed(item):
+    return item.variant.is_active and item.variant.product.is_active
+
+
+def get_cart_snapshot(request, refresh=False):
+    """
+    The cart of request.user with the session coupon, loaded at most once per request.
+    Views reading it after changing the cart or the coupon pass refresh=True.
+    """
+    coupon_code = request.session.get("applied_coupon")
+    snapshot = getattr(request, "_cart_snapshot", None)
+    if snapshot is not None and not refresh and snapshot.coupon_code == coupon_code:
+        return snapshot
+
+    snapshot = CartSnapshot.load(request.user, coupon_code)
+    request._cart_snapshot = snapshot
+    return snapshot
+
+
+# the cart page's running totals, cached between quantity changes so a click costs
+# one UPDATE instead of pricing the whole cart again. Display only, checkout and
+# order placement always price a fresh snapshot.
+
+CART_SUMMARY_TTL = 60 * 10
+CART_SUMMARY_LOCK_TTL = 5
+
+
+class CartSummary:
+    """Unit price and quantity of every in-stock line, with the running subtotal and item count."""
+
+    __slots__ = ("lines", "subtotal", "total_items")
+
+    def __init__(self, lines):
+        self.lines = lines
+        self.subtotal = sum((price * min(quantity, MAX_LINE_QUANTITY) for price, quantity in lines.values()), Decimal("0"))
+        self.total_items = sum(quantity for _, quantity in lines.values())
+
+    def __getstate__(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        return cls({item.id: (item.unit_price, item.quantity) for item in snapshot.in_stock_items})
+
+    def set_quantity(self, item_id, quantity):
+        price, old_quantity = self.lines[item_id]
+        self.lines[item_id] = (price, quantity)
+        self.subtotal += price * (min(quantity, MAX_LINE_QUANTITY) - min(old_quantity, MAX_LINE_QUANTITY))
+        self.total_items += quantity - old_quantity
+
+    def line_total(self, item_id):
+        price, quantity = self.lines[item_id]
+        return price * min(quantity, MAX_LINE_QUANTITY)
+
+    @property
+    def totals(self):
+        return CartTotals(self.subtotal, self.total_items)
+
+
+def _summary_version_key(user_id):
+    return f"cart:summary:version:{user_id}"
+
+
+def _summary_version(user_id):
+    version = cache.get(_summary_version_key(user_id))
+    if version is None:
+        version = uuid.uuid4().hex
+        cache.set(_summary_version_key(user_id), version, None)
+    return version
+
+
+def invalidate_cart_summary(user_id):
+    """Call after the cart changes other than through update_cart_summary."""
+    # a new version, so a change being applied concurrently writes to a dead key
+    transaction.on_commit(lambda: cache.set(_summary_version_key(user_id), uuid.uuid4().hex, None))
+
+
+def remember_cart_summary(request, snapshot=None):
+    """Caches the summary of a freshly loaded snapshot and returns it."""
+    user_id = request.user.pk
+    version = _summary_version(user_id)
+    summary = CartSummary.from_snapshot(snapshot or get_cart_snapshot(request, refresh=True))
+    cache.set(f"cart:summary:{user_id}:{version}", summary, CART_SUMMARY_TTL)
+    return summary
+
+
+def update_cart_summary(request, item_id, quantity):
+    """
+    Applies a quantity change, already saved, to the cached summary and returns it.
+    Falls back to pricing the cart again when the line is not cached or another
+    change to this cart is being applied at the same moment.
+    """
+    user_id = request.user.pk
+    lock = f"cart:summary:lock:{user_id}"
+    if cache.add(lock, 1, CART_SUMMARY_LOCK_TTL):
+        try:
+            key = f"cart:summary:{user_id}:{_summary_version(user_id)}"
+            summary = cache.get(key)
+            if summary is not None and item_id in summary.lines:
+                summary.set_quantity(item_id, quantity)
+                cache.set(key, summary, CART_SUMMARY_TTL)
+                return summary
+        finally:
+            cache.delete(lock)
+    else:
+        invalidate_cart_summary(user_id)
+
+    return remember_cart_summary(request)
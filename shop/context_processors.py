@@ -1,13 +1,15 @@
-from .models import CartItem
+from .user_state import get_cart_count, get_user_state
+
+# nothing under these renders the storefront header
+NON_STOREFRONT_PREFIXES = ("/adminpanel/", "/admin/")
+
 
 def cart_item_count(request):
-    if request.user.is_authenticated:
-       count = CartItem.objects.filter(
-            user=request.user,
-            variant__is_active=True,
-            variant__product__is_active=True
-        ).count()
-
-    else:
-        count = 0
-    return {'cart_item_count' : count}
\ No newline at end of file
+    if request.path.startswith(NON_STOREFRONT_PREFIXES):
+        return {}
+
+    # callables, the template engine only calls them when a template reads the value
+    return {
+        'cart_item_count' : lambda: get_cart_count(request),
+        'user_state': lambda: get_user_state(request),
+    }
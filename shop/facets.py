@@ -0,0 +1,179 @@
+import hashlib
+import json
+from decimal import Decimal, InvalidOperation
+from django.core.cache import cache
+from django.db.models import Count, Q
+from django.db.models.functions import Lower
+from products.models import Product, ProductVariant
+from products.search import search_products
+
+
+CATEGORIES = ["men", "women", "kids"]
+
+FACET_CACHE_TTL = 60
+
+# (min, max) on the final price, max exclusive
+PRICE_BUCKETS = [
+    (Decimal("0"), Decimal("2500")),
+    (Decimal("2500"), Decimal("5000")),
+    (Decimal("5000"), Decimal("10000")),
+    (Decimal("10000"), None),
+]
+
+
+def _price(value):
+    try:
+        value = Decimal(value)
+    except (InvalidOperation, TypeError, ValueError):
+        return None
+    if not value.is_finite() or value < 0:
+        return None
+    return format(value.normalize(), "f")
+
+
+def normalize_filters(params, category=None):
+    """
+    Canonical form of the catalog filters in a GET querydict, so equal filter sets
+    share one facet cache entry and malformed values are dropped instead of erroring.
+    """
+    category = (params.get("category") or category or "").lower()
+    subcategory = params.get("subcategory", "")
+
+    return {
+        "category": category if category in CATEGORIES else "",
+        "q": " ".join(params.get("q", "").split()),
+        "sizes": sorted({size.strip() for size in params.getlist("size") if size.strip()}),
+        "color": params.get("color", "").strip().lower(),
+        "subcategory": int(subcategory) if subcategory.isdigit() else None,
+        "min_price": _price(params.get("min_price") or None),
+        "max_price": _price(params.get("max_price") or None),
+        "in_stock": params.get("in_stock") in ("1", "on", "true"),
+    }
+
+
+def in_stock_variants(sizes=None):
+    variants = ProductVariant.objects.filter(is_active=True, stock__gt=0)
+    if sizes:
+        variants = variants.filter(size__in=sizes)
+    return variants
+
+
+def apply_catalog_filters(products, filters, exclude=None):
+    """
+    Applies every normalized filter except `exclude` ("size", "color", "subcategory"
+    or "price"). Price filters need the queryset annotated by with_pricing().
+    """
+    if filters["category"]:
+        products = products.filter(category=filters["category"].upper())
+
+    if filters["in_stock"]:
+        products = products.filter(id__in=in_stock_variants().values("product_id"))
+
+    if filters["sizes"] and exclude != "size":
+        # same rule as the size facet: only sizes that can actually be bought
+        products = products.filter(id__in=in_stock_variants(filters["sizes"]).values("product_id"))
+
+    if filters["color"] and exclude != "color":
+        # the whole colour, as the colour facet counts it: "red" is not "dark red"
+        products = products.filter(color__iexact=filters["color"])
+
+    if filters["subcategory"] and exclude != "subcategory":
+        products = products.filter(subcategory_id=filters["subcategory"])
+
+    if exclude != "price":
+        if filters["min_price"]:
+            products = products.filter(current_price__gte=filters["min_price"])
+        if filters["max_price"]:
+            products = products.filter(current_price__lte=filters["max_price"])
+
+    return products
+
+
+def _size_key(size):
+    return (0, float(size), size) if size.replace(".", "", 1).isdigit() else (1, 0, size)
+
+
+def compute_facets(filters):
+    """Four grouped queries, one per facet, each ignoring that facet's own filter."""
+    products = Product.objects.filter(is_active=True)
+    if filters["q"]:
+        # resolve the search once, the facet queries only need the matching ids
+        products = products.filter(id__in=search_products(products, filters["q"]).values("id"))
+    products = products.with_pricing()
+
+    sizes = (
+        in_stock_variants()
+        .filter(product__in=apply_catalog_filters(products, filters, exclude="size").values("id"))
+        .order_by()
+        .values("size")
+        .annotate(count=Count("product", distinct=True))
+    )
+
+    colors = (
+        apply_catalog_filters(products, filters, exclude="color")
+        .order_by()
+        .values(value=Lower("color"))
+        .annotate(count=Count("id"))
+    )
+
+    subcategories = (
+        apply_catalog_filters(products, filters, exclude="subcategory")
+        .filter(subcategory__is_active=True)
+        .order_by()
+        .values("subcategory_id", "subcategory__name")
+        .annotate(count=Count("id"))
+    )
+
+    price_counts = apply_catalog_filters(products, filters, exclude="price").aggregate(**{
+        f"bucket_{i}": Count("id", filter=Q(
+            current_price__gte=low,
+            **({"current_price__lt": high} if high is not None else {}),
+        ))
+        for i, (low, high) in enumerate(PRICE_BUCKETS)
+    })
+
+    size_counts = {row["size"]: row["count"] for row in sizes}
+    for size in filters["sizes"]:
+        # keep selected sizes visible so they can be unticked
+        size_counts.setdefault(size, 0)
+
+    return {
+        "sizes": [
+            {"value": size, "count": size_counts[size], "selected": size in filters["sizes"]}
+            for size in sorted(size_counts, key=_size_key)
+        ],
+        "colors": [
+            {"value": row["value"], "count": row["count"], "selected": row["value"] == filters["color"]}
+            for row in sorted(colors, key=lambda row: (-row["count"], row["value"]))
+        ],
+        "subcategories": [
+            {
+                "value": row["subcategory_id"],
+                "label": row["subcategory__name"],
+                "count": row["count"],
+                "selected": row["subcategory_id"] == filters["subcategory"],
+            }
+            for row in sorted(subcategories, key=lambda row: row["subcategory__name"])
+        ],
+        "price_buckets": [
+            {
+                "min": str(low),
+                # the max_price filter is inclusive
+                "max": str(high - Decimal("0.01")) if high is not None else "",
+                "count": price_counts[f"bucket_{i}"],
+                "selected": filters["min_price"] == _price(low) and filters["max_price"] == (
+                    _price(high - Decimal("0.01")) if high is not None else None
+                ),
+            }
+            for i, (low, high) in enumerate(PRICE_BUCKETS)
+        ],
+    }
+
+
+def get_facets(filters):
+    key = "facets:" + hashlib.md5(json.dumps(filters, sort_keys=True).encode()).hexdigest()
+    facets = cache.get(key)
+    if facets is None:
+        facets = compute_facets(filters)
+        cache.set(key, facets, FACET_CACHE_TTL)
+    return facets
@@ -0,0 +1,92 @@
+import statistics
+import threading
+import time
+import uuid
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from products.models import Product, ProductVariant
+from shop.admission import ADMISSION_BATCH_SIZE, LocalQueue
+from shop.models import AdmissionTicket, StockHold
+
+
+class Command(BaseCommand):
+    help = (
+        "Simulate simultaneous buyers of one flash-sale variant through a local admission queue. "
+        "Creates, then deletes, its own hidden product and buyer accounts: run it against a development database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--buyers", type=int, default=1000, help="Buyers arriving at the same moment.")
+        parser.add_argument("--stock", type=int, default=100, help="Units of the variant on sale.")
+        parser.add_argument("--quantity", type=int, default=1, help="Units each buyer asks for.")
+        parser.add_argument("--batch", type=int, default=ADMISSION_BATCH_SIZE, help="Tickets decided per allocation.")
+        parser.add_argument("--poll", type=float, default=0.05, help="Seconds between a buyer's polls.")
+
+    def handle(self, *args, **options):
+        run = uuid.uuid4().hex[:8]
+        User = get_user_model()
+        product = Product.objects.create(
+            name=f"Flash sale benchmark {run}", price=1000, color="none", category="MEN", is_active=False,
+        )
+        variant = ProductVariant.objects.create(product=product, size="9", stock=options["stock"])
+        buyers = User.objects.bulk_create([
+            User(email=f"flash-{run}-{n}@benchmark.invalid", fullName=f"Buyer {n}", referralCode=f"FB{run}{n}")
+            for n in range(options["buyers"])
+        ])
+
+        try:
+            self.run(variant, buyers, options)
+        finally:
+            variant.delete()
+            product.delete()
+            User.objects.filter(id__in=[buyer.id for buyer in buyers]).delete()
+
+    def run(self, variant, buyers, options):
+        queue = LocalQueue(batch_size=options["batch"])
+        start = threading.Barrier(len(buyers))
+        results = []
+
+        def buy(buyer):
+            start.wait()
+            arrived = time.monotonic()
+            ticket = queue.enqueue(buyer.id, variant.id, options["quantity"])
+            polls = 0
+            while ticket.status == AdmissionTicket.QUEUED:
+                queue.position(ticket)
+                polls += 1
+                time.sleep(options["poll"])
+            results.append((ticket, time.monotonic() - arrived, polls))
+
+        threads = [threading.Thread(target=buy, args=(buyer,)) for buyer in buyers]
+        began = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - began
+
+        admitted = sorted(ticket.id for ticket, _, _ in results if ticket.status == AdmissionTicket.ADMITTED)
+        sold_out = sorted(ticket.id for ticket, _, _ in results if ticket.status == AdmissionTicket.SOLD_OUT)
+        waits = sorted(wait for _, wait, _ in results)
+        polls = sum(polls for _, _, polls in results)
+
+        variant.refresh_from_db()
+        held = sum(StockHold.objects.filter(variant=variant).values_list("quantity", flat=True))
+        oversold = held > variant.stock or variant.reserved != held
+        # with equal quantities, arrival order means every admitted ticket came before every sold out one
+        in_order = not admitted or not sold_out or options["quantity"] != 1 or admitted[-1] < sold_out[0]
+
+        self.stdout.write(f"{len(buyers)} buyers, {variant.stock} units, {options['quantity']} per buyer")
+        self.stdout.write(f"Admitted {len(admitted)}, sold out {len(sold_out)}, {held} units held")
+        self.stdout.write(
+            f"{len(queue.batches)} allocation transactions for {len(results)} tickets, "
+            f"{polls} polls, {elapsed:.2f}s, {len(results) / elapsed:.0f} tickets/s"
+        )
+        self.stdout.write(
+            f"Wait p50 {statistics.median(waits) * 1000:.0f}ms, "
+            f"p95 {waits[int(len(waits) * 0.95) - 1] * 1000:.0f}ms, max {waits[-1] * 1000:.0f}ms"
+        )
+        if oversold or not in_order:
+            self.stdout.write(self.style.ERROR(f"Oversold: {oversold}, arrival order kept: {in_order}"))
+        else:
+            self.stdout.write(self.style.SUCCESS("No oversell, stock handed out in arrival order"))
@@ -0,0 +1,18 @@
+import time
+from django.core.management.base import BaseCommand
+from shop.reservations import release_expired_holds
+
+
+class Command(BaseCommand):
+    help = "Put stock held for abandoned online payments back on sale once the holds expire."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--every", type=int, default=0, help="Keep running, sweeping every this many seconds.")
+
+    def handle(self, *args, **options):
+        while True:
+            released = release_expired_holds()
+            self.stdout.write(self.style.SUCCESS(f"Released {released} expired stock holds"))
+            if not options["every"]:
+                return
+            time.sleep(options["every"])
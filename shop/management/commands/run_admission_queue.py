@@ -0,0 +1,20 @@
+import time
+from django.core.management.base import BaseCommand
+from shop.admission import DatabaseQueue
+
+
+class Command(BaseCommand):
+    help = "Decide queued flash-sale admission tickets, a batch per variant at a time."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--every", type=float, default=0, help="Keep running, checking the queues every this many seconds.")
+
+    def handle(self, *args, **options):
+        queue = DatabaseQueue()
+        while True:
+            decided = queue.drain()
+            if decided or not options["every"]:
+                self.stdout.write(self.style.SUCCESS(f"Decided {decided} admission tickets"))
+            if not options["every"]:
+                return
+            time.sleep(options["every"])
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-18 18:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0015_alter_orderitem_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cartitem',
+            name='version',
+            field=models.PositiveIntegerField(default=1),
+        ),
+    ]
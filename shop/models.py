@@ -1,4 +1,5 @@
 from django.db import models
+from django.db.models import Prefetch
 from django.conf import settings
 from products.models import ProductVariant, Product
 from users.models import Address
@@ -7,6 +8,7 @@ from decimal import Decimal
 from datetime import timedelta
 from django.utils import timezone
 from coupons.models import Coupon,CouponUsage
+from payments.models import Payment
 
 import uuid
 
@@ -17,18 +19,41 @@ def generate_order_id():
 # Create your models here.
 
 
+class CartItemQuerySet(models.QuerySet):
+
+    def with_pricing(self):
+        # product is prefetched (not joined) so it carries the offer annotations
+        return self.select_related("variant").prefetch_related(
+            Prefetch("variant__product", queryset=Product.objects.with_pricing())
+        )
+
+
+# most units of one size a cart line can hold
+MAX_LINE_QUANTITY = 4
+
+
 class CartItem(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='cart_items')
     variant = models.ForeignKey(ProductVariant, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField(default=1)
     added_at = models.DateTimeField(auto_now=True)
 
+    # bumped by every change, clients send it back so a stale edit is refused
+    version = models.PositiveIntegerField(default=1)
+
+    objects = CartItemQuerySet.as_manager()
+
     def __str__(self):
         return f"{self.variant.product.name} - Size {self.variant.size} - Qty {self.quantity}"
 
+    def save(self, *args, **kwargs):
+        if self.pk:
+            self.version += 1
+        super().save(*args, **kwargs)
+
     @property
     def total_price(self):
-        quantity = min(self.quantity, 4)
+        quantity = min(self.quantity, MAX_LINE_QUANTITY)
         return self.variant.product.final_price * quantity
     
     @property
@@ -37,6 +62,65 @@ class CartItem(models.Model):
 
 
 
+class StockHold(models.Model):
+    """
+    Units of a variant set aside while their online payment is in progress, or,
+    without a payment, units a flash-sale admission granted to `user`.
+    """
+
+    ACTIVE = "active"
+    CONVERTED = "converted"
+    RELEASED = "released"
+
+    STATUS_CHOICES = [
+        (ACTIVE, "Active"),
+        (CONVERTED, "Converted"),
+        (RELEASED, "Released"),
+    ]
+
+    payment = models.ForeignKey(Payment, on_delete=models.CASCADE, null=True, blank=True, related_name="stock_holds")
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=True, blank=True, related_name="stock_holds")
+    variant = models.ForeignKey(ProductVariant, on_delete=models.CASCADE, related_name="holds")
+    quantity = models.PositiveIntegerField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=ACTIVE)
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["status", "expires_at"])]
+
+    def __str__(self):
+        return f"{self.variant} x {self.quantity} ({self.status})"
+
+
+class AdmissionTicket(models.Model):
+    """A buyer waiting in a flash-sale variant's queue, see shop.admission."""
+
+    QUEUED = "queued"
+    ADMITTED = "admitted"
+    SOLD_OUT = "sold_out"
+
+    STATUS_CHOICES = [
+        (QUEUED, "Queued"),
+        (ADMITTED, "Admitted"),
+        (SOLD_OUT, "Sold out"),
+    ]
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="admission_tickets")
+    variant = models.ForeignKey(ProductVariant, on_delete=models.CASCADE, related_name="admission_tickets")
+    quantity = models.PositiveIntegerField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    created_at = models.DateTimeField(auto_now_add=True)
+    decided_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        # the queue of a variant, in arrival order
+        indexes = [models.Index(fields=["variant", "status", "id"])]
+
+    def __str__(self):
+        return f"{self.user} {self.variant} x {self.quantity} ({self.status})"
+
+
 class Wishlist(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete= models.CASCADE, related_name='wishlist')
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
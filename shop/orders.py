@@ -0,0 +1,96 @@
+from collections import Counter
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Q, Value, When
+from django.utils import timezone
+from products.bitmaps import bitmaps_products_changed
+from products.models import ProductVariant
+from products.stats import refresh_stock_stats
+from .cards import bump_card_versions
+from .models import OrderItem
+from .page_cache import purge_tags
+
+
+class StockShortage(Exception):
+    """Some cart lines ask for more than is left, `items` holds those lines."""
+
+    def __init__(self, items):
+        super().__init__(", ".join(item.variant.product.name for item in items))
+        self.items = items
+
+
+def variant_quantities(items):
+    """{variant id: units} over cart lines or holds."""
+    quantities = Counter()
+    for item in items:
+        quantities[item.variant_id] += item.quantity
+    return quantities
+
+
+def per_variant(quantities):
+    """A CASE picking each variant's own quantity in a set-based UPDATE, 0 for any other row."""
+    return Case(
+        *[When(id=variant_id, then=Value(quantity)) for variant_id, quantity in quantities.items()],
+        default=Value(0),
+        output_field=IntegerField(),
+    )
+
+
+def shortage(items, quantities):
+    """StockShortage with the lines whose variant has fewer units available than they need."""
+    available = {
+        variant.id: variant.available_stock
+        for variant in ProductVariant.objects.filter(id__in=list(quantities)).only("stock", "reserved")
+    }
+    return StockShortage([
+        item for item in items if available.get(item.variant_id, 0) < quantities[item.variant_id]
+    ])
+
+
+def stock_changed(product_ids):
+    """What the ProductVariant signals do, for stock or reserved updates that skip save()."""
+    product_ids = set(product_ids)
+    refresh_stock_stats(product_ids)
+    purge_tags("stock", *[f"product:{product_id}" for product_id in product_ids])
+    transaction.on_commit(lambda: bump_card_versions(product_ids))
+    if settings.CATALOG_BITMAP_INDEX:
+        transaction.on_commit(lambda: bitmaps_products_changed(product_ids))
+
+
+def decrement_stock(items):
+    """
+    Takes every cart line's quantity off its variant in one
+    UPDATE ... SET stock = stock - qty WHERE stock - reserved >= qty. When a row has too little
+    the whole update is undone and StockShortage lists the lines that could not be
+    served. Must run inside the order's transaction, the updated rows stay locked
+    until it commits.
+    """
+    quantities = variant_quantities(items)
+    if not quantities:
+        return
+
+    # units held for other customers' payments are not for sale
+    enough = Q()
+    for variant_id, quantity in quantities.items():
+        enough |= Q(id=variant_id, stock__gte=F("reserved") + quantity)
+
+    savepoint = transaction.savepoint()
+    updated = ProductVariant.objects.filter(enough).update(
+        stock=F("stock") - per_variant(quantities),
+        # auto_now is not applied by update()
+        updated_at=timezone.now(),
+    )
+    if updated < len(quantities):
+        transaction.savepoint_rollback(savepoint)
+        raise shortage(items, quantities)
+
+    transaction.savepoint_commit(savepoint)
+    stock_changed(item.variant.product_id for item in items)
+
+
+def create_order_items(order, items):
+    """One INSERT for all lines, priced from the cart snapshot they come from."""
+    return OrderItem.objects.bulk_create([
+        OrderItem(order=order, variant_id=item.variant_id, quantity=item.quantity, price=item.unit_price)
+        for item in items
+    ])
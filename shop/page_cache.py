@@ -0,0 +1,171 @@
+import hashlib
+import re
+import time
+from functools import wraps
+from django.conf import settings
+from django.contrib import messages
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+
+
+# seconds a page may also be served after it expired or was purged, while one request rebuilds it
+PAGE_CACHE_STALE_TTL = 60 * 5
+
+# how long one request may hold the rebuild of a page before another one takes over
+PAGE_CACHE_LOCK_TTL = 15
+
+# parameters that never change what a page shows
+IGNORED_PARAMS = {"fbclid", "gclid", "ref"}
+
+# the {% csrf_token %} input is cut out before storing and refilled for each visitor
+CSRF_INPUT = re.compile(r'(name="csrfmiddlewaretoken" value=")[^"]*(")')
+CSRF_PLACEHOLDER = "__page_cache_csrf__"
+
+
+def _tag_key(tag):
+    return f"pagetag:{tag}"
+
+
+def last_purged(tags, default=None):
+    """Latest purge time over these tags. Tags without one get `default`, now when None."""
+    keys = [_tag_key(tag) for tag in tags]
+    found = cache.get_many(keys)
+
+    # an evicted purge time must not revive pages rendered before it
+    default = time.time() if default is None else default
+    missing = {key: default for key in keys if key not in found}
+    if missing:
+        cache.set_many(missing, None)
+    return max([*found.values(), *missing.values()], default=0)
+
+
+def purge_tags(*tags):
+    """Marks every cached page carrying one of these tags as stale."""
+    if tags:
+        # after commit, so a page rendered from the old rows is never newer than the purge
+        transaction.on_commit(
+            lambda: cache.set_many({_tag_key(tag): time.time() for tag in tags}, None)
+        )
+
+
+def tag_page(request, *tags):
+    """Records what the page being rendered shows, e.g. tag_page(request, "product:3", "offer:1")."""
+    if not hasattr(request, "page_cache_tags"):
+        request.page_cache_tags = set()
+    request.page_cache_tags.update(str(tag) for tag in tags)
+
+
+def tag_products(request, products):
+    """Tags a page with the products it shows, their subcategories and their current offers."""
+    tags = set()
+    for product in products:
+        tags.add(f"product:{product.id}")
+        if product.subcategory_id:
+            tags.add(f"subcategory:{product.subcategory_id}")
+        if getattr(product, "best_offer_id", None):
+            tags.add(f"offer:{product.best_offer_id}")
+    tag_page(request, *tags)
+
+
+def normalize_querystring(params):
+    pairs = sorted(
+        (key, value)
+        for key, values in params.lists()
+        if key not in IGNORED_PARAMS and not key.startswith("utm_")
+        for value in values
+        if value != ""
+    )
+    return "&".join(f"{key}={value}" for key, value in pairs)
+
+
+def page_key(request):
+    variant = "|".join([
+        request.path,
+        normalize_querystring(request.GET),
+        request.headers.get("x-requested-with", ""),
+    ])
+    return "page:" + hashlib.md5(variant.encode()).hexdigest()
+
+
+def _cacheable_request(request):
+    if request.method != "GET" or settings.PAGE_CACHE_TTL <= 0:
+        return False
+    if request.user.is_authenticated:
+        return False
+    # pending messages (e.g. after a redirect) are shown once, to this visitor only
+    return not len(messages.get_messages(request))
+
+
+def _cacheable_response(response):
+    return (
+        response.status_code == 200
+        and not response.streaming
+        and not response.cookies
+        and not response.has_header("Cache-Control")
+    )
+
+
+def _store(key, request, response, started_at):
+    tags = sorted(getattr(request, "page_cache_tags", ()))
+    last_purged(tags, default=started_at)
+
+    content = response.content.decode(response.charset)
+    entry = {
+        "content": CSRF_INPUT.sub(rf"\g<1>{CSRF_PLACEHOLDER}\g<2>", content),
+        "content_type": response["Content-Type"],
+        "tags": tags,
+        # a purge that lands while the page renders must still count against it
+        "rendered_at": started_at,
+        "fresh_until": started_at + settings.PAGE_CACHE_TTL,
+    }
+    cache.set(key, entry, settings.PAGE_CACHE_TTL + PAGE_CACHE_STALE_TTL)
+
+
+def _is_fresh(entry):
+    if time.time() >= entry["fresh_until"]:
+        return False
+    return last_purged(entry["tags"]) <= entry["rendered_at"]
+
+
+def _respond(request, entry, state):
+    content = entry["content"]
+    if CSRF_PLACEHOLDER in content:
+        # also makes CsrfViewMiddleware send this visitor their cookie
+        content = content.replace(CSRF_PLACEHOLDER, get_token(request))
+    response = HttpResponse(content, content_type=entry["content_type"])
+    response["X-Page-Cache"] = state
+    return response
+
+
+def page_cache(view):
+    """
+    Caches a view's full response for anonymous GETs, keyed by path and normalized
+    querystring. Pages are invalidated through the tags the view records with
+    tag_page(); an expired or purged page keeps being served while a single
+    request rebuilds it, so a burst of visitors triggers one render, not hundreds.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not _cacheable_request(request):
+            return view(request, *args, **kwargs)
+
+        key = page_key(request)
+        entry = cache.get(key)
+        if entry is not None:
+            if _is_fresh(entry):
+                return _respond(request, entry, "HIT")
+            if not cache.add(f"{key}:lock", 1, PAGE_CACHE_LOCK_TTL):
+                return _respond(request, entry, "STALE")
+
+        started_at = time.time()
+        response = view(request, *args, **kwargs)
+        if _cacheable_response(response):
+            _store(key, request, response, started_at)
+            response["X-Page-Cache"] = "MISS"
+        if entry is not None:
+            cache.delete(f"{key}:lock")
+        return response
+
+    return wrapper
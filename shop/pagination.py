@@ -0,0 +1,126 @@
+from decimal import Decimal, InvalidOperation
+from django.core import signing
+from django.db.models import F, Q
+from django.utils.dateparse import parse_datetime
+
+
+CURSOR_SALT = "shop.products.cursor"
+
+
+def _datetime(value):
+    parsed = parse_datetime(value)
+    if parsed is None:
+        raise ValueError(value)
+    return parsed
+
+
+# sort param -> (field, descending, type) keys, the last one always unique and
+# none of them nullable: NULLs fall out of the (key, id) > cursor comparison
+KEYSET_SORTS = {
+    "": [("id", True, int)],
+    # current_price is annotated by with_pricing(), never null
+    "priceLow": [("current_price", False, Decimal), ("id", False, int)],
+    "priceHigh": [("current_price", True, Decimal), ("id", True, int)],
+    "new": [("created_at", True, _datetime), ("id", True, int)],
+    "nameAsc": [("name", False, str), ("id", False, int)],
+}
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+class KeysetPage:
+    """One page of a keyset-paginated queryset. Has no total count or page numbers,
+    only opaque cursors for the neighbouring pages."""
+
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+def encode_cursor(values, direction):
+    return signing.dumps({"k": [str(v) for v in values], "d": direction}, salt=CURSOR_SALT, compress=True)
+
+
+def decode_cursor(cursor, keys):
+    """The cursor's key values as the types the sort's keys compare with, and its direction."""
+    try:
+        data = signing.loads(cursor, salt=CURSOR_SALT)
+        values, direction = data["k"], data["d"]
+        if len(values) != len(keys):
+            raise InvalidCursor(cursor)
+        return [parse(value) for value, (_, _, parse) in zip(values, keys)], direction
+    except (signing.BadSignature, KeyError, TypeError, ValueError, InvalidOperation):
+        raise InvalidCursor(cursor)
+
+
+def _after(aliases, values, descending):
+    """WHERE clause for rows strictly after `values` in the (aliases) order."""
+    condition = Q()
+    for i in reversed(range(len(aliases))):
+        lookup = "lt" if descending[i] else "gt"
+        step = Q(**{f"{aliases[i]}__{lookup}": values[i]})
+        if i < len(aliases) - 1:
+            step |= Q(**{aliases[i]: values[i]}) & condition
+        condition = step
+    return condition
+
+
+def paginate_keyset(queryset, sort, cursor=None, per_page=6):
+    keys = KEYSET_SORTS[sort]
+    aliases = [f"cursor_{i}" for i in range(len(keys))]
+    descending = [desc for _, desc, _ in keys]
+
+    queryset = queryset.annotate(**{alias: F(field) for alias, (field, _, _) in zip(aliases, keys)})
+
+    direction = "n"
+    if cursor:
+        values, direction = decode_cursor(cursor, keys)
+
+        if direction == "p":
+            # walk backwards from the cursor, then flip the page back into order
+            queryset = queryset.filter(_after(aliases, values, [not d for d in descending]))
+        else:
+            queryset = queryset.filter(_after(aliases, values, descending))
+
+    reverse = direction == "p"
+    ordering = [
+        f"-{alias}" if desc != reverse else alias
+        for alias, desc in zip(aliases, descending)
+    ]
+
+    rows = list(queryset.order_by(*ordering)[:per_page + 1])
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if reverse:
+        rows.reverse()
+
+    def key_of(obj):
+        return [getattr(obj, alias) for alias in aliases]
+
+    next_cursor = previous_cursor = None
+    if rows:
+        # walking backwards means there is always a page after this one
+        if has_more or reverse:
+            next_cursor = encode_cursor(key_of(rows[-1]), "n")
+        if (has_more and reverse) or (cursor and not reverse):
+            previous_cursor = encode_cursor(key_of(rows[0]), "p")
+
+    return KeysetPage(rows, next_cursor, previous_cursor)
@@ -0,0 +1,88 @@
+from django.core.cache import cache
+from products.models import Product, ProductRecommendation
+from products.recommendations import EXCLUDED_ITEM_STATUSES, get_popular_product_ids
+from .models import CartItem, OrderItem, Wishlist
+
+
+PERSONAL_CACHE_TTL = 60 * 5
+
+# how much each kind of interest counts towards its co-purchased products
+SIGNAL_WEIGHTS = {"cart": 3.0, "wishlist": 2.0, "purchase": 1.0}
+
+# most recent purchases used as signals
+PURCHASE_HISTORY = 50
+
+MAX_RECOMMENDATIONS = 24
+
+
+def _user_signals(user):
+    """{product id: weight}, the strongest signal wins when a product shows up twice."""
+    signals = {}
+    sources = [
+        ("purchase", OrderItem.objects.filter(order__user=user)
+            .exclude(status__in=EXCLUDED_ITEM_STATUSES)
+            .order_by("-id")
+            .values_list("variant__product_id", flat=True)[:PURCHASE_HISTORY]),
+        ("wishlist", Wishlist.objects.filter(user=user).values_list("product_id", flat=True)),
+        ("cart", CartItem.objects.filter(user=user).values_list("variant__product_id", flat=True)),
+    ]
+    for kind, product_ids in sources:
+        for product_id in product_ids:
+            signals[product_id] = max(signals.get(product_id, 0), SIGNAL_WEIGHTS[kind])
+    return signals
+
+
+def compute_personal_recommendations(user):
+    """
+    Product ids ranked by the weighted sum of their similarity to everything the user
+    bought, wishlisted or has in the cart, using the precomputed ProductRecommendation
+    neighbors. Products the user already has are skipped; best sellers fill the rest.
+    """
+    signals = _user_signals(user)
+
+    scores = {}
+    for product_id, recommended_id, score in ProductRecommendation.objects.filter(
+        product_id__in=list(signals)
+    ).values_list("product_id", "recommended_id", "score"):
+        if recommended_id not in signals:
+            scores[recommended_id] = scores.get(recommended_id, 0) + signals[product_id] * score
+
+    ranked = sorted(scores, key=lambda product_id: (-scores[product_id], -product_id))
+    active = set(Product.objects.filter(id__in=ranked, is_active=True).values_list("id", flat=True))
+    product_ids = [product_id for product_id in ranked if product_id in active]
+
+    for product_id in get_popular_product_ids():
+        if len(product_ids) >= MAX_RECOMMENDATIONS:
+            break
+        if product_id not in signals and product_id not in scores:
+            product_ids.append(product_id)
+
+    return product_ids[:MAX_RECOMMENDATIONS]
+
+
+def get_recommended_product_ids(user):
+    if not user.is_authenticated:
+        return get_popular_product_ids()
+
+    key = f"recommendations:user:{user.pk}"
+    product_ids = cache.get(key)
+    if product_ids is None:
+        product_ids = compute_personal_recommendations(user)
+        cache.set(key, product_ids, PERSONAL_CACHE_TTL)
+    return product_ids
+
+
+def recommended_products(user, limit, exclude=()):
+    """Priced products with images prefetched, in recommendation order; missing or unlisted ones are skipped."""
+    exclude = set(exclude)
+    product_ids = [product_id for product_id in get_recommended_product_ids(user) if product_id not in exclude]
+
+    # a few spare ids, in case some were unlisted since they were ranked
+    candidates = product_ids[:limit * 2]
+    by_id = (
+        Product.objects.filter(is_active=True)
+        .with_pricing()
+        .prefetch_related("images")
+        .in_bulk(candidates)
+    )
+    return [by_id[product_id] for product_id in candidates if product_id in by_id][:limit]
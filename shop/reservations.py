@@ -0,0 +1,167 @@
+import copy
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.db.models.functions import Least
+from django.utils import timezone
+from products.models import ProductVariant
+from .models import StockHold
+from .orders import per_variant, shortage, stock_changed, variant_quantities
+
+
+# expired holds released per sweeper transaction
+RELEASE_BATCH_SIZE = 500
+
+
+def place_holds(payment, items):
+    """
+    Sets aside every cart line's quantity for an online payment: one
+    UPDATE ... SET reserved = reserved + qty WHERE stock - reserved >= qty and one
+    INSERT of StockHold rows. Raises StockShortage, with nothing held, when a
+    variant has too few units available.
+    """
+    quantities = variant_quantities(items)
+    if not quantities:
+        return []
+
+    enough = Q()
+    for variant_id, quantity in quantities.items():
+        enough |= Q(id=variant_id, stock__gte=F("reserved") + quantity)
+
+    with transaction.atomic():
+        updated = ProductVariant.objects.filter(enough).update(reserved=F("reserved") + per_variant(quantities))
+        if updated < len(quantities):
+            # leaving the block with the exception undoes the partial update
+            raise shortage(items, quantities)
+
+        expires_at = timezone.now() + timedelta(seconds=settings.STOCK_HOLD_TTL)
+        holds = StockHold.objects.bulk_create([
+            StockHold(payment=payment, variant_id=variant_id, quantity=quantity, expires_at=expires_at)
+            for variant_id, quantity in quantities.items()
+        ])
+        stock_changed(item.variant.product_id for item in items)
+    return holds
+
+
+def _lock_active(holds):
+    # of=("self",), the joined variant row is locked by the UPDATE that follows
+    return list(holds.filter(status=StockHold.ACTIVE).select_related("variant").select_for_update(of=("self",)))
+
+
+def _settle(holds, sold=None):
+    """Ends the holds: `sold` {variant id: units} leave stock for good, every other held unit goes back on sale."""
+    sold = sold or {}
+    held = variant_quantities(holds)
+    ProductVariant.objects.filter(id__in=list(held)).update(
+        reserved=F("reserved") - per_variant(held),
+        stock=F("stock") - per_variant(sold),
+    )
+
+    converted = [hold.id for hold in holds if sold.get(hold.variant_id)]
+    released = [hold.id for hold in holds if not sold.get(hold.variant_id)]
+    if converted:
+        StockHold.objects.filter(id__in=converted).update(status=StockHold.CONVERTED)
+    if released:
+        StockHold.objects.filter(id__in=released).update(status=StockHold.RELEASED)
+    stock_changed(hold.variant.product_id for hold in holds)
+
+
+def convert_holds(holds, items):
+    """
+    Settles the active holds in this queryset, a payment's or a user's admissions,
+    against the cart lines being ordered. Held units the lines need become sold
+    stock and the rest go back on sale. Returns copies of the lines reduced to the
+    units no hold covered, for decrement_stock: the cart may have changed during
+    payment, or the holds expired and were released.
+    """
+    needed = variant_quantities(items)
+    with transaction.atomic():
+        holds = _lock_active(holds)
+        sold = {
+            variant_id: min(quantity, needed[variant_id])
+            for variant_id, quantity in variant_quantities(holds).items()
+            if needed[variant_id]
+        }
+        if holds:
+            _settle(holds, sold)
+    return _lines_beyond(items, sold)
+
+
+def release_holds(holds):
+    """
+    Puts the still active holds in this queryset back on sale, except flash-sale
+    admissions attached to a payment: those go back to their user, who keeps the
+    place in the sale for what is left of the admission. Returns how many were released.
+    """
+    with transaction.atomic():
+        holds = _lock_active(holds)
+        admissions = [hold.id for hold in holds if hold.user_id]
+        if admissions:
+            StockHold.objects.filter(id__in=admissions).update(
+                payment=None,
+                expires_at=Least(F("expires_at"), timezone.now() + timedelta(seconds=settings.FLASH_SALE_ADMISSION_TTL)),
+            )
+        released = [hold for hold in holds if not hold.user_id]
+        if released:
+            _settle(released)
+        return len(released)
+
+
+def release_user_holds(user):
+    """A customer pays for one cart at a time, an abandoned attempt must not block the next one."""
+    return release_holds(StockHold.objects.filter(payment__user=user))
+
+
+def user_admissions(user):
+    """Holds flash-sale admissions granted the user, not yet tied to a payment."""
+    return StockHold.objects.filter(user=user, payment=None)
+
+
+def attach_admissions(payment, items):
+    """
+    Hands the user's active admissions over to an online payment, under the
+    payment's hold expiry. Returns copies of the lines reduced to the units they
+    do not cover, for place_holds.
+    """
+    with transaction.atomic():
+        holds = _lock_active(user_admissions(payment.user))
+        if holds:
+            StockHold.objects.filter(id__in=[hold.id for hold in holds]).update(
+                payment=payment,
+                expires_at=timezone.now() + timedelta(seconds=settings.STOCK_HOLD_TTL),
+            )
+    return _lines_beyond(items, variant_quantities(holds))
+
+
+def release_expired_holds(now=None):
+    """The sweeper: releases every active hold past its expiry, in batches. Returns how many were released."""
+    now = now or timezone.now()
+    released = 0
+    while True:
+        with transaction.atomic():
+            # skip_locked, a hold being converted right now is left to its payment
+            holds = list(
+                StockHold.objects.filter(status=StockHold.ACTIVE, expires_at__lte=now)
+                .select_related("variant")
+                .select_for_update(skip_locked=True, of=("self",))[:RELEASE_BATCH_SIZE]
+            )
+            if holds:
+                _settle(holds)
+        released += len(holds)
+        if len(holds) < RELEASE_BATCH_SIZE:
+            return released
+
+
+def _lines_beyond(items, sold):
+    """Copies of the cart lines reduced to the units `sold` does not cover."""
+    covered = dict(sold)
+    remaining = []
+    for item in items:
+        quantity = min(covered.get(item.variant_id, 0), item.quantity)
+        covered[item.variant_id] = covered.get(item.variant_id, 0) - quantity
+        if quantity < item.quantity:
+            part = copy.copy(item)
+            part.quantity = item.quantity - quantity
+            remaining.append(part)
+    return remaining
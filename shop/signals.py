@@ -0,0 +1,141 @@
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+from products.models import Product, ProductImage, ProductVariant, ProductReview, Offer, SubCategory
+from products.pricing import offer_product_ids
+from users.models import Banner
+from .cards import bump_card_versions
+from .cart_snapshot import invalidate_cart_summary
+from .page_cache import purge_tags
+from .models import CartItem, Order, Wishlist
+from .user_state import bump_user_state
+
+
+#product card fragments
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def bump_product_card(sender, instance, **kwargs):
+    bump_card_versions([instance.id])
+
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+@receiver(post_save, sender=ProductVariant)
+@receiver(post_delete, sender=ProductVariant)
+@receiver(post_save, sender=ProductReview)
+@receiver(post_delete, sender=ProductReview)
+def bump_related_product_card(sender, instance, **kwargs):
+    bump_card_versions([instance.product_id])
+
+
+@receiver(post_save, sender=Offer)
+def bump_offer_cards(sender, instance, **kwargs):
+    bump_card_versions(offer_product_ids(instance))
+
+
+@receiver(post_delete, sender=Offer)
+def bump_deleted_offer_cards(sender, instance, **kwargs):
+    # collected by products.signals before the M2M rows were removed
+    bump_card_versions(getattr(instance, "_affected_product_ids", set()))
+
+
+@receiver(m2m_changed, sender=Offer.products.through)
+@receiver(m2m_changed, sender=Offer.subcategories.through)
+def bump_offer_link_cards(sender, instance, action, reverse, **kwargs):
+    if not action.startswith("post_"):
+        return
+
+    if reverse:
+        if isinstance(instance, Product):
+            bump_card_versions([instance.id])
+        else:
+            bump_card_versions(instance.products.values_list("id", flat=True))
+        return
+
+    bump_card_versions(offer_product_ids(instance) | getattr(instance, "_affected_product_ids", set()))
+
+
+#full-page cache
+
+def _product_tags(product_ids):
+    return [f"product:{product_id}" for product_id in product_ids]
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def purge_product_pages(sender, instance, **kwargs):
+    # any product edit can change which listings it appears in, and where
+    purge_tags(f"product:{instance.id}", "catalog")
+
+
+@receiver(post_save, sender=ProductVariant)
+@receiver(post_delete, sender=ProductVariant)
+def purge_variant_pages(sender, instance, **kwargs):
+    purge_tags(f"product:{instance.product_id}", "stock")
+
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+@receiver(post_save, sender=ProductReview)
+@receiver(post_delete, sender=ProductReview)
+def purge_related_product_pages(sender, instance, **kwargs):
+    purge_tags(f"product:{instance.product_id}")
+
+
+@receiver(post_save, sender=Offer)
+def purge_offer_pages(sender, instance, **kwargs):
+    purge_tags(f"offer:{instance.id}", "prices", *_product_tags(offer_product_ids(instance)))
+
+
+@receiver(post_delete, sender=Offer)
+def purge_deleted_offer_pages(sender, instance, **kwargs):
+    purge_tags(f"offer:{instance.id}", "prices", *_product_tags(getattr(instance, "_affected_product_ids", set())))
+
+
+@receiver(m2m_changed, sender=Offer.products.through)
+@receiver(m2m_changed, sender=Offer.subcategories.through)
+def purge_offer_link_pages(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith("post_"):
+        return
+
+    if reverse:
+        if isinstance(instance, Product):
+            product_ids = [instance.id]
+        else:
+            product_ids = instance.products.values_list("id", flat=True)
+        purge_tags("prices", *[f"offer:{offer_id}" for offer_id in pk_set or ()], *_product_tags(product_ids))
+        return
+
+    product_ids = offer_product_ids(instance) | getattr(instance, "_affected_product_ids", set())
+    purge_tags(f"offer:{instance.id}", "prices", *_product_tags(product_ids))
+
+
+@receiver(post_save, sender=SubCategory)
+@receiver(post_delete, sender=SubCategory)
+def purge_subcategory_pages(sender, instance, **kwargs):
+    purge_tags(f"subcategory:{instance.id}", "catalog")
+
+
+@receiver(post_save, sender=Banner)
+@receiver(post_delete, sender=Banner)
+def purge_banner_pages(sender, instance, **kwargs):
+    purge_tags("banners")
+
+
+#per-user storefront state
+
+@receiver(post_save, sender=CartItem)
+@receiver(post_delete, sender=CartItem)
+@receiver(post_save, sender=Wishlist)
+@receiver(post_delete, sender=Wishlist)
+@receiver(post_save, sender=Order)
+def bump_owner_state(sender, instance, **kwargs):
+    bump_user_state(instance.user_id)
+
+
+#cached cart page totals
+
+@receiver(post_save, sender=CartItem)
+@receiver(post_delete, sender=CartItem)
+def invalidate_owner_cart_summary(sender, instance, **kwargs):
+    invalidate_cart_summary(instance.user_id)
@@ -1,3 +1,178 @@
-from django.test import TestCase
+from datetime import timedelta
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.test import TestCase, TransactionTestCase
+from django.utils import timezone
+from payments.models import Payment
+from products.models import Product, ProductVariant
+from .admission import DatabaseQueue, LocalQueue, allocate_batch
+from .models import AdmissionTicket, CartItem, StockHold
+from .reservations import attach_admissions, convert_holds, place_holds, release_expired_holds, release_user_holds
 
-# Create your tests here.
+
+def make_buyers(count):
+    User = get_user_model()
+    return [
+        User.objects.create(email=f"buyer{n}@example.com", fullName=f"Buyer {n}", referralCode=f"BUYER{n}")
+        for n in range(count)
+    ]
+
+
+def make_variant(stock):
+    product = Product.objects.create(name="Runner", price=1000, color="black", category="MEN")
+    return ProductVariant.objects.create(product=product, size="9", stock=stock)
+
+
+def active_held(variant):
+    return sum(StockHold.objects.filter(variant=variant, status=StockHold.ACTIVE).values_list("quantity", flat=True))
+
+
+class StockHoldTests(TestCase):
+
+    def setUp(self):
+        self.user = make_buyers(1)[0]
+        self.variant = make_variant(stock=5)
+        self.payment = Payment.objects.create(user=self.user, amount=1000, purpose="order_payment")
+
+    def line(self, quantity):
+        return CartItem(user=self.user, variant=self.variant, quantity=quantity)
+
+    def test_convert_holds_leaves_uncovered_units_to_the_caller(self):
+        place_holds(self.payment, [self.line(2)])
+
+        remaining = convert_holds(self.payment.stock_holds.all(), [self.line(3)])
+
+        self.assertEqual([line.quantity for line in remaining], [1])
+        self.variant.refresh_from_db()
+        self.assertEqual((self.variant.stock, self.variant.reserved), (3, 0))
+        self.assertEqual(list(self.payment.stock_holds.values_list("status", flat=True)), [StockHold.CONVERTED])
+
+    def test_convert_holds_puts_units_the_cart_dropped_back_on_sale(self):
+        place_holds(self.payment, [self.line(3)])
+
+        remaining = convert_holds(self.payment.stock_holds.all(), [self.line(1)])
+
+        self.assertEqual(remaining, [])
+        self.variant.refresh_from_db()
+        self.assertEqual((self.variant.stock, self.variant.reserved), (4, 0))
+
+    def test_expired_holds_are_released_and_no_longer_converted(self):
+        place_holds(self.payment, [self.line(2)])
+        other = Payment.objects.create(user=self.user, amount=1000, purpose="order_payment")
+        place_holds(other, [self.line(1)])
+        self.payment.stock_holds.update(expires_at=timezone.now() - timedelta(seconds=1))
+
+        self.assertEqual(release_expired_holds(), 1)
+        self.variant.refresh_from_db()
+        self.assertEqual(self.variant.reserved, 1)
+        self.assertEqual(self.variant.reserved, active_held(self.variant))
+
+        # the payment came back late, its units are taken from stock like an unheld order
+        remaining = convert_holds(self.payment.stock_holds.all(), [self.line(2)])
+        self.assertEqual([line.quantity for line in remaining], [2])
+        self.assertEqual(self.payment.stock_holds.get().status, StockHold.RELEASED)
+
+    def test_attach_admissions_moves_them_to_the_payment(self):
+        StockHold.objects.create(
+            user=self.user, variant=self.variant, quantity=2, expires_at=timezone.now() + timedelta(seconds=5),
+        )
+        ProductVariant.objects.filter(id=self.variant.id).update(reserved=2)
+
+        remaining = attach_admissions(self.payment, [self.line(3)])
+
+        self.assertEqual([line.quantity for line in remaining], [1])
+        hold = StockHold.objects.get()
+        self.assertEqual(hold.payment, self.payment)
+        self.assertGreater(hold.expires_at, timezone.now() + timedelta(seconds=60))
+
+    def test_an_abandoned_payment_gives_admissions_back_to_their_user(self):
+        StockHold.objects.create(
+            user=self.user, variant=self.variant, quantity=2, expires_at=timezone.now() + timedelta(seconds=5),
+        )
+        ProductVariant.objects.filter(id=self.variant.id).update(reserved=2)
+        remaining = attach_admissions(self.payment, [self.line(3)])
+        place_holds(self.payment, remaining)
+
+        self.assertEqual(release_user_holds(self.user), 1)
+
+        admission = StockHold.objects.get(user=self.user)
+        self.assertEqual((admission.status, admission.payment), (StockHold.ACTIVE, None))
+        # no longer than an admission lasts, not the payment's hold
+        self.assertLessEqual(admission.expires_at, timezone.now() + timedelta(seconds=settings.FLASH_SALE_ADMISSION_TTL))
+        self.variant.refresh_from_db()
+        self.assertEqual(self.variant.reserved, 2)
+        self.assertEqual(self.variant.reserved, active_held(self.variant))
+
+
+class AdmissionTests(TestCase):
+
+    def setUp(self):
+        self.buyers = make_buyers(4)
+        self.variant = make_variant(stock=3)
+
+    def queue(self, *quantities):
+        return [
+            AdmissionTicket.objects.create(user=buyer, variant=self.variant, quantity=quantity)
+            for buyer, quantity in zip(self.buyers, quantities)
+        ]
+
+    def test_allocate_batch_admits_in_arrival_order_without_overselling(self):
+        first, second, third, fourth = self.queue(2, 2, 1, 1)
+
+        admitted, sold_out = allocate_batch(self.variant.id, [first, second, third, fourth])
+
+        # a later ticket the remaining units still cover is admitted past one they do not
+        self.assertEqual(admitted, [first, third])
+        self.assertEqual(sold_out, [second, fourth])
+        self.variant.refresh_from_db()
+        self.assertEqual(self.variant.reserved, 3)
+        self.assertEqual(self.variant.reserved, active_held(self.variant))
+        self.assertEqual(
+            sorted(StockHold.objects.values_list("user_id", flat=True)), sorted([first.user_id, third.user_id]),
+        )
+
+        admitted, sold_out = allocate_batch(self.variant.id, [second])
+        self.assertEqual(admitted, [])
+        self.variant.refresh_from_db()
+        self.assertEqual(self.variant.reserved, 3)
+
+    def test_a_ticket_is_decided_once(self):
+        tickets = self.queue(1, 1)
+        queue = DatabaseQueue()
+
+        self.assertEqual(queue.decide(self.variant.id, tickets), 2)
+        # a second worker that read the same tickets while they were queued
+        self.assertEqual(queue.decide(self.variant.id, tickets), 0)
+
+        self.variant.refresh_from_db()
+        self.assertEqual(self.variant.reserved, 2)
+        self.assertEqual(StockHold.objects.count(), 2)
+
+    def test_a_sold_out_ticket_is_final(self):
+        queue = DatabaseQueue()
+        ticket = queue.enqueue(self.buyers[0].id, self.variant.id, 4)
+        queue.pump(self.variant.id)
+
+        again = queue.enqueue(self.buyers[0].id, self.variant.id, 4)
+
+        self.assertEqual(again.id, ticket.id)
+        self.assertEqual(again.status, AdmissionTicket.SOLD_OUT)
+
+
+class LocalQueueTests(TransactionTestCase):
+    # the queue's worker threads use their own database connections
+
+    def test_buyers_are_admitted_in_arrival_order(self):
+        buyers = make_buyers(5)
+        variant = make_variant(stock=3)
+        queue = LocalQueue(batch_size=2)
+
+        tickets = [queue.enqueue(buyer.id, variant.id, 1) for buyer in buyers]
+        self.assertIs(queue.enqueue(buyers[0].id, variant.id, 1), tickets[0])
+        self.assertTrue(queue.wait(timeout=10))
+
+        self.assertEqual([ticket.status for ticket in tickets], [AdmissionTicket.ADMITTED] * 3 + [AdmissionTicket.SOLD_OUT] * 2)
+        variant.refresh_from_db()
+        self.assertEqual(variant.reserved, 3)
+        self.assertEqual(variant.reserved, active_held(variant))
+        self.assertIs(queue.enqueue(buyers[4].id, variant.id, 1), tickets[4])
@@ -7,15 +7,17 @@ urlpatterns = [
    path("products/", views.product_list_view, name="shop_products"),
    path("products/category/<str:category>/", views.product_list_view, name="shop_category"),
    path("products/search/", views.product_list_view, name="shop_search"),
+   path("products/suggest/", views.search_suggestions, name="search_suggestions"),
    path("product/<int:product_id>/", views.product_detail_view, name="product_detail"),
+   path("product/<int:product_id>/reviews/", views.product_reviews, name="product_reviews"),
    path('product/review/<int:product_id>/', views.submit_review, name='submit_review'),
 
    # Cart
    path("cart/", views.cart_view, name="cart"),
    path("cart/add/<int:variant_id>/", views.add_to_cart, name="add_to_cart"),
    path("cart/remove/<int:item_id>/", views.remove_cart_item, name="remove_cart_item"),
-   path('cart/update-size/<int:item_id>/', views.update_size, name='update_size'),
    path('cart/update/<int:item_id>/', views.update_cart_quantity, name='update_cart_quantity'),
+   path('cart/line/<int:item_id>/', views.update_cart_line, name='update_cart_line'),
 
    # Wishlist
    path("wishlist/", views.wishlist_view, name="wishlist"),
@@ -30,6 +32,7 @@ urlpatterns = [
    path('checkout/remove-coupon/', views.remove_coupon, name="remove_coupon"),
    path('payment/<int:address_id>/', views.payment_view, name='payment'),
    path('place-order/', views.place_order, name='place_order'),
+   path('place-order/ticket/<int:ticket_id>/', views.admission_ticket_status, name='admission_ticket_status'),
    path('order-success/<int:order_id>/', views.order_success, name='order_success'),
    path("payment/failed/<int:order_id>/", views.order_failed_view, name="payment_failed"),
    path('payment/failure/', views.razorpay_payment_failed, name='razorpay_payment_failed'),
@@ -0,0 +1,146 @@
+import uuid
+from django.core.cache import cache
+from django.db import transaction
+from .models import CartItem, OrderItem, Wishlist
+
+
+USER_STATE_TTL = 60 * 10
+
+# also bounds how long a product being unlisted takes to drop out of the cart badge
+CART_COUNT_TTL = 60 * 10
+
+
+class UserState:
+    """What the storefront needs to know about a user, as sets for O(1) lookups in views and templates."""
+
+    __slots__ = ("wishlist_ids", "cart_variant_ids", "purchased_product_ids")
+
+    def __init__(self, wishlist_ids=(), cart_variant_ids=(), purchased_product_ids=()):
+        self.wishlist_ids = frozenset(wishlist_ids)
+        self.cart_variant_ids = frozenset(cart_variant_ids)
+        # delivered orders only, the same rule as review eligibility
+        self.purchased_product_ids = frozenset(purchased_product_ids)
+
+    def __getstate__(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+
+
+ANONYMOUS_STATE = UserState()
+
+
+def load_user_state(user):
+    return UserState(
+        wishlist_ids=Wishlist.objects.filter(user=user).values_list("product_id", flat=True),
+        cart_variant_ids=CartItem.objects.filter(user=user).values_list("variant_id", flat=True),
+        purchased_product_ids=OrderItem.objects.filter(
+            order__user=user, order__status="Delivered"
+        ).values_list("variant__product_id", flat=True).distinct(),
+    )
+
+
+def _version_key(user_id):
+    return f"userstate:version:{user_id}"
+
+
+def bump_user_state(user_id):
+    """Call after anything in UserState changes for this user."""
+    # after commit, so a concurrent request cannot cache the old rows under the new version
+    transaction.on_commit(lambda: cache.set(_version_key(user_id), uuid.uuid4().hex, None))
+
+
+def get_user_state(request, refresh=False):
+    """
+    The user's state, loaded at most once per request and cached until the next bump.
+    Views reading it after changing the cart or wishlist pass refresh=True.
+    """
+    state = getattr(request, "_user_state", None)
+    if state is not None and not refresh:
+        return state
+
+    user = request.user
+    if not user.is_authenticated:
+        state = ANONYMOUS_STATE
+    else:
+        version = cache.get(_version_key(user.pk))
+        if version is None:
+            # never fall back to a fixed default, an evicted version must not revive an old state
+            version = uuid.uuid4().hex
+            cache.set(_version_key(user.pk), version, None)
+
+        key = f"userstate:{user.pk}:{version}"
+        state = None if refresh else cache.get(key)
+        if state is None:
+            state = load_user_state(user)
+            cache.set(key, state, USER_STATE_TTL)
+
+    request._user_state = state
+    return state
+
+
+# the cart badge has its own counter, so a cart change adjusts one number instead of reloading the state
+
+def _cart_generation_key(user_id):
+    return f"cart:count:generation:{user_id}"
+
+
+def _cart_generation(user_id):
+    generation = cache.get(_cart_generation_key(user_id))
+    if generation is None:
+        generation = uuid.uuid4().hex
+        cache.set(_cart_generation_key(user_id), generation, None)
+    return generation
+
+
+def _cart_count_key(user_id, generation):
+    return f"cart:count:{user_id}:{generation}"
+
+
+def get_cart_count(request):
+    """Listed items in the user's cart, counted once and then kept current by adjust_cart_count."""
+    count = getattr(request, "_cart_count", None)
+    if count is not None:
+        return count
+
+    user = request.user
+    if not user.is_authenticated:
+        count = 0
+    else:
+        key = _cart_count_key(user.pk, _cart_generation(user.pk))
+        count = cache.get(key)
+        if count is None:
+            count = CartItem.objects.filter(
+                user=user,
+                variant__is_active=True,
+                variant__product__is_active=True,
+            ).count()
+            # the generation was read before counting, a change committed since moved it on and this lands on a dead key
+            cache.add(key, count, CART_COUNT_TTL)
+
+    request._cart_count = count
+    return count
+
+
+def adjust_cart_count(request, delta):
+    """
+    Applies a change to the cart badge count after commit. A cached count is
+    incremented in place; without one a request may be counting the old rows,
+    so the generation moves on and the next read counts again.
+    """
+    request.__dict__.pop("_cart_count", None)
+    if not delta:
+        return
+
+    def apply():
+        user_id = request.user.pk
+        try:
+            if cache.incr(_cart_count_key(user_id, _cart_generation(user_id)), delta) >= 0:
+                return
+        except ValueError:
+            pass
+        cache.set(_cart_generation_key(user_id), uuid.uuid4().hex, None)
+
+    transaction.on_commit(apply)
@@ -7,7 +7,6 @@ from reportlab.lib import colors
 from io import BytesIO
 from django.http import HttpResponse
 from decimal import Decimal
-from shop.models import CartItem
 
 
 def generate_invoice(order):
@@ -148,72 +147,3 @@ def generate_invoice(order):
     c.save()
     buffer.seek(0)
     return buffer
-
-
-# def get_cart_totals(user):
-#     cart_items = CartItem.objects.filter(user=user, variant__is_active = True, variant__product__is_active=True)
-
-#     if not cart_items.exists():
-#         return None
-    
-#     subtotal = sum(item.total_price for item in cart_items)
-#     gst = (subtotal * Decimal("0.18")).quantize(Decimal("0.01"))
-#     delivery_charge = Decimal("0")
-
-#     discount_amount = Decimal("0")
-#     coupon_code = None
-
-#     applied_coupon = None
-
-#     return{
-#         "cart_items" : cart_items,
-#         "subtotal" : subtotal,
-#         "gst" : gst,
-#         "delivery_charge" : delivery_charge,
-#         "base_total" : subtotal+gst+delivery_charge
-#     }
-
-
-from decimal import Decimal
-
-GST_RATE = Decimal("0.18")
-
-def get_cart_totals(user):
-    cart_items = CartItem.objects.filter(
-        user=user,
-        variant__is_active=True,
-        variant__product__is_active=True,
-        variant__stock__gt=0
-    )
-
-    if not cart_items.exists():
-        return None
-
-    # 1. Subtotal
-    subtotal = sum(item.total_price for item in cart_items)
-    subtotal = subtotal.quantize(Decimal("0.01"))
-
-    # 2. No discount here (handled in checkout/place_order)
-    discount_amount = Decimal("0.00")
-
-    # 3. Taxable amount = subtotal
-    taxable_amount = subtotal
-
-    # 4. GST (display only, NOT final)
-    gst = (taxable_amount * GST_RATE).quantize(Decimal("0.01"))
-
-    # 5. Delivery
-    delivery_charge = Decimal("0.00") if subtotal >= Decimal("1000") else Decimal("100.00")
-
-    # 6. Total (pre-discount)
-    grand_total = (taxable_amount + gst + delivery_charge).quantize(Decimal("0.01"))
-
-    return {
-        "cart_items": cart_items,
-        "subtotal": subtotal,
-        "discount_amount": discount_amount,   
-        "taxable_amount": taxable_amount,
-        "gst": gst,
-        "delivery_charge": delivery_charge,
-        "base_total": grand_total,
-    }
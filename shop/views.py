@@ -1,31 +1,53 @@
 from django.shortcuts import render,  get_object_or_404, redirect
-from products.models import Product, SubCategory, ProductReview
+from products.models import Product, ProductReview, ProductVariant
 from django.core.paginator import Paginator
-from django.db.models import Count, Q, Avg
+from django.db.models import Prefetch
 from django.views.decorators.csrf import csrf_exempt
-from products.models import Product, ProductVariant
 from django.contrib import messages
-from .models import CartItem, Wishlist, Address
+from .models import MAX_LINE_QUANTITY, CartItem, Wishlist, Address
 from decimal import Decimal
 from django.views.decorators.http import require_POST
 from django.http import JsonResponse
+from django.urls import reverse
+from django.template.loader import render_to_string
+from urllib.parse import urlencode
 import json
 from .models import Order, OrderItem, ReturnRequest
-from django.utils import timezone
 
 from datetime import timedelta
 from django.utils.timezone import now
 from users.decorator import user_required
 from wallet.models import Wallet, WalletTransaction
-import razorpay
 from django.conf import settings
+from payments.gateway import GatewayError, OrderNotPaid, SignatureError, confirm_payment
+from payments.intents import forget_payment_intent, get_payment_intent
 from payments.models import Payment
 from django.db import transaction
 from coupons.models import Coupon, CouponUsage
-from django.db.models import IntegerField
-from django.db.models.functions import Cast
+from django.db.models import Exists, F, FloatField, IntegerField
+from django.db.models.functions import Cast, Coalesce, NullIf
 import logging
-from .utils import get_cart_totals
+from .cart_snapshot import (
+    COUPON_CATEGORY, COUPON_EXPIRED, COUPON_MIN_CART_VALUE,
+    get_cart_snapshot, invalidate_cart_summary, remember_cart_summary, update_cart_summary,
+)
+from .pagination import KEYSET_SORTS, InvalidCursor, paginate_keyset
+from products.search import search_products
+from products.typeahead import TYPEAHEAD_MAX_RESULTS, suggest
+from products.bitmaps import BITMAP_SORTS, get_catalog_bitmaps
+from products.reviews import get_review_summary, review_page
+from products.popularity import record_event
+from .cards import render_product_cards
+from .facets import CATEGORIES, apply_catalog_filters, get_facets, normalize_filters
+from .admission import admit, get_admission_queue
+from .models import AdmissionTicket
+from .orders import StockShortage, create_order_items, decrement_stock
+from .page_cache import page_cache, tag_page, tag_products
+from .personalization import recommended_products
+from .reservations import (
+    attach_admissions, convert_holds, place_holds, release_holds, release_user_holds, user_admissions,
+)
+from .user_state import adjust_cart_count, bump_user_state, get_cart_count, get_user_state
 
 logger = logging.getLogger(__name__)
 
@@ -34,123 +56,146 @@ logger = logging.getLogger(__name__)
 
 
 
+@page_cache
 def product_list_view(request, category=None):
 
     logger.info("Product list view called with category: %s", category)
 
     products = (
         Product.objects.filter(is_active=True)
-        .prefetch_related("images")
+        .with_pricing()
         .annotate(
-            in_stock_count=Count('variants', filter=Q(variants__stock__gt=0)),
-            avg_rating=Avg('reviews__rating'),  
-            review_count=Count('reviews')       
+            # read from ProductStats, so the listing needs no GROUP BY
+            in_stock_count=Coalesce(F('stats__in_stock_variant_count'), 0),
+            avg_rating=Cast('stats__rating_sum', FloatField()) / NullIf(F('stats__review_count'), 0),
+            review_count=Coalesce(F('stats__review_count'), 0),
         )
     )
-    logger.debug("Initial product count: %s", products.count())
-
-    category_param = request.GET.get("category")
-
-    if category_param:
-        category = category_param.lower()
 
-    if category:
-        normalized_category = category.upper()   # men -> MEN
-        if normalized_category in ["MEN", "WOMEN", "KIDS"]:
-            products = products.filter(category=normalized_category)
+    # normalized once, so the listing and the facet counts apply the same rules
+    catalog_filters = normalize_filters(request.GET, category)
+    category = catalog_filters["category"] or category
 
     active_category = category  # keep lowercase for UI
 
-    
-
-    
-
-
-    q = request.GET.get("q","").strip()
+    q = catalog_filters["q"]
     if q:
-        products = products.filter(name__icontains=q)
-
-    #size
-    active_size = request.GET.getlist("size")
-    if active_size:
-        products  = products.filter(variants__size__in=active_size).distinct()
+        products = search_products(products, q)
 
+    active_size = catalog_filters["sizes"]
+    active_color = catalog_filters["color"]
+    active_subcategory = str(catalog_filters["subcategory"] or "")
+    min_price = catalog_filters["min_price"] or ""
+    max_price = catalog_filters["max_price"] or ""
+    in_stock = catalog_filters["in_stock"]
 
-    #price
-    min_price = request.GET.get("min_price","")
-    max_price = request.GET.get("max_price","")
-
-    if min_price:
-        products = products.filter(price__gte=min_price)
-
-    if max_price:
-        products = products.filter(price__lte=max_price)
+    catalog_products = products
+    products = apply_catalog_filters(products, catalog_filters)
 
     #sort
     sort = request.GET.get("sort","")
     if sort == "priceLow":
-        products = products.order_by("price")
+        products = products.order_by("current_price", "id")
     elif sort == "priceHigh":
-        products = products.order_by("-price")
+        products = products.order_by("-current_price", "-id")
     elif  sort == "new":
         products = products.order_by("-created_at")
     elif sort == "nameAsc":
         products = products.order_by("name")
     elif sort == "nameDesc":
         products = products.order_by("-name")
+    elif sort == "trending":
+        products = products.order_by(F("popularity__trending_rank").desc(nulls_last=True), "-id")
+    elif q:
+        products = products.order_by("-search_rank", "-id")
     else:
         products = products.order_by("-id")
 
-    #color
-    active_color = request.GET.get("color", "").strip()
-
-    if active_color:
-        products = products.filter(color__icontains=active_color)
-
-    #subcategory 
-    active_subcategory = request.GET.get("subcategory","")
+    facets = get_facets(catalog_filters)
 
-    if active_subcategory:
-        products = products.filter(subcategory_id= active_subcategory)
-
-    if category:
-        subcategories = SubCategory.objects.filter(
-            category = category.upper(),
-            is_active = True
-        )
-    else:
-        subcategories = SubCategory.objects.none()
+    # every listing changes with the catalog; stock and price filters also with variants and offers
+    tag_page(request, "catalog", *(f"subcategory:{s['value']}" for s in facets["subcategories"]))
+    if in_stock or active_size:
+        tag_page(request, "stock")
+    if min_price or max_price or sort in ("priceLow", "priceHigh"):
+        tag_page(request, "prices")
 
     filters = request.GET.copy()
     if 'page' in filters:
         filters.pop('page')
-    querystring = filters.urlencode()
 
-    paginator = Paginator(products, 6)
-    page_number  = request.GET.get("page")
-    page_obj  = paginator.get_page(page_number)
+    # keyset mode: no COUNT(*) and no OFFSET scan, pages are addressed by cursor
+    cursor = request.GET.get("cursor")
+    use_cursor = (cursor is not None or request.GET.get("paginate") == "cursor") and sort in KEYSET_SORTS
+    if q and not sort:
+        # relevance order has no stable keyset
+        use_cursor = False
+
+    use_bitmaps = (
+        settings.CATALOG_BITMAP_INDEX
+        and not use_cursor
+        and not q
+        and sort in BITMAP_SORTS
+        and not (min_price or max_price)
+    )
 
-    categories = ["men", "women", "kids"]
+    if use_cursor:
+        filters.pop('cursor', None)
+        filters['paginate'] = 'cursor'
+        paginator = None
+        try:
+            page_obj = paginate_keyset(products, sort, cursor, per_page=6)
+        except InvalidCursor:
+            page_obj = paginate_keyset(products, sort, None, per_page=6)
+        tag_products(request, page_obj)
 
-    # Dynamic sizes based on category
-    if category == "kids":
-        sizes = ["1", "2", "3", "4", "5"]
-    else:  # (default)
-        sizes = ["6", "7", "8", "9", "10", "11"]
+        if request.headers.get('x-requested-with') == 'XMLHttpRequest':
+            return JsonResponse({
+                "products": [
+                    {
+                        "id": p.id,
+                        "name": p.name,
+                        "color": p.color,
+                        "price": str(p.price),
+                        "final_price": str(p.final_price),
+                        "offer_percentage": p.offer_percentage,
+                        "in_stock": p.in_stock_count > 0,
+                    }
+                    for p in page_obj
+                ],
+                "next_cursor": page_obj.next_cursor,
+                "previous_cursor": page_obj.previous_cursor,
+            })
+    elif use_bitmaps:
+        # ids come from the in-process bitmaps, only the page itself is read from the database
+        paginator = Paginator(get_catalog_bitmaps().match(catalog_filters, sort), 6)
+        page_obj = paginator.get_page(request.GET.get("page"))
+        by_id = catalog_products.in_bulk(page_obj.object_list)
+        page_obj.object_list = [by_id[product_id] for product_id in page_obj.object_list if product_id in by_id]
+        tag_products(request, page_obj)
+    else:
+        paginator = Paginator(products, 6)
+        page_number  = request.GET.get("page")
+        page_obj  = paginator.get_page(page_number)
+        tag_products(request, page_obj)
 
+    querystring = filters.urlencode()
 
-    wishlist_ids = []
-    if request.user.is_authenticated:
-        wishlist_ids = request.user.wishlist.values_list('product_id', flat=True)
+    categories = CATEGORIES
+
+    wishlist_ids = get_user_state(request).wishlist_ids
 
 
     
 
     context = {
         "products" : page_obj,
+        # images are only loaded for cards missing from the fragment cache
+        "cards" : render_product_cards(page_obj),
         "category" : category,
         "page_obj" : page_obj,
         "paginator" : paginator,
+        "use_cursor" : use_cursor,
         "q":q,
         "sort": sort,
         "active_color" :  active_color,
@@ -158,10 +203,10 @@ def product_list_view(request, category=None):
         "max_price" : max_price,
         "active_category" : active_category,
         "active_sizes" : active_size,
-        "sizes":sizes,
+        "in_stock" : in_stock,
+        "facets": facets,
         "categories":categories,
         "page_query" : querystring,
-        "subcategories":subcategories,
         "active_subcategory":active_subcategory,
         "wishlist_ids": wishlist_ids,
     }
@@ -170,13 +215,44 @@ def product_list_view(request, category=None):
     
 
 
-def  product_detail_view(request, product_id):
+def search_suggestions(request):
+    q = request.GET.get("q", "")
+    try:
+        limit = max(1, min(int(request.GET.get("limit", 8)), TYPEAHEAD_MAX_RESULTS))
+    except ValueError:
+        limit = 8
+
+    suggestions = []
+    for s in suggest(q, limit):
+        if s["type"] == "product":
+            url = reverse("product_detail", args=[s["id"]])
+        elif s["type"] == "color":
+            url = f"{reverse('shop_products')}?{urlencode({'color': s['label']})}"
+        else:
+            url = f"{reverse('shop_products')}?{urlencode({'category': s['category'].lower(), 'subcategory': s['id']})}"
+
+        suggestions.append({"type": s["type"], "label": s["label"], "url": url})
+
+    return JsonResponse({"q": q, "suggestions": suggestions})
+
+
+
+def product_detail_view(request, product_id):
+    response = _product_detail_page(request, product_id)
+    # counted here rather than in the page, so cached hits count too
+    if response.status_code == 200:
+        record_event(product_id, "views")
+    return response
+
+
+@page_cache
+def _product_detail_page(request, product_id):
 
     logger.info("Product detail view called for product_id=%s", product_id)
 
     #get the product
     product = get_object_or_404(
-        Product.objects.prefetch_related("images","variants"),
+        Product.objects.with_pricing().prefetch_related("images","variants"),
         id=product_id
     )
     logger.debug("Loaded product: %s", product.name)
@@ -197,13 +273,25 @@ def  product_detail_view(request, product_id):
     images = product.images.all().order_by("-is_primary","id")
 
     #related_products
-    related_products = Product.objects.filter(
-        category=product.category,
-        is_active = True,
-    ).exclude(id=product.id)[:6]
+    # "customers also bought", precomputed by the build_recommendations command
+    related_products = list(
+        Product.objects.filter(recommended_in__product=product, is_active=True)
+        .with_pricing()
+        .prefetch_related("images")
+        .order_by("recommended_in__rank")[:6]
+    )
+    if not related_products:
+        related_products = list(
+            Product.objects.filter(
+                category=product.category,
+                is_active = True,
+            ).exclude(id=product.id).with_pricing().prefetch_related("images")[:6]
+        )
+
+    tag_products(request, [product, *related_products])
 
     #stock check
-    total_stock = sum(v.stock for v in variants)
+    total_stock = sum(v.available_stock for v in variants)
     is_out_of_stock = total_stock == 0
     logger.debug("Stock check for product_id=%s | Total stock=%s", product_id, total_stock)
 
@@ -215,39 +303,22 @@ def  product_detail_view(request, product_id):
             return redirect("shop_products")
         ##cart logics later##
 
-    is_in_wishlist = False
-    if request.user.is_authenticated:
-        is_in_wishlist = Wishlist.objects.filter(user=request.user, product=product).exists()
-        logger.debug("Wishlist status for product_id=%s | In wishlist=%s", product_id, is_in_wishlist)
+    user_state = get_user_state(request)
+    is_in_wishlist = product.id in user_state.wishlist_ids
 
     #review
-    reviews = product.reviews.all().order_by('-created_at')
-    review_count = reviews.count()
-    avg_rating = reviews.aggregate(Avg('rating'))['rating__avg'] or 0
-
-    star_distribution = {
-        5: reviews.filter(rating=5).count(),
-        4: reviews.filter(rating=4).count(),
-        3: reviews.filter(rating=3).count(),
-        2: reviews.filter(rating=2).count(),
-        1: reviews.filter(rating=1).count(),
-    }
+    # first page only, the rest is loaded from product_reviews
+    reviews, has_more_reviews = review_page(product.id)
+    review_summary = get_review_summary(product.id)
 
     # Check if user can review (Has bought + Delivered)
     can_review = False
     user_review = None
 
     if request.user.is_authenticated:
-        has_purchased = OrderItem.objects.filter(
-            order__user=request.user,
-            order__status='Delivered',
-            variant__product=product
-        ).exists()
+        can_review = product.id in user_state.purchased_product_ids
 
-        user_review = reviews.filter(user=request.user).first()
-
-        if has_purchased:
-            can_review = True
+        user_review = ProductReview.objects.filter(user=request.user, product=product).first()
     
     context = {
         "product" : product,
@@ -257,9 +328,10 @@ def  product_detail_view(request, product_id):
         "is_out_of_stock" : is_out_of_stock,
         "is_in_wishlist": is_in_wishlist,
         'reviews': reviews,
-        'review_count': review_count,
-        'avg_rating': round(avg_rating, 1),
-        'star_distribution': star_distribution,
+        'has_more_reviews': has_more_reviews,
+        'review_count': review_summary["count"],
+        'avg_rating': review_summary["average"],
+        'star_distribution': review_summary["distribution"],
         'can_review': can_review,
         'user_review': user_review, 
     }
@@ -267,6 +339,22 @@ def  product_detail_view(request, product_id):
     return render(request, "shop/product_detail.html", context)
 
 
+@page_cache
+def product_reviews(request, product_id):
+    try:
+        page = max(1, int(request.GET.get("page", 1)))
+    except ValueError:
+        page = 1
+
+    reviews, has_next = review_page(product_id, page)
+    tag_page(request, f"product:{product_id}")
+
+    return JsonResponse({
+        "html": render_to_string("shop/partials/review_list.html", {"reviews": reviews}),
+        "next_page": page + 1 if has_next else None,
+    })
+
+
 
 #cart
 
@@ -301,7 +389,7 @@ def add_to_cart(request, variant_id=None):
         messages.error(request, msg)
         return redirect(request.META.get('HTTP_REFERER', 'shop_products'))
 
-    if variant.stock <= 0:
+    if variant.available_stock <= 0:
         msg = "This product is out of stock"
         if is_ajax:
             return JsonResponse({'status': 'error', 'message': msg}, status=400)
@@ -313,7 +401,7 @@ def add_to_cart(request, variant_id=None):
     except ValueError:
         quantity = 1
 
-    max_qty = min(variant.stock, 4)
+    max_qty = min(variant.available_stock, 4)
     quantity = max(1, min(quantity, max_qty))
     
     cart_item, created = CartItem.objects.get_or_create(
@@ -325,8 +413,10 @@ def add_to_cart(request, variant_id=None):
         cart_item.quantity = quantity     # FIXED
         cart_item.save()
         msg = "Item added to cart"
+        record_event(variant.product_id, "cart_adds")
+        adjust_cart_count(request, 1)
     else:
-        if cart_item.quantity < min(variant.stock, 4):
+        if cart_item.quantity < min(variant.available_stock, 4):
             cart_item.quantity += 1
             cart_item.save()
             msg = "Quantity updated in cart"
@@ -344,7 +434,7 @@ def add_to_cart(request, variant_id=None):
         return JsonResponse({
             'status': 'success', 
             'message': msg,
-            'cart_count': CartItem.objects.filter(user=request.user).count()
+            'cart_count': get_cart_count(request)
         })
 
     messages.success(request, msg)
@@ -357,68 +447,23 @@ def cart_view(request):
         return redirect("login")
     
 
-    all_cart_items = CartItem.objects.filter(user=request.user).select_related("variant", "variant__product")
-
-    # 1. Active Items (Both Product and Variant are active)
-    active_items = all_cart_items.filter(
-        variant__is_active=True,
-        variant__product__is_active=True,
-    )
-
-    # 2. Unlisted Items (Either Product or Variant is inactive)
-    unlisted_items = all_cart_items.filter(
-        Q(variant__is_active=False) | Q(variant__product__is_active=False)
-    )
-
-    out_of_stock_items = active_items.filter(variant__stock__lte=0)
-    in_stock_items = active_items.filter(variant__stock__gt=0)
-
-    subtotal = Decimal("0")
-    total_items = 0
-
-    # if not valid_items.exists():
-    #     context = {
-    #         "cart_items": [],
-    #         "subtotal": Decimal('0'),
-    #         "gst": Decimal('0'),
-    #         "delivery_charge": Decimal('0'),
-    #         "grand_total": Decimal('0'),
-    #         "total_items": 0,
-            
-    #     }
-    #     return render(request, "shop/cart.html", context)
-    
-
-    for item in in_stock_items:
-        product = item.variant.product
-        item_final_price  = product.final_price
-        subtotal += item_final_price * item.quantity
-        total_items += item.quantity
-
-        item.sorted_variants = (
-            product.variants
-            .annotate(size_int=Cast("size", IntegerField()))
-            .order_by("size_int")
-        )
-
-    subtotal = subtotal.quantize(Decimal("0.01"))
-        
-    gst = (subtotal * Decimal('0.18')).quantize(Decimal('0.01'))
-
-    delivery_charge = Decimal('0') if subtotal >= Decimal('1000') else Decimal('100')
-
-    grand_total  = subtotal + gst + delivery_charge if total_items > 0 else Decimal('0')
-
+    snapshot = get_cart_snapshot(request)
+    totals = snapshot.base_totals
+    # quantity changes on this page start from these numbers
+    remember_cart_summary(request, snapshot)
 
     context = {
-        "cart_items": in_stock_items,
-        "out_of_stock_items": out_of_stock_items,
-        "unlisted_items": unlisted_items,  # Added to context
-        "subtotal": subtotal,
-        "gst": gst,
-        "delivery_charge": delivery_charge,
-        "grand_total": grand_total,
-        "total_items": total_items,
+        "cart_items": snapshot.in_stock_items,
+        "out_of_stock_items": snapshot.out_of_stock_items,
+        "unlisted_items": snapshot.unlisted_items,
+        "subtotal": totals.subtotal,
+        "gst": totals.gst,
+        "delivery_charge": totals.delivery_charge,
+        "grand_total": totals.grand_total,
+        "total_items": totals.total_items,
+        "recommended_products": recommended_products(
+            request.user, limit=4, exclude=snapshot.product_ids
+        ),
 
     }
 
@@ -426,67 +471,22 @@ def cart_view(request):
 
 @user_required
 def remove_cart_item(request, item_id):
-    item = get_object_or_404(CartItem, id = item_id, user = request.user)
+    item = get_object_or_404(CartItem.objects.select_related("variant__product"), id = item_id, user = request.user)
     item.delete()
+    if item.variant.is_active and item.variant.product.is_active:
+        adjust_cart_count(request, -1)
     messages.success(request, "Item removed form cart")
     return redirect("cart")
 
-@user_required
-@require_POST
-def update_size(request, item_id):
-    try:
-        data = json.loads(request.body)
-        variant_id = data.get("variant_id")
-
-        cart_item = CartItem.objects.get(id = item_id, user=request.user)
-        new_variant = ProductVariant.objects.get(id=variant_id)
-
-        if new_variant.product != cart_item.variant.product:
-            return JsonResponse({"error": "Invalid size selection"}, status=400)
-        
-        if new_variant.stock <= 0:
-            return JsonResponse({"success":False, "error": "Selected size is out of stock"}, status=400)
-        
-        cart_item.variant = new_variant
-        # Reset quantity to 1 if new size has less stock than current quantity
-        if cart_item.quantity > new_variant.stock:
-            cart_item.quantity = new_variant.stock
-        cart_item.save()
-
-        cart_data = get_cart_data(request.user)
-
-        return JsonResponse({
-            "success": True,
-            "item_total": float(cart_item.variant.product.final_price * cart_item.quantity),
-            "cart_data": cart_data       
-        })
-
-    except CartItem.DoesNotExist:
-        return JsonResponse({"error": "cart item not found"}, status=404)
-    
-    except ProductVariant.DoesNotExist:
-        return JsonResponse({"error": "Variant not found"}, status=404)
-
-
-def get_cart_data(user):
-    cart_items = CartItem.objects.filter(user=user, variant__stock__gt=0, variant__is_active=True)
-
-    if cart_items.exists():
-        subtotal = sum(item.variant.product.final_price * item.quantity for item in cart_items)
-        gst = (subtotal * Decimal('0.18')).quantize(Decimal('0.01'))
-        delivery_charge = Decimal('0') if subtotal >= Decimal('1000') else Decimal('100')
-        grand_total = subtotal + gst + delivery_charge
-        total_items = sum(item.quantity for item in cart_items)
-    else:
-        subtotal = gst = delivery_charge = grand_total = Decimal('0')
-        total_items = 0
-
+def get_cart_data(request):
+    """Pre-coupon totals for the cart page's AJAX updates, read after the cart changed."""
+    totals = get_cart_snapshot(request, refresh=True).base_totals
     return {
-        "subtotal": subtotal,
-        "gst": gst,
-        "delivery_charge": delivery_charge,
-        "grand_total": grand_total,
-        "total_items": total_items
+        "subtotal": totals.subtotal,
+        "gst": totals.gst,
+        "delivery_charge": totals.delivery_charge,
+        "grand_total": totals.grand_total,
+        "total_items": totals.total_items
     }
 
 @user_required
@@ -505,13 +505,15 @@ def update_cart_quantity(request, item_id):
         else:
             new_qty = int(qty_param)
 
-        cart_item = CartItem.objects.get(id=item_id, user=request.user)
-        max_allowed = min(cart_item.variant.stock, 4)
+        cart_item = CartItem.objects.select_related("variant__product").get(id=item_id, user=request.user)
+        max_allowed = min(cart_item.variant.available_stock, 4)
 
         # --- REMOVE ITEM LOGIC ---
         if new_qty < 1: 
             cart_item.delete()
-            cart_data = get_cart_data(request.user) 
+            if cart_item.variant.is_active and cart_item.variant.product.is_active:
+                adjust_cart_count(request, -1)
+            cart_data = get_cart_data(request) 
             
             return JsonResponse({
                 "success": True, 
@@ -530,14 +532,15 @@ def update_cart_quantity(request, item_id):
         cart_item.quantity = new_qty
         cart_item.save()
         
-        cart_data = get_cart_data(request.user)
+        cart_data = get_cart_data(request)
 
         return JsonResponse({
             "success": True,
             "removed": False,
             # Keys now match JavaScript expectations
             "item_qty": cart_item.quantity,        
-            "item_total": float(cart_item.variant.product.final_price * cart_item.quantity), 
+            # priced from the snapshot get_cart_data just loaded
+            "item_total": float(get_cart_snapshot(request).get_item(cart_item.id).unit_price * cart_item.quantity), 
             "cart_totals": cart_data,                
         })
 
@@ -547,6 +550,116 @@ def update_cart_quantity(request, item_id):
     except Exception as e:
         return JsonResponse({"success": False, "error": str(e)}, status=500)
 
+def _cart_line_refused(request, item_id, quantity, variant=None):
+    """Why update_cart_line's conditional UPDATE or DELETE matched nothing, `variant` being the size asked for."""
+    item = CartItem.objects.select_related("variant__product").filter(id=item_id, user=request.user).first()
+    if item is None:
+        return JsonResponse({"success": False, "error": "Item not found"}, status=404)
+
+    # the line as it is now, so the page can show it again
+    current = {"success": False, "item_qty": item.quantity, "version": item.version, "variant_id": item.variant_id}
+    if variant is not None and variant.product_id != item.variant.product_id:
+        return JsonResponse({**current, "error": "Invalid size selection"}, status=400)
+    variant = variant or item.variant
+    if not (variant.is_active and item.variant.product.is_active):
+        return JsonResponse({**current, "error": "This product is not available"}, status=400)
+    if quantity > variant.available_stock:
+        return JsonResponse({**current, "error": f"Max quantity allowed is {min(variant.available_stock, MAX_LINE_QUANTITY)}"}, status=400)
+    return JsonResponse({**current, "error": "This item was changed elsewhere, please try again"}, status=409)
+
+
+@user_required
+@require_POST
+def update_cart_line(request, item_id):
+    """
+    Sets a cart line's quantity from {"quantity", "version"}, version being the one the
+    page last saw, and its size when "variant_id" is sent too. The change is a single
+    conditional UPDATE and the totals are adjusted in the cached cart summary, so a
+    click does not price the whole cart again.
+    """
+    try:
+        data = json.loads(request.body)
+        quantity = int(data["quantity"])
+        version = int(data["version"])
+    except (ValueError, TypeError, KeyError):
+        return JsonResponse({"success": False, "error": "quantity and version are required"}, status=400)
+
+    if quantity > MAX_LINE_QUANTITY:
+        return JsonResponse({"success": False, "error": f"Max quantity allowed is {MAX_LINE_QUANTITY}"}, status=400)
+
+    if data.get("variant_id") is not None:
+        return _change_line_size(request, item_id, quantity, version, data["variant_id"])
+
+    if quantity < 1:
+        item = CartItem.objects.select_related("variant__product").filter(
+            id=item_id, user=request.user, version=version
+        ).first()
+        if item is None:
+            return _cart_line_refused(request, item_id, quantity)
+
+        item.delete()
+        if item.variant.is_active and item.variant.product.is_active:
+            adjust_cart_count(request, -1)
+        return JsonResponse({
+            "success": True,
+            "removed": True,
+            "cart_totals": remember_cart_summary(request).totals.as_dict(),
+        })
+
+    updated = CartItem.objects.filter(
+        id=item_id,
+        user=request.user,
+        version=version,
+        variant__is_active=True,
+        variant__product__is_active=True,
+        variant__stock__gte=F("variant__reserved") + quantity,
+    ).update(quantity=quantity, version=F("version") + 1)
+    if not updated:
+        return _cart_line_refused(request, item_id, quantity)
+
+    summary = update_cart_summary(request, item_id, quantity)
+    return JsonResponse({
+        "success": True,
+        "removed": False,
+        "item_qty": quantity,
+        "version": version + 1,
+        "item_total": float(summary.line_total(item_id)),
+        "cart_totals": summary.totals.as_dict(),
+    })
+
+def _change_line_size(request, item_id, quantity, version, variant_id):
+    """update_cart_line for a new size: the quantity is cut to what the size has available."""
+    variant = ProductVariant.objects.filter(id=variant_id).first() if str(variant_id).isdigit() else None
+    if variant is None:
+        return JsonResponse({"success": False, "error": "Variant not found"}, status=404)
+    quantity = min(quantity, variant.available_stock)
+    if quantity < 1:
+        return JsonResponse({"success": False, "error": "Selected size is out of stock"}, status=400)
+
+    updated = CartItem.objects.filter(
+        Exists(ProductVariant.objects.filter(id=variant.id, is_active=True, stock__gte=F("reserved") + quantity)),
+        id=item_id,
+        user=request.user,
+        version=version,
+        variant__product_id=variant.product_id,
+        variant__product__is_active=True,
+    ).update(variant=variant, quantity=quantity, version=F("version") + 1)
+    if not updated:
+        return _cart_line_refused(request, item_id, quantity, variant)
+
+    # what the signals of a save() would do, the line holds another variant now
+    bump_user_state(request.user.pk)
+    invalidate_cart_summary(request.user.pk)
+    summary = remember_cart_summary(request)
+    return JsonResponse({
+        "success": True,
+        "removed": False,
+        "item_qty": quantity,
+        "version": version + 1,
+        "item_total": float(summary.line_total(item_id)),
+        "cart_totals": summary.totals.as_dict(),
+    })
+
 #wishlist
 @user_required
 def add_to_wishlist(request,  product_id):
@@ -565,6 +678,7 @@ def add_to_wishlist(request,  product_id):
             message = "Removed from wishlist"
         else:
             Wishlist.objects.create(user=request.user, product=product)
+            record_event(product.id, "wishlist_adds")
             added = True
             message = "Added to wishlist"
         
@@ -583,7 +697,9 @@ def wishlist_view(request):
     if not request.user.is_authenticated:
         return redirect("login")
     
-    wishlist_items = Wishlist.objects.filter(user=request.user).select_related('product')
+    wishlist_items = Wishlist.objects.filter(user=request.user).prefetch_related(
+        Prefetch('product', queryset=Product.objects.with_pricing())
+    )
 
     wishlist_total = sum(item.product.final_price for item in  wishlist_items)
 
@@ -607,7 +723,9 @@ def move_to_cart(request, item_id):
         messages.error(request, "No valid variant available")
         return redirect("wishlist")
     
-    CartItem.objects.get_or_create(user=request.user, variant=variant)
+    _, created = CartItem.objects.get_or_create(user=request.user, variant=variant)
+    if created and wishlist_item.product.is_active:
+        adjust_cart_count(request, 1)
     wishlist_item.delete()
     messages.success(request, "Moved to cart")
 
@@ -624,15 +742,20 @@ def move_all_to_cart(request):
         messages.warning(request, "Your wishlist is empty.")
         return redirect("wishlist")
     
+    added = 0
     for item in wishlist_items:
         product = item.product
         variant = product.variants.filter(is_active=True, stock__gt=0).first()
 
         if variant:
-            CartItem.objects.get_or_create(user=request.user, variant=variant)
+            _, created = CartItem.objects.get_or_create(user=request.user, variant=variant)
+            if created and product.is_active:
+                added += 1
 
         item.delete()
 
+    adjust_cart_count(request, added)
+
     messages.success(request, "All items moved to cart successfully")
     return redirect("cart")
 
@@ -656,113 +779,43 @@ def checkout_view(request):
         messages.error(request, "Please log in to proceed to checkout")
         return  redirect("login")
     
-    cart_items = CartItem.objects.filter(
-        user=request.user,
-        variant__is_active=True,
-        variant__product__is_active=True,
-    ).select_related('variant', 'variant__product')
+    snapshot = get_cart_snapshot(request)
 
-    if not cart_items.exists():
+    if not snapshot.listed_items:
         messages.error(request, "Your cart is empty!")
         return redirect("cart")
-    
-    out_of_stock_items = []
-    for item in cart_items:
-        if item.quantity > item.variant.stock:
-            out_of_stock_items.append(item.variant.product.name)
 
-    if out_of_stock_items:
+    if snapshot.has_stock_shortfall:
         messages.error(request,"Some items in your cart are out of stock. Please update your cart before checkout.")
         return redirect("cart")
 
     
     addresses = Address.objects.filter(user=request.user)
 
-    
-    subtotal = Decimal("0")
-
-    for item in cart_items:
-        final_price = item.variant.product.final_price
-        subtotal += final_price * item.quantity
-        
-    subtotal = subtotal.quantize(Decimal("0.01"))
-
-    discount_amount = Decimal("0")
-    coupon_code = request.session.get("applied_coupon")
-    applied_coupon = None
-
-    if coupon_code:
-        try:
-            applied_coupon = Coupon.objects.get(code=coupon_code, isActive=True)
-
-            today = timezone.localtime().date()
-            start_date = timezone.localtime(applied_coupon.validFrom).date()
-            end_date = timezone.localtime(applied_coupon.validTill).date()
-
-            if  not (start_date <= today <= end_date):
-                raise ValueError("Expired")
-            
-
-            if subtotal < applied_coupon.minCartValue:
-                messages.warning(request, f"Coupon removed.  Min cart value is ₹{applied_coupon.minCartValue}")
-                del request.session["applied_coupon"]
-                applied_coupon = None
-
-
-            elif applied_coupon.category:
-                has_category = any(
-                    item.variant.product.subcategory.id == applied_coupon.category.id 
-                    for item in cart_items if item.variant.product.subcategory
-                )
-                if not has_category:
-                    messages.warning(request, f"Coupon removed. Only valid for {applied_coupon.category.name}")
-                    del request.session["applied_coupon"]
-                    applied_coupon = None
-
-            if applied_coupon:
-                if applied_coupon.discountType == 'percent':
-                    discount_amount = (subtotal * applied_coupon.discountValue) / 100
-                else:
-                    discount_amount = applied_coupon.discountValue
-                
-                
-                if discount_amount > subtotal:
-                    discount_amount = subtotal 
-
-        except Coupon.DoesNotExist:
-            del request.session["applied_coupon"]
-        except Exception:
-            del request.session["applied_coupon"]      
-
-
-    taxable_amount = (subtotal - discount_amount).quantize(Decimal("0.01"))
-
-    gst = (taxable_amount * Decimal('0.18')).quantize(Decimal('0.01'))
-
-    delivery_charge = Decimal('0') if taxable_amount >= Decimal('1000') else Decimal('100')
-    
-    is_free_delivery = (delivery_charge == Decimal('0'))
-
-    grand_total = taxable_amount + gst + delivery_charge 
-
-    if grand_total < 0:
-        grand_total = Decimal("0.00")
+    coupon = snapshot.coupon
+    if snapshot.coupon_code and coupon is None:
+        if snapshot.coupon_problem == COUPON_MIN_CART_VALUE:
+            messages.warning(request, f"Coupon removed.  Min cart value is ₹{snapshot.requested_coupon.minCartValue}")
+        elif snapshot.coupon_problem == COUPON_CATEGORY:
+            messages.warning(request, f"Coupon removed. Only valid for {snapshot.requested_coupon.category.name}")
+        del request.session["applied_coupon"]
 
+    totals = snapshot.totals
     estimated_delivery_date = (now() + timedelta(days=5)).strftime("%d %b %Y")
 
 
     context = {
         'addresses': addresses,
-        'cart_items': cart_items,
-        'subtotal': subtotal,
-        'gst': gst,
-        'delivery_charge': delivery_charge,
-        'discount_amount': discount_amount.quantize(Decimal("0.01")),
-        'grand_total': grand_total.quantize(Decimal("0.01")),
-        'total_items': sum(item.quantity for item in cart_items),
+        'cart_items': snapshot.in_stock_items,
+        'subtotal': totals.subtotal,
+        'gst': totals.gst,
+        'delivery_charge': totals.delivery_charge,
+        'discount_amount': totals.discount_amount,
+        'grand_total': totals.grand_total,
+        'total_items': totals.total_items,
         'estimated_delivery_date': estimated_delivery_date,
-        'is_free_delivery': is_free_delivery,
-        'applied_coupon': coupon_code if applied_coupon else None,
+        'is_free_delivery': totals.is_free_delivery,
+        'applied_coupon': coupon.code if coupon else None,
 
 
     }
@@ -777,64 +830,32 @@ def payment_view(request, address_id):
     
     address = get_object_or_404(Address, id=address_id, user=request.user)
 
-    data = get_cart_totals(request.user)
-    if not data:
+    snapshot = get_cart_snapshot(request)
+    if snapshot.is_empty:
         messages.error(request, "Your cart is empty")
         return redirect("cart")
 
-
-    subtotal = data['subtotal']
-    
-    
-
-
-    discount_amount = Decimal("0")
-    coupon_code = request.session.get("applied_coupon")
-
-    if coupon_code:
-        try:
-            coupon = Coupon.objects.get(code=coupon_code, isActive=True)
-            today  = timezone.localtime().date()
-            if coupon.validFrom.date() <= today <= coupon.validTill.date():
-                if subtotal >= coupon.minCartValue:
-                    if coupon.discountType == 'percent':
-                        discount_amount = (subtotal * coupon.discountValue) / 100
-                    else:
-                        discount_amount = coupon.discountValue
-                    
-                    if discount_amount > subtotal:
-                        discount_amount = subtotal
-        except Coupon.DoesNotExist:
-            pass
-
-    discount_amount = discount_amount.quantize(Decimal("0.01"))
-    
-    taxable_amount = (subtotal - discount_amount).quantize(Decimal("0.01"))
-    gst = (taxable_amount * Decimal("0.18")).quantize(Decimal("0.01"))
-    delivery_charge = Decimal('0') if taxable_amount >= Decimal('1000') else Decimal('100')
-    grand_total = taxable_amount + gst + delivery_charge
-
-    if grand_total < 0:
-        grand_total = Decimal("0.00")
+    totals = snapshot.totals
+    grand_total = totals.grand_total
 
     # wallet
     wallet,_ = Wallet.objects.get_or_create(user=request.user)
     wallet_balance = wallet.balance
 
-    client = razorpay.Client(auth=(settings.RAZORPAY_KEY_ID, settings.RAZORPAY_KEY_SECRET))
-    razorpay_order = client.order.create({
-        "amount":int(grand_total * 100),
-        "currency" :"INR",
-        "payment_capture":1,
-    })
+    # created here so placing the order finds it ready, reloads reuse it
+    try:
+        razorpay_order = _cart_payment_intent(request.user, snapshot).order
+    except GatewayError as e:
+        logger.error("Razorpay order creation failed: %s", e)
+        razorpay_order = {"id": None}
 
     context = {
         'address': address,
-        'cart_items': data['cart_items'],
-        'subtotal': subtotal,
-        'gst': gst,
-        'delivery_charge': delivery_charge,
-        'discount_amount': discount_amount,
+        'cart_items': snapshot.in_stock_items,
+        'subtotal': totals.subtotal,
+        'gst': totals.gst,
+        'delivery_charge': totals.delivery_charge,
+        'discount_amount': totals.discount_amount,
         'grand_total': grand_total,
         'wallet_balance' : wallet_balance,
 
@@ -848,6 +869,17 @@ def payment_view(request, address_id):
 
 
 
+def _cart_payment_intent(user, snapshot):
+    """The gateway order for paying this exact cart, shared by the payment page and place_order."""
+    return get_payment_intent(
+        user,
+        snapshot.totals.grand_total,
+        "order_payment",
+        lines=[(item.variant_id, item.quantity, str(item.unit_price)) for item in snapshot.in_stock_items],
+        coupon_code=snapshot.coupon.code if snapshot.coupon else None,
+    )
+
+
 @user_required
 def place_order(request):
     if request.method != "POST":
@@ -862,75 +894,55 @@ def place_order(request):
 
     address = get_object_or_404(Address, id=address_id, user=request.user)
 
-    data = get_cart_totals(request.user)
-    if not data:
+    snapshot = get_cart_snapshot(request)
+    if snapshot.is_empty:
         messages.error(request, "Your cart is empty")
         return redirect("cart")
 
-    cart_items = data['cart_items']
-    subtotal = data['subtotal']
-    
-
-    if not cart_items.exists():
-        messages.error(request, "Your cart is empty")
+    cart_lines = snapshot.in_stock_items
+    totals = snapshot.totals
+    applied_coupon = snapshot.coupon
+    subtotal = totals.subtotal
+    discount_amount = totals.discount_amount
+    gst = totals.gst
+    delivery_charge = totals.delivery_charge
+    grand_total = totals.grand_total
+
+    # an earlier attempt this customer abandoned must not hold stock against this one
+    release_user_holds(request.user)
+
+    # flash sale: a hot variant's stock is only handed out by its admission queue
+    tickets = admit(request.user, cart_lines)
+    if any(ticket.status == AdmissionTicket.SOLD_OUT for ticket in tickets):
+        messages.error(request, "Sorry, the flash sale sold out before your turn came")
         return redirect("cart")
-
-    # COUPON LOGIC 
-    discount_amount = Decimal("0")
-    coupon_code = request.session.get("applied_coupon")
-    applied_coupon = None
-
-    if coupon_code:
-        try:
-            coupon = Coupon.objects.get(code=coupon_code, isActive=True)
-            today = timezone.localtime().date()
-
-            if coupon.validFrom.date() <= today <= coupon.validTill.date():
-                if subtotal >= coupon.minCartValue:
-                    if coupon.discountType == "percent":
-                        discount_amount = (subtotal * coupon.discountValue) / 100
-                    else:
-                        discount_amount = coupon.discountValue
-
-                    if discount_amount > subtotal:
-                        discount_amount = subtotal
-
-                    applied_coupon = coupon
-        except Coupon.DoesNotExist:
-            pass
-    
-    discount_amount = discount_amount.quantize(Decimal("0.01"))
-    
-    taxable_amount = (subtotal - discount_amount).quantize(Decimal("0.01"))
-
-    gst = (taxable_amount * Decimal("0.18")).quantize(Decimal("0.01"))
-
-    delivery_charge = Decimal('0') if taxable_amount >= Decimal('1000') else Decimal('100')
-
-    grand_total = taxable_amount + gst + delivery_charge
-
-    if grand_total < 0:
-        grand_total = Decimal("0.00")
+    if any(ticket.status == AdmissionTicket.QUEUED for ticket in tickets):
+        return render(request, "shop/admission_wait.html", {
+            "tickets": tickets,
+            "address_id": address_id,
+            "payment_method": payment_method,
+        })
 
     # RAZORPAY FLOW 
     if payment_method == "razorpay":
-        client = razorpay.Client(auth=(settings.RAZORPAY_KEY_ID, settings.RAZORPAY_KEY_SECRET))
-        razorpay_order = client.order.create({
-            "amount": int(grand_total * 100),
-            "currency": "INR",
-            "payment_capture": 1,
-        })
+        try:
+            intent = _cart_payment_intent(request.user, snapshot)
+        except GatewayError as e:
+            logger.error("Razorpay order creation failed: %s", e)
+            messages.error(request, "Could not reach the payment gateway. Please try again.")
+            return redirect("payment", address_id=address_id)
 
-        payment = Payment.objects.create(
-            user=request.user,
-            amount=grand_total,
-            purpose="order_payment",
-            razorpay_order_id=razorpay_order['id'],
-            status="pending",
-        )
+        # the stock is held before the customer pays, and released by the sweeper if they never do
+        try:
+            with transaction.atomic():
+                payment = Payment.objects.get(id=intent.payment_id)
+                place_holds(payment, attach_admissions(payment, cart_lines))
+        except StockShortage as shortage:
+            messages.error(request, f"{shortage} is out of stock")
+            return redirect("checkout")
 
         return render(request, "shop/razorpay_payment.html", {
-            "razorpay_order": razorpay_order,
+            "razorpay_order": intent.order,
             "razorpay_key": settings.RAZORPAY_KEY_ID,
             "payment": payment,
             "amount": grand_total,
@@ -938,24 +950,23 @@ def place_order(request):
         })
 
    
+    if payment_method == "cod":
+        if grand_total >= 5000:
+            messages.error(
+                request,
+                "Cash on Delivery is available only for orders below ₹5000."
+            )
+            return redirect("payment", address_id=address_id)
+
+    elif payment_method != "wallet":
+        messages.error(request, "Invalid payment option")
+        return redirect("payment", address_id=address_id)
+
+    # everything below runs in a constant number of queries, whatever the cart size,
+    # so the variant rows locked by decrement_stock are held only briefly
     try:
         with transaction.atomic():
 
-           
-            variant_ids = cart_items.values_list("variant_id", flat=True)
-            variants = ProductVariant.objects.select_for_update().filter(id__in=variant_ids)
-            variant_map = {v.id: v for v in variants}
-
-       
-            for item in cart_items:
-                variant = variant_map[item.variant_id]
-                if variant.stock < item.quantity:
-                    messages.error(
-                        request,
-                        f"{variant.product.name} is out of stock"
-                    )
-                    return redirect("checkout")
-
             payment_status = "PENDING"
 
             # WALLET LOGIC 
@@ -963,37 +974,26 @@ def place_order(request):
                 wallet, _ = Wallet.objects.get_or_create(user=request.user)
                 wallet = Wallet.objects.select_for_update().get(user=request.user)
 
-                if wallet.balance >= grand_total:
-                    balance_before = wallet.balance
-                    wallet.balance -= grand_total
-                    wallet.save()
-
-                    WalletTransaction.objects.create(
-                        wallet=wallet,
-                        amount=grand_total,
-                        transaction_type="debit",
-                        description="Order Payment from Wallet",
-                        balance_before=balance_before,
-                        balance_after=wallet.balance
-                    )
-                    payment_status = "SUCCESS"
-                else:
+                if wallet.balance < grand_total:
                     messages.error(request, "Insufficient wallet balance")
                     return redirect("payment", address_id=address_id)
 
-            elif payment_method == "cod":
-                if grand_total < 5000:
-                    payment_status = "PENDING"
-                else:
-                    messages.error(
-                        request,
-                        "Cash on Delivery is available only for orders below ₹5000."
-                    )
-                    return redirect("payment", address_id=address_id)
+            decrement_stock(convert_holds(user_admissions(request.user), cart_lines))
 
-            else:
-                messages.error(request, "Invalid payment option")
-                return redirect("payment", address_id=address_id)
+            if payment_method == "wallet":
+                balance_before = wallet.balance
+                wallet.balance -= grand_total
+                wallet.save()
+
+                WalletTransaction.objects.create(
+                    wallet=wallet,
+                    amount=grand_total,
+                    transaction_type="debit",
+                    description="Order Payment from Wallet",
+                    balance_before=balance_before,
+                    balance_after=wallet.balance
+                )
+                payment_status = "SUCCESS"
 
             #  CREATE ORDER -
             order = Order.objects.create(
@@ -1009,30 +1009,46 @@ def place_order(request):
                 status="Processing" if payment_status == "SUCCESS" else "Pending",
             )
 
-            #ORDER ITEMS + STOCK DEDUCTION
-            for item in cart_items:
-                variant = variant_map[item.variant_id]
+            create_order_items(order, cart_lines)
 
-                OrderItem.objects.create(
-                    order=order,
-                    variant=variant,
-                    quantity=item.quantity,
-                    price=item.variant.product.final_price,
-                )
-
-                variant.stock -= item.quantity
-                variant.save()
-
-            cart_items.delete()
+            # only listed items are ordered, the same ones the badge counts
+            deleted, _ = CartItem.objects.filter(id__in=[item.id for item in cart_lines]).delete()
+            adjust_cart_count(request, -deleted)
 
             return redirect('order_success', order_id=order.id)
 
+    except StockShortage as shortage:
+        messages.error(request, f"{shortage} is out of stock")
+        return redirect("checkout")
+
     except Exception as e:
         print("Order Error:", e)
         messages.error(request, "An error occurred. Please try again.")
         return redirect('checkout')
 
 
+@user_required
+def admission_ticket_status(request, ticket_id):
+    """Polled by the flash-sale waiting page until the ticket is decided."""
+    queue = get_admission_queue()
+    ticket = queue.get(ticket_id, request.user.pk)
+    if ticket is None:
+        return JsonResponse({"status": "error", "message": "Ticket not found"}, status=404)
+
+    if ticket.status == AdmissionTicket.QUEUED:
+        # every waiting buyer helps, whoever holds the variant's lock decides the next batch
+        queue.pump(ticket.variant_id)
+        ticket = queue.get(ticket_id, request.user.pk)
+
+    if ticket.status == AdmissionTicket.SOLD_OUT:
+        messages.error(request, "Sorry, the flash sale sold out before your turn came")
+
+    return JsonResponse({
+        "status": ticket.status,
+        "position": queue.position(ticket) if ticket.status == AdmissionTicket.QUEUED else 0,
+    })
+
+
 @csrf_exempt
 @user_required
 def razorpay_payment_verify(request):
@@ -1041,14 +1057,8 @@ def razorpay_payment_verify(request):
     signature = request.GET.get("signature")
     address_id = request.GET.get("address_id")
 
-    client = razorpay.Client(auth=(settings.RAZORPAY_KEY_ID, settings.RAZORPAY_KEY_SECRET))
-
     try:
-        client.utility.verify_payment_signature({
-            "razorpay_order_id": order_id,
-            "razorpay_payment_id": payment_id,
-            "razorpay_signature": signature,
-        })
+        confirm_payment(order_id, payment_id, signature)
 
         with transaction.atomic():
 
@@ -1057,51 +1067,23 @@ def razorpay_payment_verify(request):
             payment.status = "SUCCESS"
             payment.razorpay_payment_id = payment_id
             payment.save()
+            forget_payment_intent(payment)
 
             address = get_object_or_404(Address, id=address_id, user=request.user)
 
-            # Cart items
-            data = get_cart_totals(request.user)
-            cart_items = data['cart_items']
-
-       
-            if not cart_items.exists():
+            snapshot = get_cart_snapshot(request)
+            if snapshot.is_empty:
                 messages.error(request, "Your cart is empty")
                 return redirect("cart")
-        
-            # Price calculation
-            
-            subtotal = data["subtotal"]
-            
-
-            discount_amount = Decimal("0")
-            coupon_code = request.session.get("applied_coupon")
-            applied_coupon = None
-
-            if coupon_code:
-                try:
-                    coupon = Coupon.objects.get(code=coupon_code)
-
-                    if coupon.discountType == "percent":
-                        discount_amount = (subtotal * coupon.discountValue) / 100
-                    else:
-                        discount_amount  = coupon.discountValue
-
-                    if discount_amount > subtotal:
-                        discount_amount = subtotal
-                    applied_coupon = coupon
 
-                except:
-                    pass
-                    
-            discount_amount = discount_amount.quantize(Decimal("0.01"))
-
-            taxable_amount = (subtotal - discount_amount).quantize(Decimal("0.01"))
-            gst = (taxable_amount * Decimal("0.18")).quantize(Decimal("0.01"))
-
-            delivery_charge = delivery_charge = Decimal('0') if taxable_amount >= Decimal('1000') else Decimal('100')
-
-            grand_total = taxable_amount + gst + delivery_charge
+            cart_lines = snapshot.in_stock_items
+            totals = snapshot.totals
+            applied_coupon = snapshot.coupon
+            subtotal = totals.subtotal
+            discount_amount = totals.discount_amount
+            gst = totals.gst
+            delivery_charge = totals.delivery_charge
+            grand_total = totals.grand_total
 
             order = Order.objects.create(
                 user=request.user,
@@ -1118,28 +1100,35 @@ def razorpay_payment_verify(request):
                 status='Processing'
             )
 
-            # Create Order Items & reduce stock
-            for item in cart_items:
-                
-                OrderItem.objects.create(
-                    order=order,
-                    variant=item.variant,
-                    quantity=item.quantity,
-                    price=item.variant.product.final_price,
-                )
-                item.variant.stock -= item.quantity
-                item.variant.save()
+            # Create Order Items & reduce stock, from the holds placed before payment where they still cover the lines
+            decrement_stock(convert_holds(payment.stock_holds.all(), cart_lines))
+            create_order_items(order, cart_lines)
 
             # Clear cart after ordering
-            cart_items.delete()
+            # only listed items are ordered, the same ones the badge counts
+            deleted, _ = CartItem.objects.filter(id__in=[item.id for item in cart_lines]).delete()
+            adjust_cart_count(request, -deleted)
 
         return redirect('order_success', order_id=order.id)
 
 
-    except razorpay.errors.SignatureVerificationError:
+    except StockShortage as shortage:
+        # the payment stays pending, its record is what support refunds from
+        payment = Payment.objects.filter(razorpay_order_id=order_id).first()
+        if payment:
+            # its order is paid, reloading the payment page must not offer it again
+            forget_payment_intent(payment)
+        messages.error(request, f"{shortage} sold out before your payment was confirmed. Please contact support for a refund.")
+        return redirect("cart")
+
+    except (SignatureError, OrderNotPaid):
         payment = Payment.objects.filter(razorpay_order_id=order_id).first()
         messages.error(request, "Payment verification failed.")
         return redirect('payment_failed', order_id=payment.id if payment else 0)
+    except GatewayError:
+        # nothing was written, the same link confirms the payment once the gateway answers
+        messages.error(request, "We could not confirm your payment with the gateway. Please try again in a moment.")
+        return redirect("cart")
     except Exception as e:
         messages.error(request, "An error occurred during order creation.")
         print(e)
@@ -1203,11 +1192,14 @@ def razorpay_payment_failed(request):
     error_description = request.GET.get('description')
     address_id = request.GET.get('address_id')
 
-    payment = Payment.objects.filter(razorpay_order_id=order_id).first()
+    # only the payer's own payment, failing it releases the stock it holds
+    payment = Payment.objects.filter(razorpay_order_id=order_id, user=request.user).first()
     
     if payment:
         payment.status = "FAILED"
         payment.save()
+        forget_payment_intent(payment)
+        release_holds(payment.stock_holds.all())
 
     return render(request, "shop/order_failed.html", {
         "payment": payment,
@@ -1481,11 +1473,7 @@ def submit_return_request(request, order_id):
 def submit_review(request, product_id):
     product = get_object_or_404(Product, id=product_id)
 
-    has_purchased  = OrderItem.objects.filter(
-        order__user = request.user,
-        order__status = 'Delivered',
-        variant__product = product
-    ).exists()
+    has_purchased = product.id in get_user_state(request).purchased_product_ids
 
     if  not has_purchased:
         messages.error(request,  "You can only review products you have purchased")
@@ -1501,19 +1489,24 @@ def submit_review(request, product_id):
             messages.error(request, "Please select a star rating")
             return redirect(request.path)
         
+        # the review and its ProductStats delta are saved together
+        with transaction.atomic():
+            if existing_review:
+                existing_review.rating = rating
+                existing_review.comment = comment
+                existing_review.save()
+            else:
+                ProductReview.objects.create(
+                    product=product,
+                    user = request.user,
+                    rating = rating,
+                    comment =  comment,
+
+                )
+
         if existing_review:
-            existing_review.rating = rating
-            existing_review.comment = comment
-            existing_review.save()
             messages.success(request, "Your review has been updated!")
         else:
-            ProductReview.objects.create(
-                product=product,
-                user = request.user,
-                rating = rating,
-                comment =  comment,
-
-            )
             messages.success(request, "Thank you for your review!")
 
         return redirect(request.META.get('HTTP_REFERER', '/'))
@@ -1526,7 +1519,6 @@ def submit_review(request, product_id):
     return render(request, 'shop/submit_review.html', context)
 
 
-from django.utils import timezone
 from datetime import datetime
 
 @user_required
@@ -1546,37 +1538,25 @@ def apply_coupon(request):
         messages.error(request, "Invalid or inactive coupon")
         return redirect("checkout")
     
-    today =  timezone.localtime().date()
-    start_date = timezone.localtime(coupon.validFrom).date()
-    end_date = timezone.localtime(coupon.validTill).date()
+    snapshot = get_cart_snapshot(request)
+    problem = snapshot.check_coupon(coupon)
 
-    
-    if not (start_date <= today <= end_date):
+    if problem == COUPON_EXPIRED:
         messages.error(request, "This coupon is expired or not yet active.")
         return redirect("checkout")
     
 
-    cart_items = request.user.cart_items.select_related("variant", "variant__product")
-    if not cart_items:
+    if snapshot.is_empty:
         messages.error(request, "Your cart is empty. Add items  before  applying a coupon.")
         return redirect("checkout")
-    
-    cart_total = sum(item.total_price for item in cart_items)
 
-    if cart_total < coupon.minCartValue:
+    if problem == COUPON_MIN_CART_VALUE:
         messages.error(request, f"Minimum cart  value must be ₹{coupon.minCartValue} to use this coupon.")
         return redirect("checkout")
 
-    if coupon.category:
-        allowed = any(
-            item.variant.product.subcategory and
-            item.variant.product.subcategory.id == coupon.category.id
-            for item in cart_items
-        )
-
-        if not allowed:
-            messages.error(request, "This coupon is not valid for the product in your cart.")
-            return redirect("checkout")
+    if problem == COUPON_CATEGORY:
+        messages.error(request, "This coupon is not valid for the product in your cart.")
+        return redirect("checkout")
 
     usage, created = CouponUsage.objects.get_or_create(
         user = request.user,
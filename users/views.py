@@ -24,6 +24,8 @@ from shop.models import Order, ReturnRequest
 import logging
 
 from shop.utils import generate_invoice
+from shop.page_cache import page_cache, tag_page, tag_products
+from shop.personalization import recommended_products
 from django.http import HttpResponse
 import json
 
@@ -408,17 +410,20 @@ def reset_password_view(request, uidb64, token):
 
 
 
+@page_cache
 def home_view(request):
 
     banners = Banner.objects.filter(is_active = True).order_by('order')
 
-    p1 = Product.objects.get(id=9)
-    p2 = Product.objects.get(id=15)
-    p3 = Product.objects.get(id=11)
-    p4 = Product.objects.get(id=18)
+    # best sellers for visitors, personal picks once we know the user
+    products = recommended_products(request.user, limit=4)
+
+    tag_page(request, "banners")
+    tag_products(request, products)
 
     context = {
-        "p1":p1,"p2":p2,"p3":p3,"p4":p4,
+        "products": products,
+        "personalized": request.user.is_authenticated,
         "banners" : banners
         }
 
@@ -1,12 +1,12 @@
 from django.shortcuts import render, get_object_or_404, redirect
 from users.decorator import user_required
 from .models import Wallet, WalletTransaction
-import razorpay
 from decimal import Decimal
 from django.conf import settings
 from django.views.decorators.csrf import csrf_exempt
 from django.contrib import messages
 from .utils import credit_wallet
+from payments.gateway import GatewayError, OrderNotPaid, SignatureError, confirm_payment, get_gateway
 from payments.models import Payment
 from django.core.paginator import Paginator
 # Create your views here.
@@ -31,9 +31,6 @@ def wallet_view(request):
     return render(request, 'wallet.html', context)
 
 
-def get_razorpay_client():
-    return razorpay.Client(auth=(settings.RAZORPAY_KEY_ID, settings.RAZORPAY_KEY_SECRET))
-
 @user_required
 def wallet_add_money_view(request):
     if request.method == "POST":
@@ -50,15 +47,13 @@ def wallet_add_money_view(request):
             purpose = "wallet_topup",
         )
 
-        client = get_razorpay_client()
-        order_data = {
-            "amount" : int(amount * 100),
-            "currency" : "INR",
-            "receipt" : f"wallet_{payment.id}",
-            "payment_capture" : 1,
-        }
-
-        order = client.order.create(order_data)
+        try:
+            order = get_gateway().create_order(int(amount * 100), "INR", receipt=f"wallet_{payment.id}")
+        except GatewayError:
+            payment.status = "FAILED"
+            payment.save()
+            messages.error(request, "Could not reach the payment gateway. Please try again.")
+            return redirect('wallet')
 
         payment.razorpay_order_id = order['id']
         payment.save()
@@ -86,17 +81,9 @@ def wallet_payment_success_view(request):
         messages.error(request, "Invalid payment details.")
         return redirect("wallet")
     
-    client = get_razorpay_client()
-
-    params_dict = {
-        "razorpay_order_id": order_id,
-        "razorpay_payment_id": payment_id,
-        "razorpay_signature": signature,
-    }
-
     try:
-        # Razorpay signature verification
-        client.utility.verify_payment_signature(params_dict)
+        # Razorpay signature verification, and the order is paid
+        confirm_payment(order_id, payment_id, signature)
 
         # Fetch payment from DB
         payment = Payment.objects.get(razorpay_order_id=order_id, user=request.user)
@@ -116,9 +103,12 @@ def wallet_payment_success_view(request):
         messages.success(request, f"₹{payment.amount} added to wallet successfully!")
         return redirect("wallet")
 
-    except razorpay.errors.SignatureVerificationError:
+    except (SignatureError, OrderNotPaid):
         messages.error(request, "Payment verification failed.")
         return redirect("wallet")
+    except GatewayError:
+        messages.error(request, "We could not confirm your payment with the gateway. Please try again in a moment.")
+        return redirect("wallet")
     
 
 @user_required